@@ -6,6 +6,7 @@ from fastapi.responses import JSONResponse, Response
 from typing import List, Optional, Dict, Any, Literal
 import json
 from datetime import datetime
+from urllib.parse import unquote
 from pydantic import BaseModel, Field
 import google.generativeai as genai
 import asyncio
@@ -97,6 +98,58 @@ class WikiExportRequest(BaseModel):
     pages: List[WikiPage] = Field(..., description="List of wiki pages to export")
     format: Literal["markdown", "json"] = Field(..., description="Export format (markdown or json)")
 
+class BatchRetrievalRequest(BaseModel):
+    """
+    Model for retrieving documents for several queries against one or more repositories.
+    """
+    repo_url: str = Field(..., description="URL or local path of the repository")
+    repo_urls: Optional[List[str]] = Field(None, description="Additional repositories searched together with repo_url")
+    workspace: Optional[str] = Field(None, description="Saved workspace whose repositories are searched together with repo_url")
+    queries: List[str] = Field(..., description="Queries to retrieve documents for, e.g. one per wiki page")
+    top_k: Optional[int] = Field(None, description="Number of documents per query (defaults to retriever.top_k)")
+    token: Optional[str] = Field(None, description="Personal access token for private repositories")
+    type: Optional[str] = Field("github", description="Type of repository (e.g., 'github', 'gitlab', 'bitbucket')")
+    provider: str = Field("google", description="Model provider; 'ollama' selects the Ollama embedder")
+    excluded_dirs: Optional[str] = Field(None, description="Newline-separated list of directories to exclude from processing")
+    excluded_files: Optional[str] = Field(None, description="Newline-separated list of file patterns to exclude from processing")
+    path_prefixes: Optional[List[str]] = Field(None, description="Only retrieve from files under these paths")
+    is_code: Optional[bool] = Field(None, description="Only code files (true) or only documentation files (false)")
+    is_implementation: Optional[bool] = Field(None, description="Only implementation files (true) or only tests (false)")
+    file_types: Optional[List[str]] = Field(None, description="Only files with these extensions, e.g. ['py', 'ts']")
+
+class RefreshIndexRequest(BaseModel):
+    """
+    Model for bringing a repository's index up to date with its latest commits.
+    """
+    repo_url: str = Field(..., description="URL or local path of the repository")
+    token: Optional[str] = Field(None, description="Personal access token for private repositories")
+    type: Optional[str] = Field("github", description="Type of repository (e.g., 'github', 'gitlab', 'bitbucket')")
+    provider: str = Field("google", description="Model provider; 'ollama' selects the Ollama embedder")
+
+class RefreshIndexResult(BaseModel):
+    """
+    Model for the state of a repository's index after a refresh.
+    """
+    repo_url: str
+    commit: Optional[str] = None
+    documents: int
+
+class RetrievedDocument(BaseModel):
+    """
+    Model for one retrieved chunk.
+    """
+    file_path: str
+    text: str
+    score: Optional[float] = None
+    repo_url: Optional[str] = None
+
+class BatchRetrievalResult(BaseModel):
+    """
+    Model for the documents retrieved for one query.
+    """
+    query: str
+    documents: List[RetrievedDocument]
+
 # --- Model Configuration Models ---
 class Model(BaseModel):
     """
@@ -353,6 +406,197 @@ from api.simple_chat import chat_completions_stream
 # Add the chat_completions_stream endpoint to the main app
 app.add_api_route("/chat/completions/stream", chat_completions_stream, methods=["POST"])
 
+from api.retriever_cache import retriever_cache
+
+@app.get("/api/retriever_cache/stats")
+async def get_retriever_cache_stats():
+    """
+    Returns hit/miss counters and memory usage of the in-process retriever cache.
+    """
+    return retriever_cache.stats()
+
+from api.embedding_cache import chunk_embedding_cache, query_embedding_cache
+
+@app.get("/api/query_embedding_cache/stats")
+async def get_query_embedding_cache_stats():
+    """
+    Returns hit/miss counters of the query embedding cache.
+    """
+    return query_embedding_cache.stats()
+
+@app.get("/api/chunk_embedding_cache/stats")
+async def get_chunk_embedding_cache_stats():
+    """
+    Returns hit/miss counters and the size of the chunk embedding cache.
+    """
+    # Waits for the cache lock, which ingestion may hold, so keep it off the event loop
+    return await asyncio.to_thread(chunk_embedding_cache.stats)
+
+from api.chunk_filter import ChunkFilter
+from api.rag import RAG, format_server_timing
+from api.workspace import (
+    FederatedRetriever,
+    Workspace,
+    delete_workspace,
+    get_workspace,
+    list_workspaces,
+    resolve_repos,
+    save_workspace,
+)
+
+@app.post("/api/retrieve/batch", response_model=List[BatchRetrievalResult])
+async def retrieve_batch(request: BatchRetrievalRequest, response: Response):
+    """
+    Retrieves documents for several queries with one embedding call and one index search.
+
+    Single-repository requests report their retrieval stages in the `Server-Timing` header.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="No queries provided")
+
+    excluded_dirs = [unquote(d) for d in request.excluded_dirs.split('\n') if d.strip()] if request.excluded_dirs else None
+    excluded_files = [unquote(f) for f in request.excluded_files.split('\n') if f.strip()] if request.excluded_files else None
+    chunk_filter = ChunkFilter.create(
+        path_prefixes=request.path_prefixes,
+        excluded_dirs=excluded_dirs,
+        excluded_files=excluded_files,
+        is_code=request.is_code,
+        is_implementation=request.is_implementation,
+        file_types=request.file_types,
+    )
+
+    try:
+        repos = resolve_repos(request.repo_url, request.type, request.repo_urls, request.workspace)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if len(repos) > 1:
+        def run_federated():
+            retriever = FederatedRetriever(provider=request.provider)
+            retriever.prepare(repos, request.token, chunk_filter=chunk_filter, token_type=request.type)
+            return retriever.retrieve_batch(request.queries, top_k=request.top_k), retriever.timings
+
+        try:
+            federated_hits, timings = await asyncio.to_thread(run_federated)
+        except Exception as e:
+            logger.error(f"Error in federated batch retrieval: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error in batch retrieval: {str(e)}")
+        if timings:
+            response.headers["Server-Timing"] = format_server_timing(timings)
+
+        return [
+            BatchRetrievalResult(
+                query=query,
+                documents=[
+                    RetrievedDocument(
+                        file_path=hit.document.meta_data.get("file_path", "unknown"),
+                        text=hit.document.text,
+                        score=hit.score,
+                        repo_url=hit.repo_url,
+                    )
+                    for hit in hits
+                ],
+            )
+            for query, hits in zip(request.queries, federated_hits)
+        ]
+
+    def run_batch():
+        rag = RAG(provider=request.provider)
+        rag.prepare_retriever(request.repo_url, request.type, request.token, chunk_filter=chunk_filter)
+        return rag.batch_call(request.queries, top_k=request.top_k), rag.timings
+
+    try:
+        # Retrieval is blocking (index loading, embedding call), keep it off the event loop
+        outputs, timings = await asyncio.to_thread(run_batch)
+    except Exception as e:
+        logger.error(f"Error in batch retrieval for {request.repo_url}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error in batch retrieval: {str(e)}")
+    if timings:
+        response.headers["Server-Timing"] = format_server_timing(timings)
+
+    return [
+        BatchRetrievalResult(
+            query=query,
+            documents=[
+                RetrievedDocument(
+                    file_path=doc.meta_data.get("file_path", "unknown"),
+                    text=doc.text,
+                    score=score,
+                    repo_url=request.repo_url,
+                )
+                for doc, score in zip(output.documents, output.doc_scores or [None] * len(output.documents))
+            ],
+        )
+        for query, output in zip(request.queries, outputs)
+    ]
+
+@app.post("/api/index/refresh", response_model=RefreshIndexResult)
+async def refresh_index(request: RefreshIndexRequest):
+    """
+    Pulls new commits into a repository and re-embeds only the files changed since its index was built.
+    """
+    def run_refresh():
+        rag = RAG(provider=request.provider)
+        rag.prepare_retriever(request.repo_url, request.type, request.token, refresh=True)
+        return rag.transformed_docs
+
+    try:
+        store = await asyncio.to_thread(run_refresh)
+    except Exception as e:
+        logger.error(f"Error refreshing index for {request.repo_url}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error refreshing index: {str(e)}")
+    return RefreshIndexResult(repo_url=request.repo_url, commit=getattr(store, "commit", None), documents=len(store))
+
+@app.get("/api/workspaces", response_model=List[Workspace])
+async def get_workspaces():
+    """
+    Lists the saved workspaces.
+    """
+    return list_workspaces()
+
+@app.get("/api/workspaces/{name}", response_model=Workspace)
+async def get_workspace_by_name(name: str):
+    """
+    Returns one saved workspace.
+    """
+    try:
+        workspace = get_workspace(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if workspace is None:
+        raise HTTPException(status_code=404, detail=f"Workspace not found: {name}")
+    return workspace
+
+@app.put("/api/workspaces/{name}", response_model=Workspace)
+async def put_workspace(name: str, workspace: Workspace):
+    """
+    Saves a workspace under the given name, replacing an existing one.
+    """
+    if not workspace.repos:
+        raise HTTPException(status_code=400, detail="A workspace needs at least one repository")
+    workspace = workspace.model_copy(update={"name": name})
+    try:
+        save_workspace(workspace)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except OSError as e:
+        logger.error(f"Error saving workspace {name}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error saving workspace: {str(e)}")
+    return workspace
+
+@app.delete("/api/workspaces/{name}")
+async def delete_workspace_by_name(name: str):
+    """
+    Deletes a saved workspace.
+    """
+    try:
+        deleted = delete_workspace(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail=f"Workspace not found: {name}")
+    return {"message": f"Workspace {name} deleted"}
+
 # --- Wiki Cache Helper Functions ---
 
 WIKI_CACHE_DIR = os.path.join(get_adalflow_default_root_path(), "wikicache")
@@ -494,6 +738,16 @@ async def root():
             ],
             "LocalRepo": [
                 "GET /local_repo/structure - Get structure of a local repository (with path parameter)",
+            ],
+            "Retrieval": [
+                "GET /api/retriever_cache/stats - Retriever cache hit/miss counters and memory usage",
+                "GET /api/query_embedding_cache/stats - Query embedding cache hit rate",
+                "GET /api/chunk_embedding_cache/stats - Chunk embedding cache hit rate and size",
+                "POST /api/retrieve/batch - Retrieve documents for several queries at once, across one or more repositories",
+                "POST /api/index/refresh - Update a repository's index with its new commits, re-embedding only changed files",
+                "GET /api/workspaces - List saved workspaces",
+                "PUT /api/workspaces/{name} - Save a workspace of repositories",
+                "DELETE /api/workspaces/{name} - Delete a workspace",
             ]
         }
     }
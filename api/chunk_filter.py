@@ -0,0 +1,145 @@
+import fnmatch
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+def _normalize_dir(path: str) -> str:
+    # "./src/", "src/" and "src" all name the same directory
+    path = path.strip().replace("\\", "/")
+    while path.startswith("./"):
+        path = path[2:]
+    return path.strip("/")
+
+@dataclass(frozen=True)
+class ChunkFilter:
+    """
+    Query-time restriction of the chunks a search may return.
+
+    Repositories are ingested once without request-specific filters; a filter is
+    evaluated against the per-file metadata of the chunk store and turned into a
+    per-chunk mask, so any combination can be served by the same index.
+
+    Attributes:
+        path_prefixes: Only files under one of these directories or paths
+        excluded_dirs: Skip files with one of these directories among their path components
+        excluded_files: Skip files whose name matches one of these glob patterns
+        is_code: Only code files (True) or only documentation files (False)
+        is_implementation: Only implementation files (True) or only tests (False)
+        file_types: Only files with one of these extensions, without the dot
+    """
+    path_prefixes: Tuple[str, ...] = ()
+    excluded_dirs: Tuple[str, ...] = ()
+    excluded_files: Tuple[str, ...] = ()
+    is_code: Optional[bool] = None
+    is_implementation: Optional[bool] = None
+    file_types: Tuple[str, ...] = ()
+
+    @classmethod
+    def create(cls, path_prefixes: Optional[Iterable[str]] = None, excluded_dirs: Optional[Iterable[str]] = None,
+               excluded_files: Optional[Iterable[str]] = None, is_code: Optional[bool] = None,
+               is_implementation: Optional[bool] = None, file_types: Optional[Iterable[str]] = None) -> "ChunkFilter":
+        """
+        Build a normalized filter; equal filters compare and hash equal, so masks can be cached.
+
+        Args:
+            path_prefixes (Iterable[str], optional): Directories or paths relative to the repository root
+            excluded_dirs (Iterable[str], optional): Directory names, e.g. "tests" or "./docs/"
+            excluded_files (Iterable[str], optional): File name patterns, e.g. "*.min.js"
+            is_code (bool, optional): Restrict to code or documentation files
+            is_implementation (bool, optional): Restrict to implementation or test files
+            file_types (Iterable[str], optional): Extensions such as "py" or ".ts"
+
+        Returns:
+            ChunkFilter: The filter
+        """
+        return cls(
+            path_prefixes=tuple(sorted({_normalize_dir(p) for p in path_prefixes or [] if _normalize_dir(p)})),
+            excluded_dirs=tuple(sorted({_normalize_dir(d) for d in excluded_dirs or [] if _normalize_dir(d)})),
+            excluded_files=tuple(sorted({f.strip() for f in excluded_files or [] if f.strip()})),
+            is_code=is_code,
+            is_implementation=is_implementation,
+            file_types=tuple(sorted({t.strip().lstrip(".").lower() for t in file_types or [] if t.strip()})),
+        )
+
+    @property
+    def is_empty(self) -> bool:
+        """Whether the filter lets every chunk through."""
+        return self == ChunkFilter()
+
+    def matches(self, meta_data: Dict[str, Any]) -> bool:
+        """
+        Check one file's metadata against the filter.
+
+        Args:
+            meta_data (dict): File metadata as stored in the chunk store (`file_path`, `type`, ...)
+
+        Returns:
+            bool: True if the file's chunks may be returned
+        """
+        file_path = (meta_data.get("file_path") or "").replace(os.sep, "/")
+        if self.path_prefixes and not any(
+            file_path == prefix or file_path.startswith(prefix + "/") for prefix in self.path_prefixes
+        ):
+            return False
+        if self.excluded_dirs:
+            parts = file_path.split("/")
+            for excluded in self.excluded_dirs:
+                excluded_parts = excluded.split("/")
+                # A nested directory ("src/generated") must match consecutive path components
+                for start in range(len(parts) - len(excluded_parts)):
+                    if parts[start:start + len(excluded_parts)] == excluded_parts:
+                        return False
+        if self.excluded_files:
+            name = file_path.rsplit("/", 1)[-1]
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in self.excluded_files):
+                return False
+        if self.is_code is not None and bool(meta_data.get("is_code")) != self.is_code:
+            return False
+        if self.is_implementation is not None and bool(meta_data.get("is_implementation")) != self.is_implementation:
+            return False
+        if self.file_types and (meta_data.get("type") or "").lower() not in self.file_types:
+            return False
+        return True
+
+    def excludes_directory(self, directory: str) -> bool:
+        """
+        Check whether the path filters rule out every file under a directory.
+
+        Only `path_prefixes` and `excluded_dirs` are considered; False means some
+        file under the directory may still match.
+
+        Args:
+            directory (str): Directory relative to the repository root
+
+        Returns:
+            bool: True if no file under the directory can match
+        """
+        directory = _normalize_dir(directory)
+        if not directory:
+            return False
+        if self.path_prefixes and not any(
+            directory == prefix or directory.startswith(prefix + "/") or prefix.startswith(directory + "/")
+            for prefix in self.path_prefixes
+        ):
+            return True
+        parts = directory.split("/")
+        for excluded in self.excluded_dirs:
+            excluded_parts = excluded.split("/")
+            for start in range(len(parts) - len(excluded_parts) + 1):
+                if parts[start:start + len(excluded_parts)] == excluded_parts:
+                    return True
+        return False
+
+    def file_mask(self, files: List[Dict[str, Any]]) -> np.ndarray:
+        """
+        Evaluate the filter for every file of a chunk store.
+
+        Args:
+            files (List[dict]): Per-file metadata, indexed by file id
+
+        Returns:
+            np.ndarray: Boolean mask over file ids
+        """
+        return np.fromiter((self.matches(meta_data) for meta_data in files), dtype=bool, count=len(files))
@@ -0,0 +1,554 @@
+import json
+import logging
+import mmap
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+from adalflow.core.types import Document
+
+from api.chunk_filter import ChunkFilter
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Bump whenever the on-disk layout of a chunk store changes
+STORE_FORMAT_VERSION = 2
+# Older layouts that can still be read; version 1 has no character spans
+READABLE_FORMAT_VERSIONS = [1, 2]
+
+# Per-chunk metadata table; file-level metadata lives in files.json.
+# start_char/end_char locate the chunk in its source file (-1 when unknown).
+CHUNK_DTYPE = np.dtype([
+    ("file_id", "<i4"),
+    ("order", "<i4"),
+    ("token_count", "<i4"),
+    ("start_char", "<i4"),
+    ("end_char", "<i4"),
+])
+
+VECTORS_FILE = "vectors.npy"
+TEXT_FILE = "text.bin"
+OFFSETS_FILE = "offsets.npy"
+CHUNKS_FILE = "chunks.npy"
+FILES_FILE = "files.json"
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"
+LEXICAL_DIR = "lexical"
+
+# Fixed .npy header size so the row count can be patched in after streaming the data
+_NPY_HEADER_SIZE = 128
+
+# File-level metadata keys shared by every chunk of a file
+FILE_META_KEYS = ["file_path", "type", "is_code", "is_implementation", "title", "token_count"]
+
+# Chunk masks kept per store for recently used filters
+MAX_CACHED_MASKS = 32
+
+# Decoded texts kept per store for recently retrieved chunks
+MAX_HOT_CHUNKS = 256
+
+# Per-directory locks serializing swaps of finished directories into place
+_replace_locks: Dict[str, threading.Lock] = {}
+_replace_locks_lock = threading.Lock()
+
+def unique_tmp_path(path: str) -> str:
+    """Temporary sibling of a path, unique to the calling writer."""
+    return f"{path}.tmp-{os.getpid()}-{uuid.uuid4().hex}"
+
+def replace_dir(src_dir: str, dst_dir: str) -> None:
+    """
+    Move a finished directory into place, replacing any existing one.
+
+    Swaps into the same destination are serialized within the process, so
+    concurrent writers never trip over each other's half-finished swap; the
+    last writer wins.
+
+    Args:
+        src_dir (str): Fully written directory to move into place
+        dst_dir (str): Destination directory
+    """
+    key = os.path.abspath(dst_dir)
+    with _replace_locks_lock:
+        lock = _replace_locks.setdefault(key, threading.Lock())
+    with lock:
+        old_dir = f"{dst_dir}.old-{os.getpid()}-{uuid.uuid4().hex}"
+        if os.path.exists(dst_dir):
+            os.replace(dst_dir, old_dir)
+        os.replace(src_dir, dst_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def get_manifest_path(store_dir: str) -> str:
+    """Path of the manifest that marks a chunk store as complete."""
+    return os.path.join(store_dir, MANIFEST_FILE)
+
+def store_exists(store_dir: str) -> bool:
+    """Whether a complete chunk store exists at the given path."""
+    return os.path.exists(get_manifest_path(store_dir))
+
+def set_store_commit(store_dir: str, commit: Optional[str]) -> None:
+    """
+    Record a new source commit for a store whose chunks are unchanged by it.
+
+    The manifest is replaced atomically, so readers see either commit. It keeps its
+    modification time, so retrievers cached from the store are not invalidated.
+    """
+    manifest_path = get_manifest_path(store_dir)
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("commit") == commit:
+        return
+    manifest["commit"] = commit
+    stat = os.stat(manifest_path)
+    tmp_path = unique_tmp_path(manifest_path)
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(tmp_path, manifest_path)
+
+def _npy_header(shape: tuple, dtype: np.dtype) -> bytes:
+    header = repr({
+        "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+        "fortran_order": False,
+        "shape": shape,
+    })
+    magic = np.lib.format.magic(1, 0)
+    # magic + 2-byte length + header text padded with spaces and terminated by a newline
+    header_len = _NPY_HEADER_SIZE - len(magic) - 2
+    if len(header) + 1 > header_len:
+        raise ValueError(f"Array shape {shape} does not fit in the .npy header")
+    header = header.ljust(header_len - 1) + "\n"
+    return magic + header_len.to_bytes(2, "little") + header.encode("latin1")
+
+class ChunkStoreWriter:
+    """
+    Streams transformed chunks into a columnar on-disk store.
+
+    Layout of a store directory:
+        vectors.npy   float32 matrix (num_chunks x dimensions) of unit-normalized embeddings
+        text.bin      UTF-8 chunk texts, concatenated
+        offsets.npy   int64 byte offsets into text.bin (num_chunks + 1)
+        chunks.npy    per-chunk metadata table (see CHUNK_DTYPE)
+        files.json    per-file metadata shared by the chunks of each file
+        manifest.json format version, counts and source commit, written last
+
+    A store created with `dimensions=0` holds no embeddings (lexical retrieval only).
+
+    The store is assembled in a temporary directory and moved into place on `close`,
+    so readers only ever see complete stores.
+    """
+
+    def __init__(self, store_dir: str, dimensions: Optional[int] = None, commit: Optional[str] = None):
+        """
+        Args:
+            store_dir (str): Directory of the store to create (replaced if it exists)
+            dimensions (int, optional): Embedding dimensions; inferred from the first chunk if omitted,
+                0 to store text only
+            commit (str, optional): Git commit of the repository the chunks were read from
+        """
+        self.store_dir = store_dir
+        self.commit = commit
+        self.tmp_dir = unique_tmp_path(store_dir)
+        os.makedirs(self.tmp_dir)
+
+        self.dimensions = dimensions
+        self.count = 0
+        self.skipped = 0
+        self._vectors_file = open(os.path.join(self.tmp_dir, VECTORS_FILE), "wb")
+        self._vectors_file.write(b"\0" * _NPY_HEADER_SIZE)
+        self._text_file = open(os.path.join(self.tmp_dir, TEXT_FILE), "wb")
+        self._offsets = array("q", [0])
+        self._file_ids = array("i")
+        self._orders = array("i")
+        self._token_counts = array("i")
+        self._start_chars = array("i")
+        self._end_chars = array("i")
+        # Per source document: where the previous chunk started, to locate overlapping chunks
+        self._cursors: Dict[str, int] = {}
+        self._files: List[Dict[str, Any]] = []
+        self._file_index: Dict[str, int] = {}
+
+    def _get_file_id(self, meta_data: Dict[str, Any]) -> int:
+        file_path = meta_data.get("file_path", "unknown")
+        file_id = self._file_index.get(file_path)
+        if file_id is None:
+            file_id = len(self._files)
+            self._file_index[file_path] = file_id
+            self._files.append({key: meta_data.get(key) for key in FILE_META_KEYS})
+        return file_id
+
+    def add(self, document: Document, source_text: Optional[str] = None) -> bool:
+        """
+        Append one transformed chunk.
+
+        Args:
+            document (Document): A chunk with its embedding in `vector`
+            source_text (str, optional): Text of the document the chunk was split from,
+                used to record the chunk's character span
+
+        Returns:
+            bool: False if the chunk was skipped because it has no usable embedding
+        """
+        if self.dimensions != 0:
+            vector = np.asarray(document.vector, dtype=np.float32)
+            if self.dimensions is None and vector.size:
+                self.dimensions = int(vector.size)
+            if vector.ndim != 1 or vector.size == 0 or vector.size != self.dimensions:
+                logger.warning(
+                    f"Skipping chunk {document.order} of {(document.meta_data or {}).get('file_path')}: "
+                    f"missing or mismatched embedding"
+                )
+                self.skipped += 1
+                return False
+
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                vector = vector / norm
+            self._vectors_file.write(vector.astype("<f4").tobytes())
+
+        text_bytes = (document.text or "").encode("utf-8")
+        self._text_file.write(text_bytes)
+        self._offsets.append(self._offsets[-1] + len(text_bytes))
+
+        self._file_ids.append(self._get_file_id(document.meta_data or {}))
+        self._orders.append(document.order if document.order is not None else -1)
+        token_count = document.estimated_num_tokens
+        self._token_counts.append(token_count if token_count is not None else -1)
+        start_char, end_char = self._locate(document, source_text)
+        self._start_chars.append(start_char)
+        self._end_chars.append(end_char)
+        self.count += 1
+        return True
+
+    def _locate(self, document: Document, source_text: Optional[str]) -> tuple:
+        meta_data = document.meta_data or {}
+        if "start_char" in meta_data and "end_char" in meta_data:
+            # Recorded by the token splitter, no search needed
+            return meta_data["start_char"], meta_data["end_char"]
+        if source_text is None or not document.text:
+            return -1, -1
+        # Chunks are exact substrings of their source, in order; overlapping chunks start
+        # after the previous one, so searching from just past it finds the right occurrence
+        parent_id = document.parent_doc_id
+        cursor = self._cursors.get(parent_id, -1) + 1 if document.order else 0
+        start_char = source_text.find(document.text, cursor)
+        if start_char < 0:
+            return -1, -1
+        self._cursors[parent_id] = start_char
+        return start_char, start_char + len(document.text)
+
+    def copy_chunks(self, store: "ChunkStore", indices: Sequence[int]) -> None:
+        """
+        Append chunks of an existing store as they are, without re-embedding them.
+
+        Args:
+            store (ChunkStore): The store to copy from; its embeddings must match this store's
+            indices (Sequence[int]): Chunk indices in `store`, in the order to append them
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if not len(indices):
+            return
+        if self.dimensions is None:
+            self.dimensions = store.dimensions
+        if self.dimensions != store.dimensions:
+            raise ValueError(f"Cannot copy {store.dimensions}-dimensional chunks into a {self.dimensions}-dimensional store")
+
+        if self.dimensions:
+            # Stored vectors are already normalized
+            self._vectors_file.write(np.asarray(store.vectors[indices], dtype="<f4").tobytes())
+        for index in indices:
+            start, end = int(store.offsets[index]), int(store.offsets[index + 1])
+            self._text_file.write(store._text[start:end])
+            self._offsets.append(self._offsets[-1] + end - start)
+            row = store.chunks[index]
+            self._file_ids.append(self._get_file_id(store.files[int(row["file_id"])]))
+            self._orders.append(int(row["order"]))
+            self._token_counts.append(int(row["token_count"]))
+            start_char, end_char = store.get_char_span(index)
+            self._start_chars.append(start_char)
+            self._end_chars.append(end_char)
+        self.count += len(indices)
+
+    def add_documents(self, documents: Sequence[Document], source_texts: Optional[Dict[str, str]] = None) -> None:
+        """
+        Append a sequence of transformed chunks.
+
+        Args:
+            documents (Sequence[Document]): The chunks
+            source_texts (dict, optional): Source document id to text, used to record character spans
+        """
+        source_texts = source_texts or {}
+        for document in documents:
+            self.add(document, source_texts.get(document.parent_doc_id))
+
+    def close(self) -> "ChunkStore":
+        """
+        Finalize the store, move it into place and open it for reading.
+
+        Returns:
+            ChunkStore: The finished store
+        """
+        dimensions = self.dimensions or 0
+        self._vectors_file.seek(0)
+        self._vectors_file.write(_npy_header((self.count, dimensions), np.dtype("<f4")))
+        self._vectors_file.close()
+        self._text_file.close()
+
+        np.save(os.path.join(self.tmp_dir, OFFSETS_FILE), np.frombuffer(self._offsets, dtype=np.int64))
+        chunks = np.zeros(self.count, dtype=CHUNK_DTYPE)
+        chunks["file_id"] = np.frombuffer(self._file_ids, dtype=np.int32)
+        chunks["order"] = np.frombuffer(self._orders, dtype=np.int32)
+        chunks["token_count"] = np.frombuffer(self._token_counts, dtype=np.int32)
+        chunks["start_char"] = np.frombuffer(self._start_chars, dtype=np.int32)
+        chunks["end_char"] = np.frombuffer(self._end_chars, dtype=np.int32)
+        np.save(os.path.join(self.tmp_dir, CHUNKS_FILE), chunks)
+        with open(os.path.join(self.tmp_dir, FILES_FILE), "w") as f:
+            json.dump(self._files, f)
+        with open(os.path.join(self.tmp_dir, MANIFEST_FILE), "w") as f:
+            json.dump({
+                "version": STORE_FORMAT_VERSION,
+                "count": self.count,
+                "dimensions": dimensions,
+                "num_files": len(self._files),
+                "created_at": time.time(),
+                "commit": self.commit,
+            }, f)
+
+        # Swap the finished store into place
+        replace_dir(self.tmp_dir, self.store_dir)
+
+        logger.info(
+            f"Wrote chunk store with {self.count} chunks from {len(self._files)} files to {self.store_dir}"
+            + (f" ({self.skipped} chunks skipped)" if self.skipped else "")
+        )
+        return ChunkStore(self.store_dir)
+
+    def abort(self) -> None:
+        """Discard the partially written store."""
+        self._vectors_file.close()
+        self._text_file.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def __enter__(self) -> "ChunkStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.abort()
+
+class ChunkStore:
+    """
+    Read-only, memory-mapped view of a chunk store written by `ChunkStoreWriter`.
+
+    Behaves like a sequence of `Document` objects; a chunk's text is only read
+    from disk when that chunk is accessed, and the texts of the most recently
+    read chunks are kept decoded in a small LRU.
+    """
+
+    def __init__(self, store_dir: str):
+        """
+        Args:
+            store_dir (str): Directory of the store
+        """
+        self.store_dir = store_dir
+        with open(get_manifest_path(store_dir), "r") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") not in READABLE_FORMAT_VERSIONS:
+            raise ValueError(
+                f"Unsupported chunk store version {self.manifest.get('version')} in {store_dir}"
+            )
+        with open(os.path.join(store_dir, FILES_FILE), "r") as f:
+            self.files: List[Dict[str, Any]] = json.load(f)
+
+        self.vectors: np.ndarray = np.load(os.path.join(store_dir, VECTORS_FILE), mmap_mode="r")
+        self.offsets: np.ndarray = np.load(os.path.join(store_dir, OFFSETS_FILE), mmap_mode="r")
+        self.chunks: np.ndarray = np.load(os.path.join(store_dir, CHUNKS_FILE), mmap_mode="r")
+
+        text_path = os.path.join(store_dir, TEXT_FILE)
+        if os.path.getsize(text_path) > 0:
+            with open(text_path, "rb") as f:
+                self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._text = b""
+
+        self._file_ids: Optional[np.ndarray] = None
+        self._masks: "OrderedDict[ChunkFilter, np.ndarray]" = OrderedDict()
+        self._masks_lock = threading.Lock()
+        self._hot_texts: "OrderedDict[int, str]" = OrderedDict()
+        self._hot_lock = threading.Lock()
+
+    @property
+    def dimensions(self) -> int:
+        return int(self.manifest["dimensions"])
+
+    @property
+    def commit(self) -> Optional[str]:
+        """Git commit of the repository the store was built from, if recorded."""
+        return self.manifest.get("commit")
+
+    @property
+    def vectors_path(self) -> str:
+        return os.path.join(self.store_dir, VECTORS_FILE)
+
+    @property
+    def index_path(self) -> str:
+        """Path of the FAISS index built over this store's vectors."""
+        return os.path.join(self.store_dir, INDEX_FILE)
+
+    @property
+    def lexical_dir(self) -> str:
+        """Directory of the BM25 index built over this store's texts."""
+        return os.path.join(self.store_dir, LEXICAL_DIR)
+
+    @property
+    def has_vectors(self) -> bool:
+        """Whether the store holds embeddings, i.e. was not built for lexical retrieval only."""
+        return self.dimensions > 0
+
+    @property
+    def nbytes(self) -> int:
+        """Total size of the mapped arrays and text."""
+        return int(self.vectors.nbytes + self.offsets.nbytes + self.chunks.nbytes + len(self._text))
+
+    @property
+    def resident_nbytes(self) -> int:
+        """
+        Size of what stays resident while the store is searched: the vectors, the chunk
+        table and offsets, and the hot texts. Other texts are only paged in on a hit.
+        """
+        with self._hot_lock:
+            # Memory of the str objects, including per-string overhead and wide characters
+            hot_bytes = sum(sys.getsizeof(text) for text in self._hot_texts.values())
+        return int(self.vectors.nbytes + self.offsets.nbytes + self.chunks.nbytes + hot_bytes)
+
+    def __len__(self) -> int:
+        return int(self.manifest["count"])
+
+    def get_text(self, index: int) -> str:
+        """Read the text of one chunk."""
+        index = int(index)
+        with self._hot_lock:
+            text = self._hot_texts.get(index)
+            if text is not None:
+                self._hot_texts.move_to_end(index)
+                return text
+
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        text = self._text[start:end].decode("utf-8")
+
+        with self._hot_lock:
+            self._hot_texts[index] = text
+            while len(self._hot_texts) > MAX_HOT_CHUNKS:
+                self._hot_texts.popitem(last=False)
+        return text
+
+    def get_vectors(self, indices: Sequence[int]) -> np.ndarray:
+        """Read the embeddings of several chunks as a float32 matrix."""
+        return np.asarray(self.vectors[np.asarray(indices, dtype=np.int64)], dtype=np.float32)
+
+    def get_token_count(self, index: int) -> int:
+        """Get a chunk's stored token count, -1 if unknown."""
+        return int(self.chunks[index]["token_count"])
+
+    def iter_texts(self) -> Iterator[str]:
+        """Read all chunk texts in order, bypassing the hot-chunk LRU (for index builds)."""
+        for index in range(len(self)):
+            start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+            yield self._text[start:end].decode("utf-8")
+
+    @property
+    def has_char_spans(self) -> bool:
+        """Whether chunks record their character span in the source file."""
+        return "start_char" in self.chunks.dtype.names
+
+    def get_char_span(self, index: int) -> tuple:
+        """
+        Get a chunk's (start, end) character offsets in its source file.
+
+        Returns:
+            tuple: The span, or (-1, -1) if unknown
+        """
+        if not self.has_char_spans:
+            return -1, -1
+        row = self.chunks[index]
+        return int(row["start_char"]), int(row["end_char"])
+
+    def get_meta_data(self, index: int) -> Dict[str, Any]:
+        """Build the metadata dictionary of one chunk."""
+        return dict(self.files[int(self.chunks[index]["file_id"])])
+
+    def get_chunk_mask(self, chunk_filter: ChunkFilter) -> np.ndarray:
+        """
+        Get the chunks a filter lets through.
+
+        The filter is evaluated once per file and broadcast to the chunks through
+        their file ids; masks of recently used filters are cached.
+
+        Args:
+            chunk_filter (ChunkFilter): The query-time filter
+
+        Returns:
+            np.ndarray: Read-only boolean mask over chunk indices
+        """
+        with self._masks_lock:
+            mask = self._masks.get(chunk_filter)
+            if mask is not None:
+                self._masks.move_to_end(chunk_filter)
+                return mask
+
+        if self._file_ids is None:
+            self._file_ids = np.ascontiguousarray(self.chunks["file_id"])
+        mask = chunk_filter.file_mask(self.files)[self._file_ids]
+        mask.flags.writeable = False
+
+        with self._masks_lock:
+            self._masks[chunk_filter] = mask
+            while len(self._masks) > MAX_CACHED_MASKS:
+                self._masks.popitem(last=False)
+        return mask
+
+    def get_document(self, index: int) -> Document:
+        """
+        Materialize one chunk as a `Document`.
+
+        Args:
+            index (int): Chunk index, as returned by the FAISS index
+
+        Returns:
+            Document: The chunk with text, metadata and vector
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Chunk index {index} out of range")
+        row = self.chunks[index]
+        meta_data = self.get_meta_data(index)
+        token_count = int(row["token_count"])
+        return Document(
+            id=str(index),
+            text=self.get_text(index),
+            meta_data=meta_data,
+            vector=self.vectors[index].tolist(),
+            parent_doc_id=meta_data.get("file_path"),
+            order=int(row["order"]),
+            estimated_num_tokens=token_count if token_count >= 0 else None,
+        )
+
+    def __getitem__(self, index: int) -> Document:
+        return self.get_document(int(index))
+
+    def __iter__(self) -> Iterator[Document]:
+        for index in range(len(self)):
+            yield self.get_document(index)
+
+    def close(self) -> None:
+        """Release the text mapping; array mappings are released with the object."""
+        if isinstance(self._text, mmap.mmap):
+            self._text.close()
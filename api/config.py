@@ -156,7 +156,7 @@ if generator_config:
 
 # Update embedder configuration
 if embedder_config:
-    for key in ["embedder", "embedder_ollama", "retriever", "text_splitter"]:
+    for key in ["embedder", "embedder_ollama", "retriever", "retriever_cache", "query_embedding_cache", "chunk_embedding_cache", "context_packing", "federation", "sharding", "ingestion", "text_splitter"]:
         if key in embedder_config:
             configs[key] = embedder_config[key]
 
@@ -220,3 +220,24 @@ def get_model_config(provider="google", model=None):
         result["model_kwargs"] = {"model": model, **model_params}
 
     return result
+
+def get_context_window(provider="google", model=None):
+    """
+    Get the context window, in tokens, of a provider's model
+
+    Parameters:
+        provider (str): Model provider ('google', 'openai', 'openrouter', 'ollama')
+        model (str): Model name, or None to use default model
+
+    Returns:
+        int: The context window, or None if it is not configured
+    """
+    provider_config = configs.get("providers", {}).get(provider, {})
+    model = model or provider_config.get("default_model")
+
+    if provider == "ollama":
+        # Ollama models run with the num_ctx they are given
+        model_params = provider_config.get("models", {}).get(model, {})
+        return model_params.get("options", {}).get("num_ctx")
+
+    return provider_config.get("context_windows", {}).get(model, provider_config.get("context_window"))
@@ -0,0 +1,206 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+from api.chunk_store import ChunkStore
+from api.config import configs, get_context_window
+from api.tokenization import count_tokens
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+@dataclass
+class ContextSpan:
+    """
+    A contiguous piece of one file assembled from one or more retrieved chunks.
+
+    Attributes:
+        file_path: Path of the source file, relative to the repository root
+        text: The de-duplicated text of the span
+        start_char: Offset of the span in the source file, -1 if unknown
+        end_char: End offset of the span in the source file, -1 if unknown
+        chunk_indices: Chunk store indices merged into the span
+        score: Best retrieval score of the merged chunks
+        rank: Best retrieval rank of the merged chunks (0 is the top result)
+        token_count: Approximate number of tokens of `text`, -1 if unknown
+    """
+    file_path: str
+    text: str
+    start_char: int = -1
+    end_char: int = -1
+    chunk_indices: List[int] = field(default_factory=list)
+    score: Optional[float] = None
+    rank: int = 0
+    token_count: int = -1
+
+def merge_retrieved_chunks(store: ChunkStore, doc_indices: Sequence[int],
+                           doc_scores: Optional[Sequence[float]] = None) -> List[ContextSpan]:
+    """
+    Coalesce overlapping or contiguous retrieved chunks of the same file into spans.
+
+    Neighbouring chunks share `chunk_overlap` tokens, so concatenating them repeats
+    text. Using each chunk's character span in its source file (`start_char`/`end_char`),
+    spans keep each character of the source once. Chunks without a recorded character
+    span (stores written before spans existed) are kept as they are.
+
+    Args:
+        store (ChunkStore): The chunk store the indices refer to, or a `ShardedChunkStore`
+        doc_indices (Sequence[int]): Retrieved chunk indices, best first
+        doc_scores (Sequence[float], optional): Scores matching `doc_indices`
+
+    Returns:
+        List[ContextSpan]: The spans, ordered by the best rank among their chunks
+    """
+    by_file: Dict[str, List[ContextSpan]] = {}
+    seen = set()
+    for rank, doc_index in enumerate(doc_indices):
+        doc_index = int(doc_index)
+        if doc_index < 0 or doc_index in seen:
+            continue
+        seen.add(doc_index)
+        start_char, end_char = store.get_char_span(doc_index)
+        file_path = store.get_meta_data(doc_index).get("file_path", "unknown")
+        by_file.setdefault(file_path, []).append(ContextSpan(
+            file_path=file_path,
+            text=store.get_text(doc_index),
+            start_char=start_char,
+            end_char=end_char,
+            chunk_indices=[doc_index],
+            score=float(doc_scores[rank]) if doc_scores is not None else None,
+            rank=rank,
+            token_count=store.get_token_count(doc_index),
+        ))
+
+    spans = []
+    for file_spans in by_file.values():
+        located = sorted((s for s in file_spans if s.start_char >= 0), key=lambda s: s.start_char)
+        spans.extend(s for s in file_spans if s.start_char < 0)
+        current = None
+        for span in located:
+            if current is not None and span.start_char <= current.end_char:
+                # Overlapping or touching: append only the part past the current end
+                if span.end_char > current.end_char:
+                    appended = span.text[current.end_char - span.start_char:]
+                    current.text += appended
+                    current.end_char = span.end_char
+                    if current.token_count >= 0 and span.token_count >= 0:
+                        # Stored counts are per chunk; count only the share of the new text
+                        current.token_count += round(span.token_count * len(appended) / max(len(span.text), 1))
+                    else:
+                        current.token_count = -1
+                current.chunk_indices.extend(span.chunk_indices)
+                if span.score is not None and (current.score is None or span.score > current.score):
+                    current.score = span.score
+                current.rank = min(current.rank, span.rank)
+            else:
+                current = span
+                spans.append(current)
+
+    spans.sort(key=lambda s: s.rank)
+    if len(spans) < len(seen):
+        logger.info(f"Merged {len(seen)} retrieved chunks into {len(spans)} spans")
+    return spans
+
+def format_context(spans: Sequence[ContextSpan]) -> str:
+    """
+    Render spans as prompt context, grouped under one header per file.
+
+    Files appear in the order of their best span; spans of a file appear in
+    source order.
+
+    Args:
+        spans (Sequence[ContextSpan]): Spans from `merge_retrieved_chunks`
+
+    Returns:
+        str: The context text
+    """
+    by_file: Dict[str, List[ContextSpan]] = {}
+    for span in spans:
+        by_file.setdefault(span.file_path, []).append(span)
+
+    context_parts = []
+    for file_path, file_spans in by_file.items():
+        file_spans = sorted(file_spans, key=lambda s: (s.start_char < 0, s.start_char, s.rank))
+        header = f"## File Path: {file_path}\n\n"
+        content = "\n\n".join(span.text for span in file_spans)
+        context_parts.append(f"{header}{content}")
+
+    # Join all parts with clear separation
+    return "\n\n" + "-" * 10 + "\n\n".join(context_parts)
+
+def get_context_budget(provider: str, model: Optional[str], prompt_tokens: int) -> int:
+    """
+    Get the number of tokens retrieved context may take in a prompt.
+
+    The budget is what remains of the model's context window after the rest of the
+    prompt and the reserved output tokens, capped at `context_packing.max_context_tokens`.
+    Models listed in `context_packing.model_max_context_tokens` use their own cap, which
+    is how long-context models are given more context.
+
+    Args:
+        provider (str): Model provider
+        model (str, optional): Model name, or None for the provider's default model
+        prompt_tokens (int): Tokens of the prompt without context (system prompt,
+            history, file content and query)
+
+    Returns:
+        int: The context budget in tokens, never negative
+    """
+    packing_config = configs.get("context_packing", {})
+    model = model or configs.get("providers", {}).get(provider, {}).get("default_model")
+    budget = packing_config.get("model_max_context_tokens", {}).get(
+        model, packing_config.get("max_context_tokens", 12000)
+    )
+    context_window = get_context_window(provider, model)
+    if context_window:
+        # Small local models cannot spare a fixed reserve; keep at most a quarter for the answer
+        reserve_tokens = min(packing_config.get("reserve_output_tokens", 8192), context_window // 4)
+        budget = min(budget, context_window - reserve_tokens - prompt_tokens)
+    return max(budget, 0)
+
+def pack_spans(spans: Sequence[ContextSpan], budget_tokens: int, max_score_gap: float = 0,
+               local_ollama: bool = False) -> List[ContextSpan]:
+    """
+    Greedily select the best-ranked spans that fit in a token budget.
+
+    Spans are visited in rank order; a span that does not fit is skipped so smaller,
+    lower-ranked spans can still fill the budget. With `max_score_gap`, packing stops
+    at the first drop between consecutive scores larger than that fraction of the top
+    score, since spans past a cliff rarely help the answer.
+
+    Args:
+        spans (Sequence[ContextSpan]): Spans from `merge_retrieved_chunks`, best first
+        budget_tokens (int): Tokens available for context, see `get_context_budget`
+        max_score_gap (float): Relative score drop that ends packing; 0 disables the cutoff
+        local_ollama (bool): Whether to count tokens for Ollama
+
+    Returns:
+        List[ContextSpan]: The selected spans, best first
+    """
+    packed = []
+    used_tokens = 0
+    files = set()
+    top_score = spans[0].score if spans else None
+    previous_score = top_score
+    for span in spans:
+        if max_score_gap and top_score and span.score is not None and previous_score is not None:
+            if (previous_score - span.score) / abs(top_score) > max_score_gap:
+                logger.info(f"Stopping context packing at a score gap after {len(packed)} spans")
+                break
+            previous_score = span.score
+
+        tokens = span.token_count if span.token_count >= 0 else count_tokens(span.text, local_ollama)
+        if span.file_path not in files:
+            # The "## File Path" header and separators of a new file
+            tokens += count_tokens(f"## File Path: {span.file_path}", local_ollama) + 4
+        else:
+            tokens += 2
+        if used_tokens + tokens > budget_tokens:
+            continue
+        packed.append(span)
+        files.add(span.file_path)
+        used_tokens += tokens
+
+    if len(packed) < len(spans):
+        logger.info(f"Packed {len(packed)} of {len(spans)} spans into {used_tokens}/{budget_tokens} context tokens")
+    return packed
@@ -1,18 +1,50 @@
 import adalflow as adal
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
 from adalflow.core.types import Document, List
 from adalflow.components.data_process import TextSplitter, ToEmbeddings
 import os
 import subprocess
 import json
-import tiktoken
 import logging
 import base64
 import re
-import glob
+import numpy as np
+from functools import lru_cache, partial
 from adalflow.utils import get_adalflow_default_root_path
 from adalflow.core.db import LocalDB
 from api.config import configs, DEFAULT_EXCLUDED_DIRS, DEFAULT_EXCLUDED_FILES
-from api.ollama_patch import OllamaDocumentProcessor
+from api.embedding_cache import chunk_embedding_cache
+from api.embedding_executor import OpenAIEmbeddingExecutor
+from api.ollama_patch import OllamaBatchEmbedder
+from api.openai_client import OpenAIClient
+from api.chunk_store import ChunkStore, ChunkStoreWriter, get_manifest_path, set_store_commit, store_exists
+from api.ingestion import stream_stage
+from api.lexical_index import LexicalIndex, get_lexical_config
+from api.path_matcher import PathMatcher
+from api.retriever_cache import retriever_cache
+from api.tokenization import TokenTextSplitter, count_tokens_batch
+from api.sharded_store import (
+    ShardedChunkStore,
+    ShardedLexicalIndex,
+    documents_fingerprint,
+    get_shard_store_dir,
+    get_sharding_config,
+    get_shards_manifest_path,
+    partition_documents,
+    read_shards_manifest,
+    remove_stale_shards,
+    shards_exist,
+    write_shards_manifest,
+)
+from api.vector_index import (
+    build_index,
+    configure_search,
+    get_index_config,
+    get_index_spec,
+    is_quantized,
+    load_index,
+    save_index,
+)
 from urllib.parse import urlparse, urlunparse, quote
 
 # Configure logging
@@ -21,30 +53,6 @@ logger = logging.getLogger(__name__)
 # Maximum token limit for OpenAI embedding models
 MAX_EMBEDDING_TOKENS = 8192
 
-def count_tokens(text: str, local_ollama: bool = False) -> int:
-    """
-    Count the number of tokens in a text string using tiktoken.
-
-    Args:
-        text (str): The text to count tokens for.
-        local_ollama (bool, optional): Whether using local Ollama embeddings. Default is False.
-
-    Returns:
-        int: The number of tokens in the text.
-    """
-    try:
-        if local_ollama:
-            encoding = tiktoken.get_encoding("cl100k_base")
-        else:
-            encoding = tiktoken.encoding_for_model("text-embedding-3-small")
-
-        return len(encoding.encode(text))
-    except Exception as e:
-        # Fallback to a simple approximation if tiktoken fails
-        logger.warning(f"Error counting tokens with tiktoken: {e}")
-        # Rough approximation: 4 characters per token
-        return len(text) // 4
-
 def download_repo(repo_url: str, local_path: str, type: str = "github", access_token: str = None) -> str:
     """
     Downloads a Git repository (GitHub, GitLab, or Bitbucket) to a specified local path.
@@ -117,213 +125,558 @@ def download_repo(repo_url: str, local_path: str, type: str = "github", access_t
 # Alias for backward compatibility
 download_github_repo = download_repo
 
-def read_all_documents(path: str, local_ollama: bool = False, excluded_dirs: List[str] = None, excluded_files: List[str] = None):
+def _run_git(repo_dir: str, *args: str) -> str:
+    result = subprocess.run(
+        ["git", *args],
+        cwd=repo_dir,
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    return result.stdout.decode("utf-8")
+
+def get_git_commit(repo_dir: str) -> Optional[str]:
     """
-    Recursively reads all documents in a directory and its subdirectories.
+    Get the commit a repository checkout is at.
+
+    Args:
+        repo_dir (str): The repository directory
+
+    Returns:
+        str: The SHA of HEAD, or None if the directory is not a git checkout
+    """
+    try:
+        return _run_git(repo_dir, "rev-parse", "HEAD").strip() or None
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+def pull_repo(repo_dir: str) -> None:
+    """
+    Fast-forward a downloaded repository to its remote branch.
+
+    Failures (no network, diverged history) are logged and the checkout is left as it is.
+
+    Args:
+        repo_dir (str): The repository directory
+    """
+    try:
+        logger.info(f"Pulling new commits into {repo_dir}")
+        _run_git(repo_dir, "pull", "--ff-only", "--quiet")
+    except subprocess.CalledProcessError as e:
+        # The remote URL may embed an access token; git prints it on some errors
+        error_msg = re.sub(r"://[^@/\s]+@", "://***TOKEN***@", e.stderr.decode("utf-8"))
+        logger.warning(f"Could not pull {repo_dir}, indexing the current checkout: {error_msg}")
+    except OSError as e:
+        logger.warning(f"Could not pull {repo_dir}, indexing the current checkout: {e}")
+
+def get_changed_files(repo_dir: str, commit: str) -> Optional[Set[str]]:
+    """
+    List the files that differ between a commit and the current checkout.
+
+    Includes files changed by later commits, uncommitted changes and untracked files,
+    so local working copies are covered as well as downloaded repositories.
+
+    Args:
+        repo_dir (str): The repository directory
+        commit (str): The commit the index was built from
+
+    Returns:
+        Set[str]: Changed, added and deleted paths relative to `repo_dir`, or None if the
+            commit is unknown (e.g. after a force push) and the changes cannot be determined
+    """
+    try:
+        changed = _run_git(repo_dir, "diff", "--name-only", "--no-renames", "--relative", "-z", commit)
+        untracked = _run_git(repo_dir, "ls-files", "--others", "--exclude-standard", "-z")
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.warning(f"Could not diff {repo_dir} against {commit}: {e}")
+        return None
+    return {path for path in (changed + untracked).split("\0") if path}
+
+# File extensions to look for, prioritizing code files
+CODE_EXTENSIONS = [".py", ".js", ".ts", ".java", ".cpp", ".c", ".go", ".rs",
+                   ".jsx", ".tsx", ".html", ".css", ".php", ".swift", ".cs"]
+DOC_EXTENSIONS = [".md", ".txt", ".rst", ".json", ".yaml", ".yml"]
+
+# Extension to whether it is a code file, for a single lookup per file
+_FILE_KINDS = {**{ext: False for ext in DOC_EXTENSIONS}, **{ext: True for ext in CODE_EXTENSIONS}}
+
+def walk_repository(path: str, matcher: PathMatcher) -> Iterator[Tuple[str, str, str, bool]]:
+    """
+    Walk a repository once, yielding the files to ingest.
+
+    Excluded directories are pruned before they are entered, so large trees such as
+    `node_modules` are never listed. Hidden files and directories are skipped, and
+    symbolic links to directories are not followed.
+
+    Args:
+        path (str): The root directory path
+        matcher (PathMatcher): Exclusions of this ingestion, see `PathMatcher.from_repository`
+
+    Returns:
+        Iterator[Tuple[str, str, str, bool]]: (file path, path relative to `path`, extension, is code),
+            in depth-first name order
+    """
+    stack = [(path, "")]
+    while stack:
+        dir_path, relative_dir = stack.pop()
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            logger.error(f"Error listing {dir_path}: {e}")
+            continue
+
+        subdirs = []
+        for entry in entries:
+            name = entry.name
+            if name.startswith("."):
+                continue
+            relative_path = os.path.join(relative_dir, name) if relative_dir else name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if matcher.matches(relative_path, is_dir=True):
+                        continue
+                    subdirs.append((entry.path, relative_path))
+                    continue
+                ext = os.path.splitext(name)[1]
+                is_code = _FILE_KINDS.get(ext)
+                if is_code is None or matcher.matches(relative_path) or not entry.is_file():
+                    continue
+            except OSError as e:
+                logger.error(f"Error reading {entry.path}: {e}")
+                continue
+            yield entry.path, relative_path, ext, is_code
+        # Visit subdirectories in name order
+        stack.extend(reversed(subdirs))
+
+def _read_file_batch(files: List[Tuple[str, str, str, bool]], local_ollama: bool = False) -> List[Document]:
+    """
+    Read and token-count a batch of files from `walk_repository`; runs in ingestion workers.
+
+    Files that cannot be read or exceed the size limit are skipped.
+
+    Args:
+        files (List[Tuple[str, str, str, bool]]): (file path, relative path, extension, is code) entries
+        local_ollama (bool): Whether to use local Ollama for token counting
+
+    Returns:
+        List[Document]: One document per file read, in input order
+    """
+    contents = []
+    for file_path, relative_path, ext, is_code in files:
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                contents.append(f.read())
+        except Exception as e:
+            logger.error(f"Error reading {file_path}: {e}")
+            contents.append(None)
+
+    # One batch encode for all files of the batch
+    read = [(entry, content) for entry, content in zip(files, contents) if content is not None]
+    token_counts = count_tokens_batch([content for _, content in read], local_ollama)
+
+    documents = []
+    for ((file_path, relative_path, ext, is_code), content), token_count in zip(read, token_counts):
+        # Determine if this is an implementation file
+        is_implementation = is_code and (
+            not relative_path.startswith("test_")
+            and not relative_path.startswith("app_")
+            and "test" not in relative_path.lower()
+        )
+
+        # Check token count; code files may be split into more chunks than documentation
+        if token_count > (MAX_EMBEDDING_TOKENS * 10 if is_code else MAX_EMBEDDING_TOKENS):
+            logger.warning(f"Skipping large file {relative_path}: Token count ({token_count}) exceeds limit")
+            continue
+
+        documents.append(Document(
+            text=content,
+            meta_data={
+                "file_path": relative_path,
+                "type": ext[1:],
+                "is_code": is_code,
+                "is_implementation": is_implementation,
+                "title": relative_path,
+                "token_count": token_count,
+            },
+            estimated_num_tokens=token_count,
+        ))
+    return documents
+
+def list_repository_files(path: str, excluded_dirs: List[str] = None,
+                          excluded_files: List[str] = None) -> List[Tuple[str, str, str, bool]]:
+    """
+    List the files of a repository that are ingested.
 
     Args:
         path (str): The root directory path.
-        local_ollama (bool): Whether to use local Ollama for token counting. Default is False.
         excluded_dirs (List[str], optional): List of directories to exclude from processing.
             Overrides the default configuration if provided.
         excluded_files (List[str], optional): List of file patterns to exclude from processing.
             Overrides the default configuration if provided.
 
+    Exclusions use gitignore syntax, and the repository's own `.gitignore` and
+    `.deepwikiignore` patterns apply after them.
+
     Returns:
-        list: A list of Document objects with metadata.
+        List[Tuple[str, str, str, bool]]: (file path, relative path, extension, is code), see `walk_repository`
     """
-    documents = []
-    # File extensions to look for, prioritizing code files
-    code_extensions = [".py", ".js", ".ts", ".java", ".cpp", ".c", ".go", ".rs",
-                       ".jsx", ".tsx", ".html", ".css", ".php", ".swift", ".cs"]
-    doc_extensions = [".md", ".txt", ".rst", ".json", ".yaml", ".yml"]
-
     # Always start with default excluded directories and files
-    final_excluded_dirs = set(DEFAULT_EXCLUDED_DIRS)
-    final_excluded_files = set(DEFAULT_EXCLUDED_FILES)
+    final_excluded_dirs = list(DEFAULT_EXCLUDED_DIRS)
+    final_excluded_files = list(DEFAULT_EXCLUDED_FILES)
 
     # Add any additional excluded directories from config
     if "file_filters" in configs and "excluded_dirs" in configs["file_filters"]:
-        final_excluded_dirs.update(configs["file_filters"]["excluded_dirs"])
+        final_excluded_dirs.extend(configs["file_filters"]["excluded_dirs"])
 
     # Add any additional excluded files from config
     if "file_filters" in configs and "excluded_files" in configs["file_filters"]:
-        final_excluded_files.update(configs["file_filters"]["excluded_files"])
+        final_excluded_files.extend(configs["file_filters"]["excluded_files"])
 
     # Add any explicitly provided excluded directories and files
     if excluded_dirs is not None:
-        final_excluded_dirs.update(excluded_dirs)
+        final_excluded_dirs.extend(excluded_dirs)
 
     if excluded_files is not None:
-        final_excluded_files.update(excluded_files)
+        final_excluded_files.extend(excluded_files)
 
-    # Convert back to lists for compatibility
-    excluded_dirs = list(final_excluded_dirs)
-    excluded_files = list(final_excluded_files)
+    # Remove duplicates but keep the order, so later "!" patterns can re-include files
+    excluded_dirs = list(dict.fromkeys(final_excluded_dirs))
+    excluded_files = list(dict.fromkeys(final_excluded_files))
 
     logger.info(f"Using excluded directories: {excluded_dirs}")
     logger.info(f"Using excluded files: {excluded_files}")
 
-    logger.info(f"Reading documents from {path}")
+    # Compiled once per ingestion, together with the repository's .gitignore and .deepwikiignore
+    matcher = PathMatcher.from_repository(path, excluded_dirs, excluded_files)
 
-    # Process code files first
-    for ext in code_extensions:
-        files = glob.glob(f"{path}/**/*{ext}", recursive=True)
-        for file_path in files:
-            # Skip excluded directories and files
-            is_excluded = False
-            # Check if file is in an excluded directory
-            file_path_parts = os.path.normpath(file_path).split(os.sep)
-            for excluded in excluded_dirs:
-                # Remove ./ prefix and trailing slash if present
-                clean_excluded = excluded.strip("./").rstrip("/")
-                # Check if the excluded directory is in the path components
-                if clean_excluded in file_path_parts:
-                    is_excluded = True
-                    break
-            if not is_excluded and any(os.path.basename(file_path) == excluded for excluded in excluded_files):
-                is_excluded = True
-            if is_excluded:
-                continue
+    return list(walk_repository(path, matcher))
 
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                    relative_path = os.path.relpath(file_path, path)
-
-                    # Determine if this is an implementation file
-                    is_implementation = (
-                        not relative_path.startswith("test_")
-                        and not relative_path.startswith("app_")
-                        and "test" not in relative_path.lower()
-                    )
-
-                    # Check token count
-                    token_count = count_tokens(content, local_ollama)
-                    if token_count > MAX_EMBEDDING_TOKENS * 10:
-                        logger.warning(f"Skipping large file {relative_path}: Token count ({token_count}) exceeds limit")
-                        continue
+def _code_first(files: List[Tuple[str, str, str, bool]]) -> List[Tuple[str, str, str, bool]]:
+    # Code files first, then documentation, each in walk order
+    return [entry for entry in files if entry[3]] + [entry for entry in files if not entry[3]]
 
-                    doc = Document(
-                        text=content,
-                        meta_data={
-                            "file_path": relative_path,
-                            "type": ext[1:],
-                            "is_code": True,
-                            "is_implementation": is_implementation,
-                            "title": relative_path,
-                            "token_count": token_count,
-                        },
-                    )
-                    documents.append(doc)
-            except Exception as e:
-                logger.error(f"Error reading {file_path}: {e}")
-
-    # Then process documentation files
-    for ext in doc_extensions:
-        files = glob.glob(f"{path}/**/*{ext}", recursive=True)
-        for file_path in files:
-            # Skip excluded directories and files
-            is_excluded = False
-            # Check if file is in an excluded directory
-            file_path_parts = os.path.normpath(file_path).split(os.sep)
-            for excluded in excluded_dirs:
-                # Remove ./ prefix and trailing slash if present
-                clean_excluded = excluded.strip("./").rstrip("/")
-                # Check if the excluded directory is in the path components
-                if clean_excluded in file_path_parts:
-                    is_excluded = True
-                    break
-            if not is_excluded and any(os.path.basename(file_path) == excluded for excluded in excluded_files):
-                is_excluded = True
-            if is_excluded:
-                continue
+def iter_documents(files: Iterable[Tuple[str, str, str, bool]], local_ollama: bool = False) -> Iterator[Document]:
+    """
+    Read files listed by `list_repository_files` into documents as they are needed.
 
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                    relative_path = os.path.relpath(file_path, path)
-
-                    # Check token count
-                    token_count = count_tokens(content, local_ollama)
-                    if token_count > MAX_EMBEDDING_TOKENS:
-                        logger.warning(f"Skipping large file {relative_path}: Token count ({token_count}) exceeds limit")
-                        continue
+    Reading and token counting run on the ingestion pool with a bounded number of
+    files in flight, so only a few batches of file contents are in memory at a time.
 
-                    doc = Document(
-                        text=content,
-                        meta_data={
-                            "file_path": relative_path,
-                            "type": ext[1:],
-                            "is_code": False,
-                            "is_implementation": False,
-                            "title": relative_path,
-                            "token_count": token_count,
-                        },
-                    )
-                    documents.append(doc)
-            except Exception as e:
-                logger.error(f"Error reading {file_path}: {e}")
+    Args:
+        files (Iterable[Tuple[str, str, str, bool]]): The files
+        local_ollama (bool): Whether to use local Ollama for token counting
+
+    Returns:
+        Iterator[Document]: The documents with metadata, in the order of `files`
+    """
+    for _, documents in stream_stage("read", partial(_read_file_batch, local_ollama=local_ollama), files, "files", "documents"):
+        yield from documents
+
+def read_documents(files: List[Tuple[str, str, str, bool]], local_ollama: bool = False) -> List[Document]:
+    """
+    Read files listed by `list_repository_files` into documents.
 
+    Args:
+        files (List[Tuple[str, str, str, bool]]): The files
+        local_ollama (bool): Whether to use local Ollama for token counting
+
+    Returns:
+        List[Document]: The documents with metadata, code files first
+    """
+    documents = list(iter_documents(_code_first(files), local_ollama))
     logger.info(f"Found {len(documents)} documents")
     return documents
 
-def prepare_data_pipeline(local_ollama: bool = False):
+def read_all_documents(path: str, local_ollama: bool = False, excluded_dirs: List[str] = None, excluded_files: List[str] = None):
+    """
+    Recursively reads all documents in a directory and its subdirectories.
+
+    Args:
+        path (str): The root directory path.
+        local_ollama (bool): Whether to use local Ollama for token counting. Default is False.
+        excluded_dirs (List[str], optional): List of directories to exclude from processing.
+            Overrides the default configuration if provided.
+        excluded_files (List[str], optional): List of file patterns to exclude from processing.
+            Overrides the default configuration if provided.
+
+    Returns:
+        list: A list of Document objects with metadata, code files first.
+    """
+    logger.info(f"Reading documents from {path}")
+    return read_documents(list_repository_files(path, excluded_dirs, excluded_files), local_ollama)
+
+@lru_cache(maxsize=1)
+def _get_text_splitter():
+    # One splitter per process, reused by every batch the process splits
+    splitter_config = configs["text_splitter"]
+    if splitter_config.get("split_by") == "token":
+        return TokenTextSplitter(
+            chunk_size=splitter_config["chunk_size"],
+            chunk_overlap=splitter_config["chunk_overlap"],
+        )
+    return TextSplitter(**splitter_config)
+
+def _split_document_batch(documents: List[Document]) -> List[Document]:
+    """
+    Split a batch of documents into chunks; runs in ingestion workers.
+
+    Args:
+        documents (List[Document]): Documents from `read_all_documents`
+
+    Returns:
+        List[Document]: The chunks, in document order
+    """
+    return _get_text_splitter().call(documents=documents)
+
+def iter_chunks(documents: Iterable[Document]) -> Iterator[Tuple[List[Document], List[Document]]]:
+    """
+    Split a stream of documents into chunks on the ingestion pool, with a bounded number of documents in flight.
+
+    Args:
+        documents (Iterable[Document]): Documents, e.g. from `iter_documents`
+
+    Returns:
+        Iterator[Tuple[List[Document], List[Document]]]: Each batch of documents with its chunks, in document order
+    """
+    return stream_stage("split", _split_document_batch, documents, "documents", "chunks")
+
+def prepare_data_pipeline(local_ollama: bool = False, embed: bool = True, split: bool = True):
     """
     Creates and returns the data transformation pipeline.
 
     Args:
         local_ollama (bool): Whether to use local Ollama for embedding (default: False)
+        embed (bool): Whether to embed the chunks; False only splits them, for lexical retrieval
+        split (bool): Whether to split documents first; False for chunks that `iter_chunks` already split
 
     Returns:
         adal.Sequential: The data transformation pipeline
     """
-    splitter = TextSplitter(**configs["text_splitter"])
+    splitter = [_get_text_splitter()] if split else []
+    if not embed:
+        return adal.Sequential(*splitter)
 
     if local_ollama:
-        # Use Ollama embedder
-        embedder = adal.Embedder(
-            model_client=configs["embedder_ollama"]["model_client"](),
+        # Use Ollama's batch embed endpoint, several requests at a time
+        embedder_transformer = OllamaBatchEmbedder(
             model_kwargs=configs["embedder_ollama"]["model_kwargs"],
+            batch_size=configs["embedder_ollama"].get("batch_size", 32),
+            max_concurrency=configs["embedder_ollama"].get("max_concurrency", 4),
+            max_batch_tokens=configs["embedder_ollama"].get("max_batch_tokens", 16384),
+            max_input_tokens=configs["embedder_ollama"].get("max_input_tokens", 2048),
         )
-        embedder_transformer = OllamaDocumentProcessor(embedder=embedder)
     else:
-        # Use OpenAI embedder
-        embedder = adal.Embedder(
-            model_client=configs["embedder"]["model_client"](),
-            model_kwargs=configs["embedder"]["model_kwargs"],
-        )
-        embedder_transformer = ToEmbeddings(
-            embedder=embedder, batch_size=configs["embedder"]["batch_size"]
-        )
+        embedder_config = configs["embedder"]
+        model_client = embedder_config["model_client"]()
+        if isinstance(model_client, OpenAIClient):
+            # Concurrent batches, paced by the model's rate limits
+            embedder_transformer = OpenAIEmbeddingExecutor(
+                model_client=model_client,
+                model_kwargs=embedder_config["model_kwargs"],
+                batch_size=embedder_config["batch_size"],
+                max_concurrency=embedder_config.get("max_concurrency", 4),
+                requests_per_minute=embedder_config.get("requests_per_minute", 0),
+                tokens_per_minute=embedder_config.get("tokens_per_minute", 0),
+                max_retries=embedder_config.get("max_retries", 6),
+                max_batch_tokens=embedder_config.get("max_batch_tokens", 300000),
+                max_input_tokens=embedder_config.get("max_input_tokens", 8191),
+            )
+        else:
+            embedder = adal.Embedder(model_client=model_client, model_kwargs=embedder_config["model_kwargs"])
+            embedder_transformer = ToEmbeddings(
+                embedder=embedder, batch_size=embedder_config["batch_size"]
+            )
 
     data_transformer = adal.Sequential(
-        splitter, embedder_transformer
+        *splitter, embedder_transformer
     )  # sequential will chain together splitter and embedder
     return data_transformer
 
+class ChunkEmbedder:
+    """
+    Embeds batches of chunks, taking the vectors of chunks embedded before from the chunk embedding cache.
+
+    Only cache misses are sent to the provider, whose client is created on the first miss.
+    """
+
+    def __init__(self, local_ollama: bool = False):
+        """
+        Args:
+            local_ollama (bool): Whether to use local Ollama for embedding
+        """
+        self.local_ollama = local_ollama
+        self.embedder_config = configs["embedder_ollama"] if local_ollama else configs["embedder"]
+        self._transformer = None
+
+    def __call__(self, chunks: List[Document]) -> List[Document]:
+        """
+        Embed chunks.
+
+        Args:
+            chunks (List[Document]): The chunks
+
+        Returns:
+            List[Document]: The chunks with their embeddings in `vector`, in the same order
+        """
+        cached = chunk_embedding_cache.get_many(self.embedder_config, [chunk.text for chunk in chunks])
+        misses = [i for i, vector in enumerate(cached) if vector is None]
+        for chunk, vector in zip(chunks, cached):
+            if vector is not None:
+                chunk.vector = vector
+        logger.info(f"Chunk embedding cache: {len(chunks) - len(misses)} of {len(chunks)} chunks cached, embedding {len(misses)}")
+        if not misses:
+            return chunks
+
+        if self._transformer is None:
+            self._transformer = prepare_data_pipeline(self.local_ollama, embed=True, split=False)
+        # Both embedder transformers keep one output per input, in order
+        embedded = self._transformer([chunks[i] for i in misses])
+        chunks = list(chunks)
+        for i, chunk in zip(misses, embedded):
+            chunks[i] = chunk
+        chunk_embedding_cache.put_many(
+            self.embedder_config, [chunk.text for chunk in embedded], [chunk.vector for chunk in embedded]
+        )
+        return chunks
+
+def write_documents(writer: ChunkStoreWriter, documents: Iterable[Document], local_ollama: bool = False,
+                    embed: bool = True) -> int:
+    """
+    Split, embed and append a stream of documents to a chunk store.
+
+    Each stage works on a bounded number of items: documents are split in batches on
+    the ingestion pool while earlier chunks are embedded, chunks are embedded once
+    an embedding batch is full, and embedded chunks are written to disk and dropped.
+    Memory use therefore does not grow with the size of the repository.
+
+    Args:
+        writer (ChunkStoreWriter): The store to append to
+        documents (Iterable[Document]): The documents, e.g. from `iter_documents`
+        local_ollama (bool): Whether to use local Ollama for embedding
+        embed (bool): Whether to embed the chunks; False writes text only, for lexical retrieval
+
+    Returns:
+        int: The number of documents written
+    """
+    embedder = ChunkEmbedder(local_ollama) if embed else None
+    # Enough chunks per call for every request the embedder keeps in flight
+    embed_batch_size = (
+        embedder.embedder_config.get("batch_size", 500) * embedder.embedder_config.get("max_concurrency", 1) if embed else 1
+    )
+    pending: List[Document] = []
+    source_texts: Dict[str, str] = {}
+    num_documents = 0
+
+    def flush(count: int):
+        batch = pending[:count]
+        del pending[:count]
+        writer.add_documents(embedder(batch) if embed else batch, source_texts)
+        waiting = {chunk.parent_doc_id for chunk in pending}
+        for doc_id in [doc_id for doc_id in source_texts if doc_id not in waiting]:
+            del source_texts[doc_id]
+
+    for batch, chunks in iter_chunks(documents):
+        num_documents += len(batch)
+        # Source texts are only needed to locate chunks of splitters that do not record their spans
+        source_texts.update({
+            doc.id: doc.text for doc in batch
+            if any("start_char" not in (chunk.meta_data or {}) for chunk in chunks)
+        })
+        pending.extend(chunks)
+        # Send full embedding batches only
+        if len(pending) >= embed_batch_size:
+            flush(len(pending) - len(pending) % embed_batch_size)
+    if pending:
+        flush(len(pending))
+    return num_documents
+
 def transform_documents_and_save_to_db(
-    documents: List[Document], db_path: str, local_ollama: bool = False
-) -> LocalDB:
+    documents: Iterable[Document], db_path: str, local_ollama: bool = False, embed: bool = True, commit: Optional[str] = None
+) -> ChunkStore:
     """
-    Transforms a list of documents and saves them to a local database.
+    Transforms documents and saves them to a local chunk store.
+
+    Documents are consumed as a stream (see `write_documents`), so an iterator such as
+    `iter_documents` indexes a repository without holding all of it in memory.
 
     Args:
-        documents (list): A list of `Document` objects.
-        db_path (str): The path to the local database file.
+        documents (Iterable[Document]): The `Document` objects, a list or an iterator.
+        db_path (str): The directory of the chunk store.
         local_ollama (bool): Whether to use local Ollama for embedding (default: False)
-    """
-    # Get the data transformer
-    data_transformer = prepare_data_pipeline(local_ollama)
+        embed (bool): Whether to embed the chunks; False builds a text-only store for lexical retrieval
+        commit (str, optional): Git commit the documents were read at, recorded for incremental refreshes
 
-    # Save the documents to a local database
-    db = LocalDB()
-    db.register_transformer(transformer=data_transformer, key="split_and_embed")
-    db.load(documents)
-    db.transform(key="split_and_embed")
+    Returns:
+        ChunkStore: The memory-mapped store of transformed documents
+    """
+    # Save the transformed documents as a columnar chunk store
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    db.save_state(filepath=db_path)
-    return db
+    with ChunkStoreWriter(db_path, dimensions=None if embed else 0, commit=commit) as writer:
+        num_documents = write_documents(writer, documents, local_ollama, embed)
+        store = writer.close()
+    logger.info(f"Saved {len(store)} chunks of {num_documents} documents to {db_path}")
+    _save_store_indexes(store, db_path)
+    return store
+
+def transform_documents_and_update_db(
+    store: ChunkStore, files: List[Tuple[str, str, str, bool]], removed_files: Set[str], db_path: str,
+    local_ollama: bool = False, embed: bool = True, commit: Optional[str] = None
+) -> ChunkStore:
+    """
+    Rewrites a chunk store with some files replaced, embedding only the new documents.
+
+    Chunks of unchanged files are copied with their embeddings; chunks of files in
+    `removed_files` or `files` are dropped, and `files` are read, split and embedded
+    as a stream. The BM25 and FAISS indexes are rebuilt from the stored texts and
+    vectors, which needs no embedding calls.
+
+    Args:
+        store (ChunkStore): The current store
+        files (List[Tuple[str, str, str, bool]]): Added and changed files, see `list_repository_files`
+        removed_files (Set[str]): Relative paths of deleted files, and of files no longer ingested
+        db_path (str): The directory of the chunk store; may be the directory of `store`
+        local_ollama (bool): Whether to use local Ollama for embedding (default: False)
+        embed (bool): Whether to embed the chunks; must match how `store` was built
+        commit (str, optional): Git commit the files were read at
+
+    Returns:
+        ChunkStore: The updated store
+    """
+    dropped = set(removed_files) | {entry[1] for entry in files}
+    file_kept = np.array([file["file_path"] not in dropped for file in store.files], dtype=bool)
+    kept = np.flatnonzero(file_kept[np.asarray(store.chunks["file_id"], dtype=np.int64)]) if len(store) else []
+
+    with ChunkStoreWriter(db_path, dimensions=(store.dimensions or None) if embed else 0, commit=commit) as writer:
+        writer.copy_chunks(store, kept)
+        num_documents = write_documents(writer, iter_documents(_code_first(files), local_ollama), local_ollama, embed)
+        updated = writer.close()
+    logger.info(
+        f"Updated {db_path}: kept {len(kept)} chunks, dropped {len(store) - len(kept)}, "
+        f"added {len(updated) - len(kept)} from {num_documents} changed files"
+    )
+    _save_store_indexes(updated, db_path)
+    return updated
+
+def _save_store_indexes(store: ChunkStore, db_path: str) -> None:
+    # Persist the BM25 and FAISS indexes next to the chunks so loads do not rebuild them
+    if len(store):
+        bm25 = get_lexical_config()["bm25"]
+        try:
+            LexicalIndex.build(store.iter_texts(), **bm25).save(store.lexical_dir)
+        except Exception as e:
+            logger.error(f"Error saving lexical index for {db_path}: {e}")
+    if len(store) and store.has_vectors:
+        index_config = get_index_config()
+        try:
+            save_index(
+                build_index(store.vectors, index_config),
+                store.index_path,
+                store.vectors_path,
+                spec=get_index_spec(len(store), store.dimensions, index_config),
+            )
+        except Exception as e:
+            logger.error(f"Error saving FAISS index for {db_path}: {e}")
 
 def get_github_file_content(repo_url: str, file_path: str, access_token: str = None) -> str:
     """
@@ -561,6 +914,56 @@ def get_file_content(repo_url: str, file_path: str, type: str = "github", access
     else:
         raise ValueError("Unsupported repository URL. Only GitHub and GitLab are supported.")
 
+def transform_documents_and_save_to_shards(
+    documents: List[Document], shards_dir: str, local_ollama: bool = False, embed: bool = True
+) -> ShardedChunkStore:
+    """
+    Splits documents into directory shards and saves each shard as its own chunk store.
+
+    Shards whose files, splitter and embedder are unchanged since the last build are
+    kept as they are, so only the changed parts of a large repository are re-embedded.
+
+    Args:
+        documents (list): A list of `Document` objects.
+        shards_dir (str): The directory of the sharded store.
+        local_ollama (bool): Whether to use local Ollama for embedding (default: False)
+        embed (bool): Whether to embed the chunks; False builds text-only stores for lexical retrieval
+
+    Returns:
+        ShardedChunkStore: The sharded store of transformed documents
+    """
+    sharding_config = get_sharding_config()
+    embedder_config = configs["embedder_ollama"] if local_ollama else configs["embedder"]
+    previous = {shard["name"]: shard for shard in (read_shards_manifest(shards_dir) or {}).get("shards", [])}
+    os.makedirs(shards_dir, exist_ok=True)
+
+    shards = []
+    rebuilt = 0
+    for name, shard in sorted(partition_documents(documents, sharding_config).items()):
+        fingerprint = documents_fingerprint(shard["documents"], embedder_config, embed)
+        store_dir = get_shard_store_dir(shards_dir, name)
+        if previous.get(name, {}).get("fingerprint") == fingerprint and store_exists(store_dir):
+            entry = dict(previous[name], directories=shard["directories"])
+        else:
+            logger.info(f"Building shard {name} from {len(shard['documents'])} documents")
+            store = transform_documents_and_save_to_db(shard["documents"], store_dir, local_ollama=local_ollama, embed=embed)
+            entry = {
+                "name": name,
+                "directories": shard["directories"],
+                "fingerprint": fingerprint,
+                "count": len(store),
+                "dimensions": store.dimensions,
+                "nbytes": store.nbytes,
+            }
+            store.close()
+            rebuilt += 1
+        shards.append(entry)
+
+    remove_stale_shards(shards_dir, [shard["name"] for shard in shards])
+    write_shards_manifest(shards_dir, shards, sharding_config)
+    logger.info(f"Saved {len(shards)} shards to {shards_dir} ({rebuilt} rebuilt, {len(shards) - rebuilt} unchanged)")
+    return ShardedChunkStore(shards_dir)
+
 class DatabaseManager:
     """
     Manages the creation, loading, transformation, and persistence of LocalDB instances.
@@ -568,11 +971,13 @@ class DatabaseManager:
 
     def __init__(self):
         self.db = None
+        self.index = None
+        self.lexical_index = None
         self.repo_url_or_path = None
         self.repo_paths = None
 
     def prepare_database(self, repo_url_or_path: str, type: str = "github", access_token: str = None, local_ollama: bool = False,
-                       excluded_dirs: List[str] = None, excluded_files: List[str] = None) -> List[Document]:
+                       excluded_dirs: List[str] = None, excluded_files: List[str] = None, refresh: bool = False) -> List[Document]:
         """
         Create a new database from the repository.
 
@@ -582,19 +987,37 @@ class DatabaseManager:
             local_ollama (bool): Whether to use local Ollama for embedding (default: False)
             excluded_dirs (List[str], optional): List of directories to exclude from processing
             excluded_files (List[str], optional): List of file patterns to exclude from processing
+            refresh (bool): Whether to bring an existing database up to date with the repository
 
         Returns:
             List[Document]: List of Document objects
         """
+        self.prepare_repo(repo_url_or_path, type, access_token)
+        return self.prepare_db_index(local_ollama=local_ollama, excluded_dirs=excluded_dirs, excluded_files=excluded_files,
+                                     refresh=refresh)
+
+    def prepare_repo(self, repo_url_or_path: str, type: str = "github", access_token: str = None) -> dict:
+        """
+        Reset the manager and prepare the repository paths without loading the database.
+
+        Args:
+            repo_url_or_path (str): The URL or local path of the repository
+            access_token (str, optional): Access token for private repositories
+
+        Returns:
+            dict: The repository paths (`save_repo_dir`, `save_db_file`, `save_store_dir` and `save_shards_dir`)
+        """
         self.reset_database()
         self._create_repo(repo_url_or_path, type, access_token)
-        return self.prepare_db_index(local_ollama=local_ollama, excluded_dirs=excluded_dirs, excluded_files=excluded_files)
+        return self.repo_paths
 
     def reset_database(self):
         """
         Reset the database to its initial state.
         """
         self.db = None
+        self.index = None
+        self.lexical_index = None
         self.repo_url_or_path = None
         self.repo_paths = None
 
@@ -603,7 +1026,9 @@ class DatabaseManager:
         Download and prepare all paths.
         Paths:
         ~/.adalflow/repos/{repo_name} (for url, local path will be the same)
-        ~/.adalflow/databases/{repo_name}.pkl
+        ~/.adalflow/databases/{repo_name}.store (chunk store)
+        ~/.adalflow/databases/{repo_name}.shards (per-directory chunk stores, when sharding is enabled)
+        ~/.adalflow/databases/{repo_name}.pkl (legacy pickled LocalDB, migrated on first load)
 
         Args:
             repo_url_or_path (str): The URL or local path of the repository
@@ -645,12 +1070,16 @@ class DatabaseManager:
                 save_repo_dir = repo_url_or_path
 
             save_db_file = os.path.join(root_path, "databases", f"{repo_name}.pkl")
+            save_store_dir = os.path.join(root_path, "databases", f"{repo_name}.store")
+            save_shards_dir = os.path.join(root_path, "databases", f"{repo_name}.shards")
             os.makedirs(save_repo_dir, exist_ok=True)
             os.makedirs(os.path.dirname(save_db_file), exist_ok=True)
 
             self.repo_paths = {
                 "save_repo_dir": save_repo_dir,
                 "save_db_file": save_db_file,
+                "save_store_dir": save_store_dir,
+                "save_shards_dir": save_shards_dir,
             }
             self.repo_url_or_path = repo_url_or_path
             logger.info(f"Repo paths: {self.repo_paths}")
@@ -659,46 +1088,305 @@ class DatabaseManager:
             logger.error(f"Failed to create repository structure: {e}")
             raise
 
-    def prepare_db_index(self, local_ollama: bool = False, excluded_dirs: List[str] = None, excluded_files: List[str] = None) -> List[Document]:
+    def prepare_db_index(self, local_ollama: bool = False, excluded_dirs: List[str] = None, excluded_files: List[str] = None,
+                         refresh: bool = False) -> ChunkStore:
         """
         Prepare the indexed database for the repository.
 
+        An existing database is used as it is unless `refresh` is set. A refresh pulls
+        new commits into downloaded repositories, diffs the checkout against the commit
+        the database was built from and re-embeds only the changed files.
+
         Args:
             local_ollama (bool): Whether to use local Ollama for embedding (default: False)
             excluded_dirs (List[str], optional): List of directories to exclude from processing
             excluded_files (List[str], optional): List of file patterns to exclude from processing
+            refresh (bool): Whether to bring an existing database up to date with the repository
 
         Returns:
-            List[Document]: List of Document objects
+            ChunkStore: Sequence of transformed Document objects
         """
+        if not refresh:
+            return self._prepare_db_index(local_ollama, excluded_dirs, excluded_files)
+        # Concurrent refreshes of one repository would pull into and rewrite the same database
+        with retriever_cache.build_lock(os.path.abspath(self.get_db_path())):
+            return self._prepare_db_index(local_ollama, excluded_dirs, excluded_files, refresh=True)
+
+    def _prepare_db_index(self, local_ollama: bool = False, excluded_dirs: List[str] = None,
+                          excluded_files: List[str] = None, refresh: bool = False) -> ChunkStore:
+        store_dir = self.repo_paths["save_store_dir"]
+        repo_dir = self.repo_paths["save_repo_dir"]
+        # Lexical-only retrieval works without an embedding provider
+        embed = get_lexical_config()["mode"] != "lexical"
+        if refresh and self._is_downloaded_repo():
+            pull_repo(repo_dir)
+        if get_sharding_config()["strategy"] != "none":
+            return self._prepare_sharded_db_index(local_ollama, embed, excluded_dirs, excluded_files, refresh)
+
         # check the database
-        if self.repo_paths and os.path.exists(self.repo_paths["save_db_file"]):
+        if store_exists(store_dir):
             logger.info("Loading existing database...")
             try:
-                self.db = LocalDB.load_state(self.repo_paths["save_db_file"])
-                documents = self.db.get_transformed_data(key="split_and_embed")
-                if documents:
-                    logger.info(f"Loaded {len(documents)} documents from existing database")
-                    return documents
+                self.db = ChunkStore(store_dir)
+                if len(self.db) and (self.db.has_vectors or not embed) and refresh:
+                    refreshed = self._refresh_db_index(self.db, local_ollama, embed, excluded_dirs, excluded_files)
+                    if refreshed is not None:
+                        self.db = refreshed
+                        logger.info(f"Refreshed database has {len(self.db)} documents")
+                        self._load_indexes(self.db)
+                        return self.db
+                    logger.info("Database cannot be refreshed incrementally, rebuilding it")
+                elif len(self.db) and (self.db.has_vectors or not embed):
+                    logger.info(f"Loaded {len(self.db)} documents from existing database")
+                    self._load_indexes(self.db)
+                    return self.db
+                elif len(self.db):
+                    logger.info("Existing database has no embeddings, rebuilding it for vector retrieval")
             except Exception as e:
                 logger.error(f"Error loading existing database: {e}")
                 # Continue to create a new database
+        elif os.path.exists(self.repo_paths["save_db_file"]):
+            try:
+                self.db = self._migrate_pickle_database()
+                if self.db is not None and len(self.db):
+                    self._load_indexes(self.db)
+                    return self.db
+            except Exception as e:
+                logger.error(f"Error migrating existing database: {e}")
+                # Continue to create a new database
 
         # prepare the database
         logger.info("Creating new database...")
+        # Read before reading the files, so changes made meanwhile are picked up by the next refresh
+        commit = get_git_commit(repo_dir)
+        # Files are read, split, embedded and written as a stream
+        files = list_repository_files(repo_dir, excluded_dirs, excluded_files)
+        self.db = transform_documents_and_save_to_db(
+            iter_documents(_code_first(files), local_ollama), store_dir, local_ollama=local_ollama, embed=embed, commit=commit
+        )
+        # Retrievers cached from the previous database must not be served any more
+        retriever_cache.invalidate(get_manifest_path(store_dir))
+        logger.info(f"Total files: {len(files)}")
+        logger.info(f"Total transformed documents: {len(self.db)}")
+        self._load_indexes(self.db)
+        return self.db
+
+    def _is_downloaded_repo(self) -> bool:
+        return self.repo_url_or_path.startswith("https://") or self.repo_url_or_path.startswith("http://")
+
+    def _refresh_db_index(self, store: ChunkStore, local_ollama: bool, embed: bool, excluded_dirs: List[str] = None,
+                          excluded_files: List[str] = None) -> Optional[ChunkStore]:
+        """
+        Update a chunk store to the repository's current checkout, re-embedding only changed files.
+
+        Files are re-read if git reports them changed since the store's commit, or if they
+        are ingested now but missing from the store (e.g. after a change of exclusions).
+        Chunks of deleted and no longer ingested files are dropped.
+
+        Args:
+            store (ChunkStore): The current store
+            local_ollama (bool): Whether to use local Ollama for embedding
+            embed (bool): Whether the retrieval mode needs embeddings
+            excluded_dirs (List[str], optional): List of directories to exclude from processing
+            excluded_files (List[str], optional): List of file patterns to exclude from processing
+
+        Returns:
+            ChunkStore: The updated store, `store` itself if nothing changed, or None if the
+                changes cannot be determined and the store must be rebuilt
+        """
+        repo_dir = self.repo_paths["save_repo_dir"]
+        store_dir = self.repo_paths["save_store_dir"]
+        commit = get_git_commit(repo_dir)
+        if commit is None or store.commit is None:
+            logger.info("No commit recorded for the database or the repository is not a git checkout")
+            return None
+        changed = get_changed_files(repo_dir, store.commit)
+        if changed is None:
+            return None
+
+        files = list_repository_files(repo_dir, excluded_dirs, excluded_files)
+        current = {entry[1].replace(os.sep, "/"): entry for entry in files}
+        indexed = {file["file_path"].replace(os.sep, "/") for file in store.files}
+        to_read = [entry for path, entry in current.items() if path in changed or path not in indexed]
+        removed = {path for path in indexed if path not in current}
+        if not to_read and not removed:
+            if commit != store.commit:
+                set_store_commit(store_dir, commit)
+                store.manifest["commit"] = commit
+            logger.info(f"Database is up to date with {commit[:12]}")
+            return store
+
+        logger.info(
+            f"Refreshing database from {store.commit[:12]} to {commit[:12]}: "
+            f"{len(to_read)} files to read, {len(removed)} removed"
+        )
+        updated = transform_documents_and_update_db(
+            store, to_read, removed, store_dir, local_ollama=local_ollama, embed=embed, commit=commit
+        )
+        store.close()
+        # Retrievers cached from the previous database must not be served any more
+        retriever_cache.invalidate(get_manifest_path(store_dir))
+        return updated
+
+    def get_db_path(self) -> str:
+        """
+        Get the path whose modification marks a rebuild of the repository's database.
+
+        Returns:
+            str: The shards manifest when sharding is enabled, otherwise the chunk store manifest
+        """
+        if get_sharding_config()["strategy"] != "none":
+            return get_shards_manifest_path(self.repo_paths["save_shards_dir"])
+        return get_manifest_path(self.repo_paths["save_store_dir"])
+
+    def _prepare_sharded_db_index(self, local_ollama: bool, embed: bool, excluded_dirs: List[str] = None,
+                                  excluded_files: List[str] = None, refresh: bool = False) -> ShardedChunkStore:
+        """
+        Prepare the indexed database of a repository stored as directory shards.
+
+        An existing sharded store is used if it matches the sharding configuration and
+        all its shards are present; otherwise, or on a refresh, the shards are rebuilt,
+        reusing those whose files are unchanged.
+
+        Args:
+            local_ollama (bool): Whether to use local Ollama for embedding
+            embed (bool): Whether the retrieval mode needs embeddings
+            excluded_dirs (List[str], optional): List of directories to exclude from processing
+            excluded_files (List[str], optional): List of file patterns to exclude from processing
+            refresh (bool): Whether to bring an existing database up to date with the repository
+
+        Returns:
+            ShardedChunkStore: The sharded store
+        """
+        shards_dir = self.repo_paths["save_shards_dir"]
+        sharding_config = get_sharding_config()
+        if shards_exist(shards_dir) and not refresh:
+            logger.info("Loading existing sharded database...")
+            try:
+                store = ShardedChunkStore(shards_dir)
+                current = (
+                    store.manifest["strategy"] == sharding_config["strategy"]
+                    and store.manifest["path_map"] == sharding_config["path_map"]
+                    and all(store_exists(get_shard_store_dir(shards_dir, shard["name"])) for shard in store.shards)
+                )
+                if current and len(store) and (store.has_vectors or not embed):
+                    logger.info(f"Loaded {len(store)} documents from {store.num_shards} shards")
+                    self.db = store
+                    self._load_indexes(self.db)
+                    return self.db
+                logger.info("Sharded database is incomplete or outdated, rebuilding changed shards")
+            except Exception as e:
+                logger.error(f"Error loading existing sharded database: {e}")
+
         documents = read_all_documents(
             self.repo_paths["save_repo_dir"],
             local_ollama=local_ollama,
             excluded_dirs=excluded_dirs,
             excluded_files=excluded_files
         )
-        self.db = transform_documents_and_save_to_db(
-            documents, self.repo_paths["save_db_file"], local_ollama=local_ollama
-        )
+        self.db = transform_documents_and_save_to_shards(documents, shards_dir, local_ollama=local_ollama, embed=embed)
+        # Retrievers cached from the previous database must not be served any more
+        retriever_cache.invalidate(get_shards_manifest_path(shards_dir))
         logger.info(f"Total documents: {len(documents)}")
-        transformed_docs = self.db.get_transformed_data(key="split_and_embed")
-        logger.info(f"Total transformed documents: {len(transformed_docs)}")
-        return transformed_docs
+        logger.info(f"Total transformed documents: {len(self.db)} in {self.db.num_shards} shards")
+        self._load_indexes(self.db)
+        return self.db
+
+    def _migrate_pickle_database(self) -> ChunkStore:
+        """
+        Convert a legacy pickled LocalDB into a chunk store and remove the pickle.
+
+        Returns:
+            ChunkStore: The migrated store, or None if the pickle holds no transformed documents
+        """
+        db_file = self.repo_paths["save_db_file"]
+        logger.info(f"Migrating pickled database {db_file} to a chunk store...")
+        documents = LocalDB.load_state(db_file).get_transformed_data(key="split_and_embed")
+        if not documents:
+            return None
+
+        with ChunkStoreWriter(self.repo_paths["save_store_dir"]) as writer:
+            writer.add_documents(documents)
+            store = writer.close()
+
+        # The pickle and any index persisted next to it are superseded by the store
+        base_path = os.path.splitext(db_file)[0]
+        for legacy_file in (db_file, f"{base_path}.faiss", f"{base_path}.faiss.json"):
+            if os.path.exists(legacy_file):
+                os.remove(legacy_file)
+        logger.info(f"Migrated {len(store)} documents from {db_file}")
+        return store
+
+    def _load_indexes(self, store: ChunkStore) -> None:
+        """
+        Load the indexes the configured retrieval mode needs into `index` and `lexical_index`.
+
+        Args:
+            store (ChunkStore): The transformed documents of the database, or a `ShardedChunkStore`
+        """
+        mode = get_lexical_config()["mode"]
+        if isinstance(store, ShardedChunkStore):
+            # Shard indexes are loaded by the retriever the first time a search reaches them
+            self.index = None
+            self.lexical_index = ShardedLexicalIndex(store, self._load_or_build_lexical_index) if mode != "vector" else None
+            return
+        self.index = self._load_or_build_index(store) if mode != "lexical" else None
+        self.lexical_index = self._load_or_build_lexical_index(store) if mode != "vector" else None
+
+    def _load_or_build_lexical_index(self, store: ChunkStore) -> LexicalIndex:
+        """
+        Load the persisted BM25 index for a chunk store, rebuilding it if missing or stale.
+
+        Args:
+            store (ChunkStore): The transformed documents of the database
+
+        Returns:
+            LexicalIndex: The index over the chunk texts, or None if the store is empty
+        """
+        if not len(store):
+            return None
+        bm25 = get_lexical_config()["bm25"]
+        lexical_index = LexicalIndex.load(store.lexical_dir, expected_num_docs=len(store), **bm25)
+        if lexical_index is not None:
+            return lexical_index
+
+        logger.info("Rebuilding lexical index from stored chunks...")
+        lexical_index = LexicalIndex.build(store.iter_texts(), **bm25)
+        try:
+            lexical_index.save(store.lexical_dir)
+        except OSError as e:
+            logger.error(f"Error saving lexical index for {store.store_dir}: {e}")
+        return lexical_index
+
+    def _load_or_build_index(self, store: ChunkStore):
+        """
+        Load the persisted FAISS index for a chunk store, rebuilding it if missing or stale.
+
+        Args:
+            store (ChunkStore): The transformed documents of the database
+
+        Returns:
+            faiss.Index: The index over the document vectors, or None if the store is empty
+                or holds no embeddings
+        """
+        if not len(store) or not store.has_vectors:
+            return None
+        index_config = get_index_config()
+        spec = get_index_spec(len(store), store.dimensions, index_config)
+        # Quantized indexes are a fraction of the vectors' size, so keep them fully in RAM
+        index = load_index(store.index_path, store.vectors_path, expected_ntotal=len(store), expected_spec=spec,
+                           mmap=not is_quantized(index_config))
+        if index is not None:
+            configure_search(index, index_config)
+            return index
+
+        logger.info(f"Rebuilding {spec} FAISS index from stored vectors...")
+        index = build_index(store.vectors, index_config)
+        try:
+            save_index(index, store.index_path, store.vectors_path, spec=spec)
+        except OSError as e:
+            logger.error(f"Error saving FAISS index for {store.store_dir}: {e}")
+        return index
 
     def prepare_retriever(self, repo_url_or_path: str, type: str = "github", access_token: str = None):
         """
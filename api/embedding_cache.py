@@ -0,0 +1,406 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from api.config import configs
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def make_query_key(embedder_config: Dict, query: str) -> Tuple:
+    """
+    Build the cache key for a query string and the embedder that embeds it.
+
+    Args:
+        embedder_config (dict): Embedder configuration (`configs["embedder"]` or `configs["embedder_ollama"]`)
+        query (str): The query text
+
+    Returns:
+        tuple: A hashable key
+    """
+    model_kwargs = embedder_config.get("model_kwargs", {})
+    return (
+        embedder_config.get("client_class"),
+        model_kwargs.get("model"),
+        model_kwargs.get("dimensions"),
+        query,
+    )
+
+class QueryEmbeddingCache:
+    """
+    Thread-safe LRU cache of query embeddings with a time-to-live and an optional SQLite tier.
+
+    The in-memory tier holds up to `max_entries` vectors. When `disk_path` is set,
+    vectors are also written to a SQLite database so they survive restarts and are
+    shared by worker processes on the same host; memory misses fall back to it.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 86400, disk_path: Optional[str] = None):
+        """
+        Args:
+            max_entries (int): Maximum number of vectors held in memory
+            ttl_seconds (float): Age after which a cached vector is re-embedded; 0 disables expiry
+            disk_path (str, optional): SQLite file of the on-disk tier
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self._entries: "OrderedDict[Tuple, Tuple[np.ndarray, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expirations = 0
+        if disk_path:
+            self._open_disk(disk_path)
+
+    def _open_disk(self, disk_path: str) -> None:
+        try:
+            os.makedirs(os.path.dirname(disk_path) or ".", exist_ok=True)
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)"
+            )
+            if self.ttl_seconds:
+                self._disk.execute(
+                    "DELETE FROM query_embeddings WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Could not open query embedding cache {disk_path}, using memory only: {e}")
+            self._disk = None
+
+    def _is_expired(self, created_at: float) -> bool:
+        return bool(self.ttl_seconds) and time.time() - created_at > self.ttl_seconds
+
+    @staticmethod
+    def _disk_key(key: Tuple) -> str:
+        return hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+
+    def get(self, key: Tuple) -> Optional[List[float]]:
+        """
+        Return the cached embedding for a key, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                vector, created_at = entry
+                if not self._is_expired(created_at):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector.tolist()
+                del self._entries[key]
+                self.expirations += 1
+
+            row = None
+            if self._disk is not None:
+                try:
+                    row = self._disk.execute(
+                        "SELECT vector, created_at FROM query_embeddings WHERE key = ?", (self._disk_key(key),)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    logger.warning(f"Error reading query embedding cache: {e}")
+            if row is not None and not self._is_expired(row[1]):
+                vector = np.frombuffer(row[0], dtype=np.float32)
+                self._insert(key, vector, row[1])
+                self.disk_hits += 1
+                return vector.tolist()
+
+            self.misses += 1
+            return None
+
+    def put(self, key: Tuple, embedding: List[float]) -> None:
+        """
+        Cache an embedding in memory and, if enabled, on disk.
+
+        Args:
+            key: Cache key, see `make_query_key`
+            embedding (List[float]): The query embedding
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        created_at = time.time()
+        with self._lock:
+            self._insert(key, vector, created_at)
+            if self._disk is not None:
+                try:
+                    self._disk.execute(
+                        "INSERT OR REPLACE INTO query_embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                        (self._disk_key(key), vector.tobytes(), created_at),
+                    )
+                except sqlite3.Error as e:
+                    logger.warning(f"Error writing query embedding cache: {e}")
+
+    def _insert(self, key: Tuple, vector: np.ndarray, created_at: float) -> None:
+        self._entries[key] = (vector, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop all cached embeddings, in memory and on disk."""
+        with self._lock:
+            self._entries.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM query_embeddings")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters of both tiers."""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "disk_path": self.disk_path if self._disk is not None else None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "expirations": self.expirations,
+            }
+
+def make_chunk_key(embedder_config: Dict, text: str) -> bytes:
+    """
+    Build the content address of a chunk embedding: a hash of the text and the embedder.
+
+    Identical chunks of different repositories, forks and rebuilds share the key.
+
+    Args:
+        embedder_config (dict): Embedder configuration (`configs["embedder"]` or `configs["embedder_ollama"]`)
+        text (str): The chunk text
+
+    Returns:
+        bytes: A 32-byte SHA-256 digest
+    """
+    model_kwargs = embedder_config.get("model_kwargs", {})
+    digest = hashlib.sha256(json.dumps([
+        embedder_config.get("client_class"),
+        model_kwargs.get("model"),
+        model_kwargs.get("dimensions"),
+    ]).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.digest()
+
+class ChunkEmbeddingCache:
+    """
+    Persistent, size-bounded cache of chunk embeddings in SQLite, addressed by content.
+
+    Indexing consults it before calling the embedding provider, so chunks that were
+    embedded before, in any repository, are not paid for again. When the stored
+    vectors exceed `max_size_mb`, the least recently used ones are evicted. The
+    database is opened on first use and can be shared by processes on the same host.
+    """
+
+    # Keys per SQL statement, below SQLite's bound-parameter limit
+    _BATCH_SIZE = 500
+
+    def __init__(self, path: Optional[str], max_size_mb: float = 4096):
+        """
+        Args:
+            path (str, optional): SQLite file; None disables the cache
+            max_size_mb (float): Bound on the size of the stored vectors
+        """
+        self.path = path
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self._db = None
+        self._opened = False
+        self._lock = threading.Lock()
+        # Running estimates of the stored vectors' number and size, measured on first use and
+        # again before evicting; writes by other processes sharing the file are seen only then
+        self._entries: Optional[int] = None
+        self._size_bytes: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get_db(self) -> Optional[sqlite3.Connection]:
+        if self._opened:
+            return self._db
+        self._opened = True
+        if not self.path:
+            return None
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS chunk_embeddings "
+                "(key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL) WITHOUT ROWID"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS chunk_embeddings_last_used ON chunk_embeddings (last_used)")
+        except sqlite3.Error as e:
+            logger.error(f"Could not open chunk embedding cache {self.path}, embedding without it: {e}")
+            self._db = None
+        return self._db
+
+    def get_many(self, embedder_config: Dict, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Look up the embeddings of several chunk texts.
+
+        Args:
+            embedder_config (dict): Embedder configuration the vectors must come from
+            texts (List[str]): The chunk texts
+
+        Returns:
+            List[Optional[List[float]]]: The cached embedding of each text, None for misses
+        """
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        with self._lock:
+            db = self._get_db()
+            if db is None:
+                return results
+            keys = [make_chunk_key(embedder_config, text) for text in texts]
+            found: Dict[bytes, bytes] = {}
+            try:
+                for start in range(0, len(keys), self._BATCH_SIZE):
+                    batch = list(set(keys[start:start + self._BATCH_SIZE]))
+                    placeholders = ",".join("?" * len(batch))
+                    found.update(db.execute(
+                        f"SELECT key, vector FROM chunk_embeddings WHERE key IN ({placeholders})", batch
+                    ).fetchall())
+                now = time.time()
+                hit_keys = list(found)
+                for start in range(0, len(hit_keys), self._BATCH_SIZE):
+                    batch = hit_keys[start:start + self._BATCH_SIZE]
+                    placeholders = ",".join("?" * len(batch))
+                    db.execute(f"UPDATE chunk_embeddings SET last_used = ? WHERE key IN ({placeholders})", [now, *batch])
+            except sqlite3.Error as e:
+                logger.warning(f"Error reading chunk embedding cache: {e}")
+                return results
+
+            for i, key in enumerate(keys):
+                vector = found.get(key)
+                if vector is not None:
+                    results[i] = np.frombuffer(vector, dtype=np.float32).tolist()
+            hits = sum(result is not None for result in results)
+            self.hits += hits
+            self.misses += len(texts) - hits
+        return results
+
+    def put_many(self, embedder_config: Dict, texts: List[str], embeddings: List[List[float]]) -> None:
+        """
+        Store the embeddings of several chunk texts, then evict down to the size bound.
+
+        Args:
+            embedder_config (dict): Embedder configuration that produced the vectors
+            texts (List[str]): The chunk texts
+            embeddings (List[List[float]]): Their embeddings
+        """
+        rows = [
+            (make_chunk_key(embedder_config, text), np.asarray(embedding, dtype=np.float32).tobytes())
+            for text, embedding in zip(texts, embeddings)
+            if embedding is not None and len(embedding)
+        ]
+        if not rows:
+            return
+        with self._lock:
+            db = self._get_db()
+            if db is None:
+                return
+            now = time.time()
+            try:
+                db.execute("BEGIN")
+                db.executemany(
+                    "INSERT OR REPLACE INTO chunk_embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    [(key, vector, now) for key, vector in rows],
+                )
+                db.execute("COMMIT")
+                if self._size_bytes is None:
+                    self._entries, self._size_bytes = self._measure(db)
+                else:
+                    # Replaced rows are counted twice, so this errs on the high side
+                    self._entries += len(rows)
+                    self._size_bytes += sum(len(vector) for _, vector in rows)
+                if self._size_bytes > self.max_size_bytes:
+                    self._evict(db)
+            except sqlite3.Error as e:
+                if db.in_transaction:
+                    db.execute("ROLLBACK")
+                logger.warning(f"Error writing chunk embedding cache: {e}")
+
+    def _measure(self, db: sqlite3.Connection) -> Tuple[int, int]:
+        """Count the stored vectors and their size in bytes with a full scan."""
+        return db.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM chunk_embeddings").fetchone()
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        # The running estimate only says eviction may be due; measure before deleting
+        count, size = self._measure(db)
+        self._entries, self._size_bytes = count, size
+        if size <= self.max_size_bytes or not count:
+            return
+        # Evict to 90% of the bound so the next writes do not evict again right away
+        excess = size - int(self.max_size_bytes * 0.9)
+        evicted = min(count, -(-excess * count // size))
+        db.execute(
+            "DELETE FROM chunk_embeddings WHERE key IN "
+            "(SELECT key FROM chunk_embeddings ORDER BY last_used LIMIT ?)",
+            (evicted,),
+        )
+        self._entries = count - evicted
+        self._size_bytes = size * (count - evicted) // count
+        self.evictions += evicted
+        logger.info(f"Evicted {evicted} least recently used chunk embeddings from {self.path}")
+
+    def clear(self) -> None:
+        """Drop all cached chunk embeddings."""
+        with self._lock:
+            db = self._get_db()
+            if db is not None:
+                db.execute("DELETE FROM chunk_embeddings")
+                self._entries = self._size_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return hit/miss counters and the size of the cache.
+
+        The size is the running estimate kept by writes; the table is only scanned
+        if nothing has measured it yet.
+        """
+        with self._lock:
+            db = self._get_db()
+            if db is not None and self._size_bytes is None:
+                try:
+                    self._entries, self._size_bytes = self._measure(db)
+                except sqlite3.Error as e:
+                    logger.warning(f"Error reading chunk embedding cache: {e}")
+            entries = self._entries or 0
+            size = self._size_bytes or 0
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path if db is not None else None,
+                "entries": entries,
+                "size_mb": round(size / (1024 * 1024), 2),
+                "max_size_mb": round(self.max_size_bytes / (1024 * 1024), 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+_cache_config = configs.get("query_embedding_cache", {})
+
+# Shared by all requests in this process
+query_embedding_cache = QueryEmbeddingCache(
+    max_entries=_cache_config.get("max_entries", 10000),
+    ttl_seconds=_cache_config.get("ttl_seconds", 86400),
+    disk_path=os.path.expanduser(_cache_config["disk_path"]) if _cache_config.get("disk_path") else None,
+)
+
+_chunk_cache_config = configs.get("chunk_embedding_cache", {})
+
+# Shared by all ingestions in this process
+chunk_embedding_cache = ChunkEmbeddingCache(
+    path=os.path.expanduser(_chunk_cache_config["path"]) if _chunk_cache_config.get("path") else None,
+    max_size_mb=_chunk_cache_config.get("max_size_mb", 4096),
+)
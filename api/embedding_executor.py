@@ -0,0 +1,374 @@
+import asyncio
+import logging
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from adalflow.core.component import DataComponent
+from adalflow.core.types import Document
+from openai import APIConnectionError, BadRequestError, InternalServerError, RateLimitError
+
+from api.openai_client import OpenAIClient
+from api.tokenization import count_tokens, make_token_batches, truncate_to_tokens
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def run_coroutine(coro):
+    """Run a coroutine to completion from synchronous code, also when called inside a running event loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # Called from async code: run on a thread with its own event loop
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a rate-limit reset duration such as "1s", "6m0s" or "20ms".
+
+    Args:
+        value (str, optional): The header value
+
+    Returns:
+        float: The duration in seconds, or None if it cannot be parsed
+    """
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * _DURATION_SECONDS[unit] for number, unit in parts)
+
+def _header_number(headers: Mapping[str, str], name: str) -> Optional[float]:
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """
+    A quota refilled continuously at `per_minute` units per minute, up to `per_minute` units.
+
+    A bucket with `per_minute=0` is unlimited.
+    """
+
+    def __init__(self, per_minute: float = 0):
+        self.per_minute = float(per_minute or 0)
+        self.available = self.per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.per_minute:
+            self.available = min(self.per_minute, self.available + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available; requests larger than the bucket wait for a full bucket."""
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        missing = min(amount, self.per_minute) - self.available
+        return missing * 60 / self.per_minute if missing > 0 else 0.0
+
+    def consume(self, amount: float) -> None:
+        if self.per_minute:
+            self.available -= min(amount, self.per_minute)
+
+    def update(self, limit: Optional[float], remaining: Optional[float], now: float) -> None:
+        """Adopt the limit and remaining quota reported by the provider, which also counts other clients' usage."""
+        self._refill(now)
+        if limit and not self.per_minute:
+            # First limit learned: the budget starts at what the provider has left
+            self.available = limit
+        if limit:
+            self.per_minute = limit
+        if remaining is not None and self.per_minute:
+            self.available = min(self.available, remaining)
+
+class RateLimiter:
+    """
+    Request and token budgets of one embedding model, shared by all executors of the process.
+
+    The budgets start from the configured requests and tokens per minute and follow the
+    provider's `x-ratelimit-*` response headers, so concurrent requests use the quota
+    without exceeding it. After a rate-limit error, all requests wait for the
+    `retry-after` delay.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        """
+        Args:
+            requests_per_minute (float): Initial request budget; 0 until the provider reports one
+            tokens_per_minute (float): Initial token budget; 0 until the provider reports one
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            delay = max(
+                self.paused_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(tokens, now),
+            )
+            if delay <= 0:
+                self.requests.consume(1)
+                self.tokens.consume(tokens)
+            return delay
+
+    async def acquire(self, tokens: int) -> None:
+        """
+        Wait until one request of `tokens` tokens fits in the budgets, and take it from them.
+
+        Args:
+            tokens (int): Estimated tokens of the request
+        """
+        while True:
+            delay = self._reserve(tokens)
+            if delay <= 0:
+                return
+            self.waited += delay
+            await asyncio.sleep(delay)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """
+        Adjust the budgets to the provider's rate-limit response headers.
+
+        Args:
+            headers (Mapping[str, str]): Response headers
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.requests.update(
+                _header_number(headers, "x-ratelimit-limit-requests"),
+                _header_number(headers, "x-ratelimit-remaining-requests"),
+                now,
+            )
+            self.tokens.update(
+                _header_number(headers, "x-ratelimit-limit-tokens"),
+                _header_number(headers, "x-ratelimit-remaining-tokens"),
+                now,
+            )
+
+    def pause(self, seconds: float) -> None:
+        """Hold back all requests for `seconds`, e.g. after a rate-limit error."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+# One limiter per API endpoint and model, shared by concurrent ingestions
+_rate_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(base_url: str, model: str, requests_per_minute: float = 0,
+                     tokens_per_minute: float = 0) -> RateLimiter:
+    """
+    Get the rate limiter of an embedding model, creating it on first use.
+
+    Args:
+        base_url (str): The API endpoint
+        model (str): The embedding model
+        requests_per_minute (float): Initial request budget of a new limiter
+        tokens_per_minute (float): Initial token budget of a new limiter
+
+    Returns:
+        RateLimiter: The limiter
+    """
+    with _rate_limiters_lock:
+        key = (base_url, model)
+        if key not in _rate_limiters:
+            _rate_limiters[key] = RateLimiter(requests_per_minute, tokens_per_minute)
+        return _rate_limiters[key]
+
+def _retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    retry_after_ms = _header_number(headers, "retry-after-ms")
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    return _header_number(headers, "retry-after") or parse_reset_duration(headers.get("x-ratelimit-reset-tokens"))
+
+def prepare_inputs(documents: Sequence[Document], max_input_tokens: int,
+                   local_ollama: bool = False) -> Tuple[List[str], List[int]]:
+    """
+    Get the texts to embed and their token counts, truncating texts over the model's input limit.
+
+    Token counts come from ingestion (`estimated_num_tokens`) and are only counted for
+    documents without one. Texts longer than `max_input_tokens` are cut to their first
+    `max_input_tokens` tokens, so the same chunk always gets the same embedding.
+
+    Args:
+        documents (Sequence[Document]): The documents
+        max_input_tokens (int): Maximum tokens the embedding model accepts per input
+        local_ollama (bool): Whether the tokens are for local Ollama models
+
+    Returns:
+        Tuple[List[str], List[int]]: The texts and their token counts after truncation
+    """
+    texts = [doc.text or "" for doc in documents]
+    token_counts = [
+        doc.estimated_num_tokens if doc.estimated_num_tokens is not None else count_tokens(text, local_ollama)
+        for doc, text in zip(documents, texts)
+    ]
+    truncated = 0
+    for i, count in enumerate(token_counts):
+        if count > max_input_tokens:
+            texts[i] = truncate_to_tokens(texts[i], max_input_tokens, local_ollama)
+            token_counts[i] = max_input_tokens
+            truncated += 1
+    if truncated:
+        logger.warning(f"Truncated {truncated} inputs to the embedding model's limit of {max_input_tokens} tokens")
+    return texts, token_counts
+
+class OpenAIEmbeddingExecutor(DataComponent):
+    """
+    Embed documents with an OpenAI-compatible API, several batches at a time.
+
+    Batches hold at most `batch_size` documents and `max_batch_tokens` tokens, and are
+    sent concurrently through the async client of an `OpenAIClient`, with up to
+    `max_concurrency` requests in flight, paced by the model's shared `RateLimiter`.
+    Rate-limit errors pause all requests for the delay the provider asks for; they and
+    transient errors are retried with exponential backoff up to `max_retries` times. A
+    batch the provider rejects is split in halves until the bad inputs are isolated.
+    """
+
+    def __init__(self, model_client: OpenAIClient, model_kwargs: Dict[str, Any], batch_size: int = 500,
+                 max_concurrency: int = 4, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_retries: int = 6, max_batch_tokens: int = 300000, max_input_tokens: int = 8191):
+        """
+        Args:
+            model_client (OpenAIClient): The client whose API key and endpoint are used
+            model_kwargs (dict): `model` and other arguments of the embeddings call (e.g. `dimensions`)
+            batch_size (int): Maximum documents per request
+            max_concurrency (int): Requests in flight
+            requests_per_minute (float): Request budget until the provider reports one; 0 for none
+            tokens_per_minute (float): Token budget until the provider reports one; 0 for none
+            max_retries (int): Retries of a batch after rate-limit and transient errors
+            max_batch_tokens (int): Maximum tokens per request
+            max_input_tokens (int): Maximum tokens per document; longer documents are truncated
+        """
+        super().__init__()
+        self.model_client = model_client
+        self.model_kwargs = dict(model_kwargs)
+        self.batch_size = max(int(batch_size), 1)
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.max_retries = max(int(max_retries), 0)
+        self.max_batch_tokens = max(int(max_batch_tokens), 1)
+        self.max_input_tokens = max(int(max_input_tokens), 1)
+        self.rate_limiter = get_rate_limiter(
+            model_client.base_url, self.model_kwargs.get("model"), requests_per_minute, tokens_per_minute
+        )
+
+    async def _embed_batch(self, client, semaphore: asyncio.Semaphore, texts: List[str],
+                           token_counts: List[int]) -> List[Optional[List[float]]]:
+        tokens = sum(token_counts)
+        for attempt in range(self.max_retries + 1):
+            async with semaphore:
+                await self.rate_limiter.acquire(tokens)
+                try:
+                    raw_response = await client.embeddings.with_raw_response.create(input=texts, **self.model_kwargs)
+                    self.rate_limiter.update(raw_response.headers)
+                    response = raw_response.parse()
+                    self._requests += 1
+                    self._tokens += tokens
+                    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+                except RateLimitError as e:
+                    self.rate_limiter.update(e.response.headers)
+                    delay = _retry_after(e.response.headers) or min(2 ** attempt, 60)
+                    self.rate_limiter.pause(delay)
+                    error = e
+                except (APIConnectionError, InternalServerError) as e:
+                    delay = min(2 ** attempt, 60) * random.uniform(0.5, 1.0)
+                    error = e
+                except BadRequestError as e:
+                    self._requests += 1
+                    if len(texts) == 1:
+                        logger.error(f"Error embedding document: {e}")
+                        return [None]
+                    error = e
+                    break
+                except Exception as e:
+                    logger.error(f"Error embedding a batch of {len(texts)} documents: {e}")
+                    return [None] * len(texts)
+            if attempt < self.max_retries:
+                logger.warning(f"Embedding request failed ({error}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        else:
+            logger.error(f"Giving up on a batch of {len(texts)} documents after {self.max_retries + 1} attempts: {error}")
+            return [None] * len(texts)
+
+        # Rejected batch: retry its halves, outside the semaphore so they can take its slot
+        logger.warning(f"Batch of {len(texts)} documents rejected ({error}), retrying it in halves")
+        middle = len(texts) // 2
+        first, second = await asyncio.gather(
+            self._embed_batch(client, semaphore, texts[:middle], token_counts[:middle]),
+            self._embed_batch(client, semaphore, texts[middle:], token_counts[middle:]),
+        )
+        return first + second
+
+    async def _embed(self, texts: List[str], token_counts: List[int]) -> List[Optional[List[float]]]:
+        # A client per event loop, since its connections belong to the loop; retries are
+        # paced here, by the rate limiter, not by the client
+        client = self.model_client.init_async_client().with_options(max_retries=0)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        batches = make_token_batches(token_counts, self.max_batch_tokens, self.batch_size)
+        try:
+            results = await asyncio.gather(*(
+                self._embed_batch(client, semaphore, texts[start:end], token_counts[start:end])
+                for start, end in batches
+            ))
+        finally:
+            await client.close()
+        return [embedding for batch_results in results for embedding in batch_results]
+
+    def __call__(self, documents: Sequence[Document]) -> Sequence[Document]:
+        """
+        Embed documents.
+
+        Args:
+            documents (Sequence[Document]): The documents
+
+        Returns:
+            Sequence[Document]: Copies of the documents, in the same order, with their embeddings in `vector`;
+                documents that could not be embedded keep their vector
+        """
+        output = [copy(doc) for doc in documents]
+        if not output:
+            return output
+        texts, token_counts = prepare_inputs(output, self.max_input_tokens)
+        self._requests = 0
+        self._tokens = 0
+        waited = self.rate_limiter.waited
+        start_time = time.perf_counter()
+        embeddings = run_coroutine(self._embed(texts, token_counts))
+        for doc, embedding in zip(output, embeddings):
+            if embedding is not None:
+                doc.vector = embedding
+        seconds = time.perf_counter() - start_time
+        embedded = sum(embedding is not None for embedding in embeddings)
+        logger.info(
+            f"Embedded {embedded} of {len(output)} documents in {self._requests} requests, {seconds:.2f}s "
+            f"({len(output) / seconds if seconds > 0 else 0.0:.1f} documents/s, "
+            f"{self._tokens / seconds if seconds > 0 else 0.0:.0f} tokens/s, "
+            f"requests waited {self.rate_limiter.waited - waited:.1f}s in total for the rate limit)"
+        )
+        return output
+
+    def _extra_repr(self) -> str:
+        return (
+            f"model={self.model_kwargs.get('model')}, batch_size={self.batch_size}, "
+            f"max_batch_tokens={self.max_batch_tokens}, max_concurrency={self.max_concurrency}"
+        )
@@ -0,0 +1,186 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from itertools import chain, islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from api.config import configs
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_INGESTION_CONFIG = {
+    # Worker processes; 0 uses one per CPU
+    "max_workers": 0,
+    # Stages with fewer items run in the calling process, where starting workers would cost more than it saves
+    "min_parallel_items": 64,
+    # Items sent to a worker per task
+    "batch_size": 32,
+    # "spawn" is safe in a threaded server; "fork" starts faster where it is safe
+    "start_method": "spawn",
+    # Batches a streaming stage keeps in flight, bounding its memory; 0 uses two per worker
+    "max_pending_batches": 0,
+}
+
+def get_ingestion_config() -> Dict[str, Any]:
+    """
+    Get the ingestion configuration, with defaults for missing keys.
+
+    Returns:
+        dict: The ingestion configuration
+    """
+    ingestion_config = {**DEFAULT_INGESTION_CONFIG, **configs.get("ingestion", {})}
+    if not ingestion_config["max_workers"]:
+        ingestion_config["max_workers"] = os.cpu_count() or 1
+    if not ingestion_config["max_pending_batches"]:
+        ingestion_config["max_pending_batches"] = 2 * ingestion_config["max_workers"]
+    return ingestion_config
+
+@dataclass
+class StageStats:
+    """
+    Throughput of one ingestion stage.
+
+    Attributes:
+        name: Stage name, e.g. "read" or "split"
+        items: Number of inputs, counted in `unit`
+        outputs: Number of results, counted in `output_unit`
+        seconds: Wall-clock duration of the stage
+        workers: Number of processes the stage ran on
+        unit: Name of the inputs, e.g. "files"
+        output_unit: Name of the results, e.g. "chunks"
+    """
+    name: str
+    items: int
+    outputs: int
+    seconds: float
+    workers: int
+    unit: str = "items"
+    output_unit: str = "items"
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def outputs_per_second(self) -> float:
+        return self.outputs / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.items} {self.unit} -> {self.outputs} {self.output_unit} in {self.seconds:.2f}s "
+            f"({self.items_per_second:.1f} {self.unit}/s, {self.outputs_per_second:.1f} {self.output_unit}/s) "
+            f"on {self.workers} process{'es' if self.workers != 1 else ''}"
+        )
+
+# Created on first use and shared by all ingestions, so worker start-up is paid once
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool(ingestion_config: Dict[str, Any]) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=ingestion_config["max_workers"],
+                mp_context=multiprocessing.get_context(ingestion_config["start_method"]),
+            )
+            logger.info(f"Started ingestion pool with {ingestion_config['max_workers']} processes")
+        return _pool
+
+def shutdown_pool() -> None:
+    """Stop the ingestion worker processes; the next parallel stage starts new ones."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def stream_stage(name: str, fn: Callable[[List[Any]], List[Any]], items: Iterable[Any],
+                 unit: str = "items", output_unit: str = "items",
+                 stats: Optional[StageStats] = None) -> Iterator[Tuple[List[Any], List[Any]]]:
+    """
+    Run one ingestion stage over a stream of items, on the process pool if it is large enough.
+
+    Items are consumed lazily and sent to the workers in batches, with at most
+    `max_pending_batches` batches in flight, so a stage holds a bounded number of
+    items whatever the size of its input. Stages chain by passing one stage's results
+    as the next one's items; they then run concurrently on the shared pool. Results
+    are yielded in input order, so the output does not depend on the number of workers
+    or on which worker finishes first. If the pool breaks (e.g. a worker is killed),
+    the remaining batches run in the calling process.
+
+    Args:
+        name (str): Stage name used in the log
+        fn (Callable): Module-level function (or `functools.partial` of one) mapping a batch of items
+            to a list of results; it runs in worker processes, so it and its items must be picklable
+        items (Iterable): The inputs
+        unit (str): Name of the inputs in the throughput report, e.g. "files"
+        output_unit (str): Name of the results in the throughput report, e.g. "chunks"
+        stats (StageStats, optional): Updated with the stage's throughput as it runs
+
+    Returns:
+        Iterator[Tuple[List, List]]: Each batch of inputs with its results
+    """
+    ingestion_config = get_ingestion_config()
+    batch_size = max(int(ingestion_config["batch_size"]), 1)
+    max_pending = max(int(ingestion_config["max_pending_batches"]), 1)
+    if stats is None:
+        stats = StageStats(name, 0, 0, 0.0, 1, unit, output_unit)
+    start_time = time.perf_counter()
+
+    # Look ahead far enough to tell whether the stage is worth running on the pool
+    items = iter(items)
+    head = list(islice(items, ingestion_config["min_parallel_items"]))
+    pool = None
+    if len(head) >= ingestion_config["min_parallel_items"] and ingestion_config["max_workers"] > 1:
+        pool = _get_pool(ingestion_config)
+        stats.workers = ingestion_config["max_workers"]
+    items = chain(head, items)
+    batches = iter(lambda: list(islice(items, batch_size)), [])
+
+    pending = deque()
+    try:
+        while True:
+            # Keep the pool busy up to the bound before waiting for the oldest batch
+            while pool is not None and len(pending) < max_pending:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                pending.append((batch, pool.submit(fn, batch)))
+            if pending:
+                batch, future = pending.popleft()
+                if future is None:
+                    results = fn(batch)
+                else:
+                    try:
+                        results = future.result()
+                    except BrokenProcessPool as e:
+                        logger.error(f"Ingestion pool failed during {name}, continuing in this process: {e}")
+                        shutdown_pool()
+                        pool = None
+                        stats.workers = 1
+                        # Batches not yielded yet are rerun in order
+                        pending = deque((pending_batch, None) for pending_batch, _ in pending)
+                        results = fn(batch)
+            else:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                results = fn(batch)
+            results = list(results)
+            stats.items += len(batch)
+            stats.outputs += len(results)
+            yield batch, results
+    finally:
+        for _, future in pending:
+            if future is not None:
+                future.cancel()
+        stats.seconds = time.perf_counter() - start_time
+        logger.info(f"Ingestion stage {stats}")
@@ -0,0 +1,299 @@
+import json
+import logging
+import math
+import os
+import re
+from array import array
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from api.chunk_store import replace_dir, unique_tmp_path
+from api.config import configs
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Bump whenever the on-disk layout of the lexical index changes
+LEXICAL_FORMAT_VERSION = 1
+
+RETRIEVAL_MODES = ["vector", "hybrid", "lexical"]
+
+DEFAULT_LEXICAL_CONFIG: Dict[str, Any] = {
+    # "vector" (embeddings only), "hybrid" (embeddings + BM25, fused) or "lexical" (BM25 only, no embeddings)
+    "mode": "vector",
+    "bm25": {"k1": 1.2, "b": 0.75},
+    # Each ranking contributes candidate_factor * top_k candidates to reciprocal rank fusion
+    "fusion": {"rrf_k": 60, "candidate_factor": 2},
+}
+
+TERMS_FILE = "terms.json"
+INDPTR_FILE = "indptr.npy"
+DOC_IDS_FILE = "doc_ids.npy"
+TERM_FREQS_FILE = "term_freqs.npy"
+DOC_LENGTHS_FILE = "doc_lengths.npy"
+META_FILE = "meta.json"
+
+# Identifiers (snake_case, camelCase, dotted paths split at the dots) and numbers
+_WORD_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|[0-9]+")
+# Sub-words of an identifier: "parseHTTPResponse_v2" -> parse, HTTP, Response, v, 2
+_SUBWORD_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+MIN_TOKEN_LENGTH = 2
+
+def get_lexical_config(retriever_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Merge the retriever configuration over the lexical retrieval defaults.
+
+    Args:
+        retriever_config (dict, optional): Defaults to `configs["retriever"]`
+
+    Returns:
+        dict: The retrieval mode with its BM25 and fusion parameters
+    """
+    if retriever_config is None:
+        retriever_config = configs.get("retriever", {})
+    lexical_config = {}
+    for key, default in DEFAULT_LEXICAL_CONFIG.items():
+        value = retriever_config.get(key, default)
+        lexical_config[key] = {**default, **value} if isinstance(default, dict) else value
+    if lexical_config["mode"] not in RETRIEVAL_MODES:
+        raise ValueError(f"Invalid retrieval mode '{lexical_config['mode']}', expected one of {RETRIEVAL_MODES}")
+    return lexical_config
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into identifier-aware, lowercased search terms.
+
+    Every identifier is kept whole and, if it is a compound, also split into its
+    snake_case / camelCase parts, so `get_index_spec` matches both the exact name
+    and queries mentioning "index spec".
+
+    Args:
+        text (str): Source code or natural language
+
+    Returns:
+        List[str]: The terms, in order of occurrence
+    """
+    tokens = []
+    for word in _WORD_RE.findall(text):
+        tokens.extend(_word_terms(word))
+    return tokens
+
+@lru_cache(maxsize=65536)
+def _word_terms(word: str) -> Tuple[str, ...]:
+    # Identifiers repeat heavily within a repository, so their splits are memoized
+    terms = [word.lower()] if len(word) >= MIN_TOKEN_LENGTH else []
+    parts = _SUBWORD_RE.findall(word)
+    if len(parts) > 1:
+        terms.extend(part.lower() for part in parts if len(part) >= MIN_TOKEN_LENGTH)
+    return tuple(terms)
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the chunks of a chunk store.
+
+    Postings are stored in CSR form: the postings of term `t` are
+    `doc_ids[indptr[t]:indptr[t + 1]]` with matching `term_freqs`. The arrays are
+    memory-mapped when loaded from disk; only the vocabulary is held in a dict.
+    """
+
+    def __init__(self, terms: Dict[str, int], indptr: np.ndarray, doc_ids: np.ndarray,
+                 term_freqs: np.ndarray, doc_lengths: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        """
+        Args:
+            terms (dict): Term to term id
+            indptr (np.ndarray): Postings offsets per term id (num_terms + 1)
+            doc_ids (np.ndarray): Chunk index of each posting
+            term_freqs (np.ndarray): Term frequency of each posting
+            doc_lengths (np.ndarray): Number of terms per chunk
+            k1 (float): BM25 term frequency saturation
+            b (float): BM25 document length normalization
+        """
+        self.terms = terms
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.num_docs = int(doc_lengths.shape[0])
+        self.avg_doc_length = float(doc_lengths.mean()) if self.num_docs else 0.0
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = 1.2, b: float = 0.75) -> "LexicalIndex":
+        """
+        Build the index from chunk texts.
+
+        Args:
+            texts (Iterable[str]): Chunk texts, in chunk index order
+            k1 (float): BM25 term frequency saturation
+            b (float): BM25 document length normalization
+
+        Returns:
+            LexicalIndex: The in-memory index
+        """
+        terms: Dict[str, int] = {}
+        posting_terms, posting_freqs = array("i"), array("i")
+        doc_lengths, doc_num_terms = array("i"), array("i")
+        for text in texts:
+            tokens = tokenize(text or "")
+            counts = Counter(tokens)
+            doc_lengths.append(len(tokens))
+            doc_num_terms.append(len(counts))
+            posting_terms.extend([terms.setdefault(term, len(terms)) for term in counts])
+            posting_freqs.extend(counts.values())
+
+        posting_terms = np.frombuffer(posting_terms, dtype=np.int32)
+        posting_docs = np.repeat(np.arange(len(doc_lengths), dtype=np.int32), np.frombuffer(doc_num_terms, dtype=np.int32))
+        # Stable sort keeps the postings of each term in chunk order
+        order = np.argsort(posting_terms, kind="stable")
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_terms, minlength=len(terms)), out=indptr[1:])
+        return cls(
+            terms,
+            indptr,
+            posting_docs[order],
+            np.frombuffer(posting_freqs, dtype=np.int32)[order],
+            np.frombuffer(doc_lengths, dtype=np.int32).copy(),
+            k1=k1,
+            b=b,
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the postings and vocabulary."""
+        arrays = self.indptr.nbytes + self.doc_ids.nbytes + self.term_freqs.nbytes + self.doc_lengths.nbytes
+        # Vocabulary dict: key string plus dict slot, roughly
+        return int(arrays + 100 * len(self.terms))
+
+    def search(self, query: str, top_k: int, chunk_mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rank chunks by BM25 score for a query.
+
+        Args:
+            query (str): The query text
+            top_k (int): Number of results
+            chunk_mask (np.ndarray, optional): Boolean mask of the chunks that may be returned
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Chunk indices and scores, best first;
+                chunks without any query term are never returned
+        """
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.terms.get(term)
+            if term_id is None:
+                continue
+            start, end = int(self.indptr[term_id]), int(self.indptr[term_id + 1])
+            doc_ids = np.asarray(self.doc_ids[start:end])
+            term_freqs = np.asarray(self.term_freqs[start:end], dtype=np.float32)
+            doc_freq = end - start
+            idf = math.log(1.0 + (self.num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+            length_norm = 1.0 - self.b + self.b * self.doc_lengths[doc_ids] / max(self.avg_doc_length, 1.0)
+            scores[doc_ids] += idf * term_freqs * (self.k1 + 1.0) / (term_freqs + self.k1 * length_norm)
+
+        if chunk_mask is not None:
+            scores[~chunk_mask] = 0.0
+        candidates = np.flatnonzero(scores)
+        if candidates.size > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return candidates.astype(np.int64), scores[candidates]
+
+    def save(self, index_dir: str) -> None:
+        """
+        Write the index to a directory, replacing it atomically.
+
+        Args:
+            index_dir (str): Target directory, e.g. `ChunkStore.lexical_dir`
+        """
+        tmp_dir = unique_tmp_path(index_dir)
+        os.makedirs(tmp_dir)
+        vocabulary = [None] * len(self.terms)
+        for term, term_id in self.terms.items():
+            vocabulary[term_id] = term
+        with open(os.path.join(tmp_dir, TERMS_FILE), "w") as f:
+            json.dump(vocabulary, f)
+        np.save(os.path.join(tmp_dir, INDPTR_FILE), self.indptr)
+        np.save(os.path.join(tmp_dir, DOC_IDS_FILE), self.doc_ids)
+        np.save(os.path.join(tmp_dir, TERM_FREQS_FILE), self.term_freqs)
+        np.save(os.path.join(tmp_dir, DOC_LENGTHS_FILE), self.doc_lengths)
+        with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+            json.dump({
+                "version": LEXICAL_FORMAT_VERSION,
+                "num_docs": self.num_docs,
+                "num_terms": len(self.terms),
+                "num_postings": int(self.doc_ids.shape[0]),
+            }, f)
+
+        replace_dir(tmp_dir, index_dir)
+        logger.info(f"Saved lexical index with {len(self.terms)} terms over {self.num_docs} chunks to {index_dir}")
+
+    @classmethod
+    def load(cls, index_dir: str, expected_num_docs: Optional[int] = None,
+             k1: float = 1.2, b: float = 0.75) -> Optional["LexicalIndex"]:
+        """
+        Load a persisted index with memory-mapped postings.
+
+        Args:
+            index_dir (str): Directory written by `save`
+            expected_num_docs (int, optional): Number of chunks the index must cover
+            k1 (float): BM25 term frequency saturation
+            b (float): BM25 document length normalization
+
+        Returns:
+            LexicalIndex: The index, or None if it is missing, outdated or does not match
+        """
+        try:
+            with open(os.path.join(index_dir, META_FILE), "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != LEXICAL_FORMAT_VERSION:
+            logger.info(f"Lexical index {index_dir} has an outdated format, it will be rebuilt")
+            return None
+        if expected_num_docs is not None and meta.get("num_docs") != expected_num_docs:
+            logger.warning(f"Lexical index {index_dir} covers {meta.get('num_docs')} chunks, expected {expected_num_docs}")
+            return None
+
+        try:
+            with open(os.path.join(index_dir, TERMS_FILE), "r") as f:
+                vocabulary = json.load(f)
+            return cls(
+                {term: term_id for term_id, term in enumerate(vocabulary)},
+                np.load(os.path.join(index_dir, INDPTR_FILE), mmap_mode="r"),
+                np.load(os.path.join(index_dir, DOC_IDS_FILE), mmap_mode="r"),
+                np.load(os.path.join(index_dir, TERM_FREQS_FILE), mmap_mode="r"),
+                np.load(os.path.join(index_dir, DOC_LENGTHS_FILE), mmap_mode="r"),
+                k1=k1,
+                b=b,
+            )
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading lexical index {index_dir}: {e}")
+            return None
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], top_k: int, k: int = 60) -> Tuple[List[int], List[float]]:
+    """
+    Fuse several rankings of chunk indices with reciprocal rank fusion.
+
+    Each chunk scores `sum(1 / (k + rank))` over the rankings it appears in, so chunks
+    ranked well by both the vector and the lexical search come first.
+
+    Args:
+        rankings (Sequence[Sequence[int]]): Chunk indices, best first, one sequence per ranking
+        top_k (int): Number of fused results
+        k (int): Rank smoothing constant
+
+    Returns:
+        Tuple[List[int], List[float]]: Fused chunk indices and their scores, best first
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_index in enumerate(ranking):
+            if doc_index < 0:
+                continue
+            fused[int(doc_index)] = fused.get(int(doc_index), 0.0) + 1.0 / (k + rank + 1)
+    best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+    return [doc_index for doc_index, _ in best], [score for _, score in best]
@@ -1,11 +1,16 @@
-from typing import Sequence, List
-from copy import deepcopy
-from tqdm import tqdm
+from typing import Any, Dict, Sequence, List, Optional
+from copy import copy
+import asyncio
 import logging
-import adalflow as adal
+import os
+import time
+import ollama
 from adalflow.core.types import Document
 from adalflow.core.component import DataComponent
 
+from api.embedding_executor import prepare_inputs, run_coroutine
+from api.tokenization import make_token_batches
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -13,29 +18,96 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class OllamaDocumentProcessor(DataComponent):
+class OllamaBatchEmbedder(DataComponent):
     """
-    Process documents for Ollama embeddings by processing one document at a time.
-    Adalflow Ollama Client does not support batch embedding, so we need to process each document individually.
+    Embed documents with Ollama's multi-input `/api/embed` endpoint, several requests at a time.
+
+    Requests hold at most `batch_size` documents and `max_batch_tokens` tokens, with up to
+    `max_concurrency` requests in flight, so the Ollama server is kept busy instead of
+    waiting on one round trip per document. If a request fails, its documents are
+    retried one by one, so a bad input only loses its own embedding.
     """
-    def __init__(self, embedder: adal.Embedder) -> None:
+    def __init__(self, model_kwargs: Dict[str, Any], batch_size: int = 32, max_concurrency: int = 4,
+                 host: Optional[str] = None, max_batch_tokens: int = 16384, max_input_tokens: int = 2048) -> None:
+        """
+        Args:
+            model_kwargs (dict): `model` and other arguments of Ollama's embed call (e.g. `options`, `keep_alive`)
+            batch_size (int): Maximum documents per request
+            max_concurrency (int): Requests in flight
+            host (str, optional): Ollama server; defaults to the `OLLAMA_HOST` environment variable
+            max_batch_tokens (int): Maximum tokens per request
+            max_input_tokens (int): Maximum tokens per document, the model's context; longer documents are truncated
+        """
         super().__init__()
-        self.embedder = embedder
+        self.model_kwargs = dict(model_kwargs)
+        self.model = self.model_kwargs.pop("model")
+        self.batch_size = max(int(batch_size), 1)
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.host = host or os.getenv("OLLAMA_HOST")
+        self.max_batch_tokens = max(int(max_batch_tokens), 1)
+        self.max_input_tokens = max(int(max_input_tokens), 1)
 
-    def __call__(self, documents: Sequence[Document]) -> Sequence[Document]:
-        output = deepcopy(documents)
-        logger.info(f"Processing {len(output)} documents individually for Ollama embeddings")
-
-        for i, doc in enumerate(tqdm(output, desc="Processing documents for Ollama embeddings")):
+    async def _embed_batch(self, client: ollama.AsyncClient, semaphore: asyncio.Semaphore,
+                           texts: List[str]) -> List[Optional[List[float]]]:
+        async with semaphore:
             try:
-                # Get embedding for a single document
-                result = self.embedder(input=doc.text)
-                if result.data and len(result.data) > 0:
-                    # Assign the embedding to the document
-                    output[i].vector = result.data[0].embedding
-                else:
-                    logger.warning(f"Failed to get embedding for document {i}")
+                response = await client.embed(model=self.model, input=texts, **self.model_kwargs)
+                if len(response.embeddings) != len(texts):
+                    raise ValueError(f"expected {len(texts)} embeddings, got {len(response.embeddings)}")
+                self._requests += 1
+                return [list(embedding) for embedding in response.embeddings]
             except Exception as e:
-                logger.error(f"Error processing document {i}: {e}")
+                self._requests += 1
+                if len(texts) == 1:
+                    logger.error(f"Error embedding document with Ollama: {e}")
+                    return [None]
+                logger.warning(f"Error embedding a batch of {len(texts)} documents with Ollama, retrying them one by one: {e}")
+        # Retry outside the semaphore, so the retries can take its slots
+        results = await asyncio.gather(*(self._embed_batch(client, semaphore, [text]) for text in texts))
+        return [result[0] for result in results]
+
+    async def _embed(self, texts: List[str], token_counts: List[int]) -> List[Optional[List[float]]]:
+        # One client per call: its connection pool is bound to the event loop it runs on
+        client = ollama.AsyncClient(host=self.host)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        batches = make_token_batches(token_counts, self.max_batch_tokens, self.batch_size)
+        try:
+            results = await asyncio.gather(*(self._embed_batch(client, semaphore, texts[start:end]) for start, end in batches))
+        finally:
+            await client.close()
+        return [embedding for batch_results in results for embedding in batch_results]
+
+    def __call__(self, documents: Sequence[Document]) -> Sequence[Document]:
+        """
+        Embed documents.
+
+        Args:
+            documents (Sequence[Document]): The documents
+
+        Returns:
+            Sequence[Document]: Copies of the documents, in the same order, with their embeddings in `vector`;
+                documents that could not be embedded keep their vector
+        """
+        output = [copy(doc) for doc in documents]
+        if not output:
+            return output
+        texts, token_counts = prepare_inputs(output, self.max_input_tokens, local_ollama=True)
+        self._requests = 0
+        start_time = time.perf_counter()
+        embeddings = run_coroutine(self._embed(texts, token_counts))
+        for doc, embedding in zip(output, embeddings):
+            if embedding is not None:
+                doc.vector = embedding
+        seconds = time.perf_counter() - start_time
+        embedded = sum(embedding is not None for embedding in embeddings)
+        logger.info(
+            f"Embedded {embedded} of {len(output)} documents with Ollama in {self._requests} requests, {seconds:.2f}s "
+            f"({len(output) / seconds if seconds > 0 else 0.0:.1f} documents/s, {self.max_concurrency} in flight)"
+        )
+        return output
 
-        return output
\ No newline at end of file
+    def _extra_repr(self) -> str:
+        return (
+            f"model={self.model}, batch_size={self.batch_size}, "
+            f"max_batch_tokens={self.max_batch_tokens}, max_concurrency={self.max_concurrency}"
+        )
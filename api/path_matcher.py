@@ -0,0 +1,251 @@
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Ignore files read from the repository root, in order; later files can re-include with "!"
+IGNORE_FILES = [".gitignore", ".deepwikiignore"]
+
+# Prefix of patterns that match a name at any depth
+_ANY_DIRS = "(?:[^/]+/)*"
+
+def _translate_segment(segment: str) -> str:
+    """Translate one path segment of a glob into a regex that never crosses "/"."""
+    out = []
+    i = 0
+    while i < len(segment):
+        c = segment[i]
+        if c == "\\" and i + 1 < len(segment):
+            out.append(re.escape(segment[i + 1]))
+            i += 2
+            continue
+        if c == "*":
+            # Consecutive stars inside a segment behave like one
+            while i + 1 < len(segment) and segment[i + 1] == "*":
+                i += 1
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = segment.find("]", i + 2 if segment[i + 1:i + 2] in ("!", "^") else i + 1)
+            if end < 0:
+                out.append(re.escape(c))
+            else:
+                body = segment[i + 1:end]
+                negate = body[:1] in ("!", "^")
+                if negate:
+                    body = body[1:]
+                body = body.replace("\\", "\\\\")
+                out.append(f"[{'^/' if negate else ''}{body}]")
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+@dataclass(frozen=True)
+class IgnorePattern:
+    """
+    One compiled gitignore-style pattern.
+
+    Attributes:
+        regex: Regex matching the whole repository-relative path
+        name_regex: Regex matching the base name alone, if the pattern matches a name at any depth
+        negated: Whether the pattern re-includes paths ("!" prefix)
+        dir_only: Whether the pattern matches directories only (trailing "/")
+    """
+    regex: str
+    name_regex: Optional[str]
+    negated: bool
+    dir_only: bool
+
+def translate_pattern(pattern: str) -> Optional[IgnorePattern]:
+    """
+    Translate one gitignore-style pattern into a regex over repository-relative paths.
+
+    Patterns without a "/" (other than a trailing one) match a name at any depth;
+    other patterns are anchored at the repository root. "**" matches any number of
+    directories, "*" and "?" never match "/", a trailing "/" matches directories only
+    and a leading "!" re-includes what earlier patterns excluded.
+
+    Args:
+        pattern (str): One line of an ignore file, or an exclusion from the configuration
+
+    Returns:
+        IgnorePattern: The translated pattern, or None for blank lines and comments
+    """
+    pattern = pattern.rstrip("\n")
+    # Trailing spaces are ignored unless escaped
+    if not pattern.endswith("\\ "):
+        pattern = pattern.rstrip()
+    if not pattern or pattern.startswith("#"):
+        return None
+    negated = pattern.startswith("!")
+    if negated:
+        pattern = pattern[1:]
+    elif pattern.startswith("\\!") or pattern.startswith("\\#"):
+        pattern = pattern[1:]
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    if not pattern:
+        return None
+
+    segments = pattern.split("/")
+    regex = ""
+    for index, segment in enumerate(segments):
+        last = index == len(segments) - 1
+        if segment == "**":
+            regex += ".*" if last else "(?:[^/]+/)*"
+        else:
+            regex += _translate_segment(segment) + ("" if last else "/")
+    if anchored:
+        return IgnorePattern(regex, None, negated, dir_only)
+    return IgnorePattern(_ANY_DIRS + regex, regex if len(segments) == 1 else None, negated, dir_only)
+
+def _literal_name(regex: str) -> Optional[str]:
+    """Return the name a translated segment matches if it has no wildcards, else None."""
+    name = re.sub(r"\\(.)", r"\1", regex)
+    return name if re.escape(name) == regex else None
+
+def _literal_suffix(regex: str) -> Optional[str]:
+    """Return the suffix a "*<name>" segment matches if the rest has no wildcards, else None."""
+    if not regex.startswith("[^/]*"):
+        return None
+    return _literal_name(regex[len("[^/]*"):])
+
+def _compile_alternatives(alternatives: List[str]) -> Optional["re.Pattern"]:
+    # Reversed, so the first alternative that matches is the last pattern in file order
+    return re.compile("|".join(reversed(alternatives))) if alternatives else None
+
+class PathMatcher:
+    """
+    Precompiled matcher for a list of gitignore-style exclusion patterns.
+
+    The patterns are compiled once: exact names and name suffixes ("*.min.js") go into
+    dictionaries, the remaining name patterns into one combined regex over the base
+    name and path patterns into
+    one combined regex over the whole path, each per entry kind (files and directories).
+    A check costs one dictionary lookup per distinct suffix length and at most two
+    regex matches, however many files were seen. As in git, the last matching pattern decides and a "!"
+    pattern re-includes the path. Paths are relative to the repository root and use
+    "/" separators.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        """
+        Args:
+            patterns (Iterable[str]): Patterns in the order they apply; later patterns win
+        """
+        self.patterns: List[str] = []
+        self._negated: List[bool] = []
+        # Per entry kind (file or directory): pattern index by exact name and by name suffix
+        # ("*.min.js"), then combined regexes for the other name globs and for path globs
+        self._names: Dict[bool, Dict[str, int]] = {False: {}, True: {}}
+        self._suffixes: Dict[bool, Dict[str, int]] = {False: {}, True: {}}
+        name_alternatives: Dict[bool, List[str]] = {False: [], True: []}
+        path_alternatives: Dict[bool, List[str]] = {False: [], True: []}
+        for pattern in patterns:
+            translated = translate_pattern(pattern)
+            if translated is None:
+                continue
+            index = len(self.patterns)
+            self.patterns.append(pattern)
+            self._negated.append(translated.negated)
+            kinds = (True,) if translated.dir_only else (False, True)
+            name = suffix = None
+            if translated.name_regex is not None:
+                name = _literal_name(translated.name_regex)
+                suffix = _literal_suffix(translated.name_regex)
+            for is_dir in kinds:
+                if name is not None:
+                    self._names[is_dir][name] = index
+                elif suffix is not None:
+                    self._suffixes[is_dir][suffix] = index
+                elif translated.name_regex is not None:
+                    name_alternatives[is_dir].append(f"(?P<p{index}>{translated.name_regex})")
+                else:
+                    path_alternatives[is_dir].append(f"(?P<p{index}>{translated.regex})")
+        # Only the suffix lengths that occur are looked up, shortest first
+        self._suffix_lengths = {is_dir: sorted({len(s) for s in suffixes}) for is_dir, suffixes in self._suffixes.items()}
+        self._name_regex = {is_dir: _compile_alternatives(alts) for is_dir, alts in name_alternatives.items()}
+        self._path_regex = {is_dir: _compile_alternatives(alts) for is_dir, alts in path_alternatives.items()}
+
+    @classmethod
+    def from_repository(cls, root: str, excluded_dirs: Iterable[str] = (), excluded_files: Iterable[str] = (),
+                        ignore_files: Iterable[str] = IGNORE_FILES) -> "PathMatcher":
+        """
+        Build the matcher for one ingestion of a repository.
+
+        Configured exclusions come first, so the repository's ignore files can extend
+        or re-include them.
+
+        Args:
+            root (str): Repository root directory
+            excluded_dirs (Iterable[str]): Directory names ("./node_modules/") or relative paths
+                ("src/generated"), excluded at any depth
+            excluded_files (Iterable[str]): File name globs ("*.min.js") or path globs ("packages/*/dist")
+            ignore_files (Iterable[str]): Ignore files read from the repository root, if present
+
+        Returns:
+            PathMatcher: The compiled matcher
+        """
+        patterns = []
+        for excluded in excluded_dirs:
+            clean_excluded = excluded.strip().replace("\\", "/")
+            while clean_excluded.startswith("./"):
+                clean_excluded = clean_excluded[2:]
+            clean_excluded = clean_excluded.strip("/")
+            if clean_excluded:
+                # Directory names and nested paths are both matched at any depth
+                patterns.append(f"**/{clean_excluded}/" if "/" in clean_excluded else f"{clean_excluded}/")
+        patterns.extend(pattern.strip() for pattern in excluded_files if pattern.strip())
+
+        for ignore_file in ignore_files:
+            ignore_path = os.path.join(root, ignore_file)
+            if not os.path.isfile(ignore_path):
+                continue
+            try:
+                with open(ignore_path, "r", encoding="utf-8") as f:
+                    lines = f.readlines()
+            except (OSError, UnicodeDecodeError) as e:
+                logger.warning(f"Could not read {ignore_path}: {e}")
+                continue
+            logger.info(f"Using {len(lines)} lines of {ignore_path}")
+            patterns.extend(lines)
+        return cls(patterns)
+
+    def matches(self, path: str, is_dir: bool = False) -> bool:
+        """
+        Check whether a path is excluded.
+
+        Args:
+            path (str): Path relative to the repository root
+            is_dir (bool): Whether the path is a directory
+
+        Returns:
+            bool: True if the last pattern matching the path excludes it
+        """
+        if os.sep != "/":
+            path = path.replace(os.sep, "/")
+        name = path.rsplit("/", 1)[-1]
+        # The last matching pattern decides; each lookup reports its highest pattern index
+        index = self._names[is_dir].get(name, -1)
+        suffixes = self._suffixes[is_dir]
+        for length in self._suffix_lengths[is_dir]:
+            if length > len(name):
+                break
+            found = suffixes.get(name[len(name) - length:], -1)
+            if found > index:
+                index = found
+        for regex, subject in ((self._name_regex[is_dir], name), (self._path_regex[is_dir], path)):
+            if regex is not None:
+                match = regex.fullmatch(subject)
+                if match is not None:
+                    index = max(index, int(match.lastgroup[1:]))
+        return index >= 0 and not self._negated[index]
@@ -1,10 +1,12 @@
 import logging
 import re
+import time
 from dataclasses import dataclass
 from typing import Any, List, Tuple, Dict
 from uuid import uuid4
 
 import adalflow as adal
+from adalflow.core.types import RetrieverOutput
 
 
 # Create our own implementation of the conversation classes
@@ -35,9 +37,14 @@ class CustomConversation:
         self.dialog_turns.append(dialog_turn)
 
 # Import other adalflow components
-from adalflow.components.retriever.faiss_retriever import FAISSRetriever
 from api.config import configs
+from api.chunk_filter import ChunkFilter
 from api.data_pipeline import DatabaseManager
+from api.embedding_cache import query_embedding_cache, make_query_key
+from api.lexical_index import get_lexical_config, reciprocal_rank_fusion
+from api.retriever_cache import retriever_cache, make_cache_key, estimate_retriever_size
+from api.sharded_store import ShardedChunkStore, ShardedRetriever
+from api.vector_index import PrebuiltFAISSRetriever, get_index_config, is_quantized, mmr_rerank
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -201,6 +208,18 @@ class RAGAnswer(adal.DataClass):
 
     __output_fields__ = ["rationale", "answer"]
 
+def format_server_timing(timings: Dict[str, float]) -> str:
+    """
+    Format stage durations as a `Server-Timing` header value.
+
+    Args:
+        timings (dict): Stage name to duration in milliseconds, e.g. `RAG.timings`
+
+    Returns:
+        str: The header value, e.g. "embed;dur=12.5, search;dur=1.3"
+    """
+    return ", ".join(f"{stage};dur={duration:.1f}" for stage, duration in timings.items())
+
 class RAG(adal.Component):
     """RAG with one repo.
     If you want to load a new repos, call prepare_retriever(repo_url_or_path) first."""
@@ -227,7 +246,12 @@ class RAG(adal.Component):
             embedder_config = configs["embedder_ollama"]
         else:
             embedder_config = configs["embedder"]
-        
+        self.embedder_config = embedder_config
+        self.lexical_config = get_lexical_config()
+        self.chunk_filter = ChunkFilter()
+        # Stage durations of the last retrieval, in milliseconds
+        self.timings: Dict[str, float] = {}
+
         # --- Initialize Embedder ---
         self.embedder = adal.Embedder(
             model_client=embedder_config["model_client"](),
@@ -288,57 +312,249 @@ IMPORTANT FORMATTING RULES:
         self.transformed_docs = []
 
     def prepare_retriever(self, repo_url_or_path: str, type: str = "github", access_token: str = None, 
-                      excluded_dirs: List[str] = None, excluded_files: List[str] = None):
+                      excluded_dirs: List[str] = None, excluded_files: List[str] = None,
+                      chunk_filter: ChunkFilter = None, refresh: bool = False):
         """
         Prepare the retriever for a repository.
         Will load database from local storage if available.
 
+        The repository is indexed once without request-specific exclusions; they are
+        applied when searching, so every filter combination shares one index.
+
         Args:
             repo_url_or_path: URL or local path to the repository
             access_token: Optional access token for private repositories
-            excluded_dirs: Optional list of directories to exclude from processing
-            excluded_files: Optional list of file patterns to exclude from processing
+            excluded_dirs: Optional list of directories to exclude from retrieval
+            excluded_files: Optional list of file patterns to exclude from retrieval
+            chunk_filter: Optional filter used instead of excluded_dirs/excluded_files
+            refresh: Whether to first update the database with the repository's new commits,
+                re-embedding only changed files
         """
         self.initialize_db_manager()
         self.repo_url_or_path = repo_url_or_path
-        self.transformed_docs = self.db_manager.prepare_database(
-            repo_url_or_path, 
-            type, 
-            access_token, 
-            local_ollama=self.local_ollama,
-            excluded_dirs=excluded_dirs,
-            excluded_files=excluded_files
+        if chunk_filter is None:
+            chunk_filter = ChunkFilter.create(excluded_dirs=excluded_dirs, excluded_files=excluded_files)
+        self.chunk_filter = chunk_filter
+        self.db_manager.prepare_repo(repo_url_or_path, type, access_token)
+        db_path = self.db_manager.get_db_path()
+        # The retrieval mode decides which indexes a cached entry holds
+        cache_key = make_cache_key(db_path, self.embedder_config) + (self.lexical_config["mode"],)
+        if refresh:
+            # Rewrites the database in place; the cache notices the new manifest below.
+            # Holding the build lock keeps a retriever for this key from being built meanwhile.
+            with retriever_cache.build_lock(cache_key):
+                self.db_manager.prepare_db_index(local_ollama=self.local_ollama, refresh=True)
+
+        def build_retriever():
+            transformed_docs = self.db_manager.prepare_db_index(local_ollama=self.local_ollama)
+            # The retriever is shared between requests through the cache, so it is built
+            # without an embedder; queries are embedded per request in `call`.
+            index_config = get_index_config()
+            retriever_kwargs = dict(
+                top_k=configs["retriever"]["top_k"],
+                # Re-rank quantized results against the full-precision vectors on disk
+                rerank=is_quantized(index_config),
+                rerank_factor=index_config["quantization"]["rerank_factor"],
+                exact_search_max_chunks=index_config["filter"]["exact_search_max_chunks"],
+            )
+            if isinstance(transformed_docs, ShardedChunkStore):
+                retriever = ShardedRetriever(transformed_docs, self.db_manager._load_or_build_index, **retriever_kwargs)
+            else:
+                retriever = PrebuiltFAISSRetriever(
+                    self.db_manager.index,
+                    documents=transformed_docs,
+                    vectors=transformed_docs.vectors,
+                    **retriever_kwargs,
+                )
+            lexical_index = self.db_manager.lexical_index
+            size_bytes = estimate_retriever_size(transformed_docs, retriever)
+            if lexical_index is not None:
+                size_bytes += lexical_index.nbytes
+            return (transformed_docs, retriever, lexical_index), size_bytes
+
+        self.transformed_docs, self.retriever, self.lexical_index = retriever_cache.get_or_create(
+            cache_key,
+            build_retriever,
+            db_path=db_path,
         )
         logger.info(f"Loaded {len(self.transformed_docs)} documents for retrieval")
 
-        retreive_embedder = self.query_embedder if self.local_ollama else self.embedder
-        self.retriever = FAISSRetriever(
-            **configs["retriever"],
-            embedder=retreive_embedder,
-            documents=self.transformed_docs,
-            document_map_func=lambda doc: doc.vector,
-        )
+    def embed_query(self, query: str) -> List[float]:
+        """
+        Embed a single query string with the configured embedder.
+
+        Embeddings are cached per embedder model, so repeated queries skip the provider.
 
-    def call(self, query: str, language: str = "en") -> Tuple[List]:
+        Args:
+            query: The query to embed
+
+        Returns:
+            List[float]: The query embedding
+        """
+        return self.embed_queries([query])[0]
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Embed several query strings, sending all cache misses to the provider in one call.
+
+        Ollama only embeds one string per call, so its misses are embedded one by one.
+
+        Args:
+            queries: The queries to embed
+
+        Returns:
+            List[List[float]]: One embedding per query, in input order
+        """
+        cache_keys = [make_query_key(self.embedder_config, query) for query in queries]
+        embeddings = [query_embedding_cache.get(cache_key) for cache_key in cache_keys]
+        # Deduplicate the misses so a repeated query is embedded once
+        missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings) if embedding is None))
+
+        computed = {}
+        if self.local_ollama:
+            for query in missing:
+                output = self.query_embedder(query)
+                if not output.data:
+                    raise ValueError(f"Failed to embed query: {output.error}")
+                computed[query] = output.data[0].embedding
+        else:
+            batch_size = self.embedder_config.get("batch_size", 500)
+            for start in range(0, len(missing), batch_size):
+                batch = missing[start:start + batch_size]
+                output = self.embedder(input=batch)
+                if not output.data or len(output.data) != len(batch):
+                    raise ValueError(f"Failed to embed queries: {output.error}")
+                for query, embedding in zip(batch, output.data):
+                    computed[query] = embedding.embedding
+
+        for query, embedding in computed.items():
+            query_embedding_cache.put(make_query_key(self.embedder_config, query), embedding)
+        return [embedding if embedding is not None else computed[query] for query, embedding in zip(queries, embeddings)]
+
+    def retrieve(self, query: str, top_k: int = None, chunk_filter: ChunkFilter = None) -> RetrieverOutput:
+        """
+        Retrieve the chunks for a query with the configured retrieval mode.
+
+        In hybrid mode the vector and BM25 rankings are merged with reciprocal rank
+        fusion; if the query cannot be embedded, the BM25 ranking is used alone.
+
+        Args:
+            query: The query text
+            top_k: Number of chunks to return, defaults to `retriever.top_k`
+            chunk_filter: Restricts the chunks that may be returned, defaults to the filter
+                set by `prepare_retriever`
+
+        Returns:
+            RetrieverOutput: Chunk indices and scores, best first
+        """
+        return self.retrieve_batch([query], top_k=top_k, chunk_filter=chunk_filter)[0]
+
+    def retrieve_batch(self, queries: List[str], top_k: int = None,
+                       chunk_filter: ChunkFilter = None) -> List[RetrieverOutput]:
+        """
+        Retrieve the chunks for several queries with one embedding call and one FAISS search.
+
+        The duration of each stage is recorded in `timings`, in milliseconds.
+
+        Args:
+            queries: The query texts
+            top_k: Number of chunks to return per query, defaults to `retriever.top_k`
+            chunk_filter: Restricts the chunks that may be returned, defaults to the filter
+                set by `prepare_retriever`
+
+        Returns:
+            List[RetrieverOutput]: One output per query, in input order
+        """
+        self.timings = {}
+        mode = self.lexical_config["mode"]
+        top_k = top_k or configs["retriever"]["top_k"]
+        mmr_config = get_index_config()["mmr"]
+        # MMR needs the query and chunk embeddings; it never embeds anything itself
+        use_mmr = mmr_config["enabled"] and mode != "lexical" and self.transformed_docs.has_vectors
+        fetch_k = top_k * max(1, mmr_config["fetch_factor"]) if use_mmr else top_k
+        chunk_filter = chunk_filter if chunk_filter is not None else self.chunk_filter
+        chunk_mask = None if chunk_filter.is_empty else self.transformed_docs.get_chunk_mask(chunk_filter)
+
+        query_embeddings = None
+        if mode != "lexical":
+            start = time.perf_counter()
+            try:
+                query_embeddings = self.embed_queries(queries)
+            except Exception as e:
+                if mode == "vector":
+                    raise
+                logger.warning(f"Query embedding failed, using lexical results only: {e}")
+            self.timings["embed"] = (time.perf_counter() - start) * 1000
+
+        if mode == "vector":
+            start = time.perf_counter()
+            outputs = self.retriever.retrieve_embedding_queries(query_embeddings, top_k=fetch_k, chunk_mask=chunk_mask)
+            self.timings["search"] = (time.perf_counter() - start) * 1000
+            for query, output in zip(queries, outputs):
+                output.query = query
+        else:
+            fusion = self.lexical_config["fusion"]
+            num_candidates = fetch_k if mode == "lexical" else fetch_k * fusion["candidate_factor"]
+            start = time.perf_counter()
+            lexical_results = [self.lexical_index.search(query, num_candidates, chunk_mask=chunk_mask) for query in queries]
+            self.timings["lexical"] = (time.perf_counter() - start) * 1000
+            if mode == "lexical":
+                return [
+                    RetrieverOutput(doc_indices=indices.tolist(), doc_scores=scores.tolist(), query=query)
+                    for query, (indices, scores) in zip(queries, lexical_results)
+                ]
+
+            vector_outputs = [None] * len(queries)
+            if query_embeddings is not None:
+                start = time.perf_counter()
+                vector_outputs = self.retriever.retrieve_embedding_queries(
+                    query_embeddings, top_k=num_candidates, chunk_mask=chunk_mask
+                )
+                self.timings["search"] = (time.perf_counter() - start) * 1000
+            outputs = []
+            for query, (lexical_indices, _), vector_output in zip(queries, lexical_results, vector_outputs):
+                rankings = [lexical_indices.tolist()]
+                if vector_output is not None:
+                    rankings.insert(0, vector_output.doc_indices)
+                doc_indices, doc_scores = reciprocal_rank_fusion(rankings, fetch_k, k=fusion["rrf_k"])
+                outputs.append(RetrieverOutput(doc_indices=doc_indices, doc_scores=doc_scores, query=query))
+
+        if use_mmr and query_embeddings is not None:
+            start = time.perf_counter()
+            for output, query_embedding in zip(outputs, query_embeddings):
+                self._apply_mmr(output, query_embedding, top_k, mmr_config["lambda"])
+            self.timings["mmr"] = (time.perf_counter() - start) * 1000
+        elif use_mmr:
+            # The query embedding failed, so the candidates fetched for MMR are cut to top_k as ranked
+            for output in outputs:
+                output.doc_indices = output.doc_indices[:top_k]
+                if output.doc_scores is not None:
+                    output.doc_scores = output.doc_scores[:top_k]
+        return outputs
+
+    def _apply_mmr(self, output: RetrieverOutput, query_embedding: List[float], top_k: int, lambda_mult: float) -> None:
+        # FAISS pads with -1 when fewer candidates match
+        found = [i for i, doc_index in enumerate(output.doc_indices) if doc_index >= 0]
+        doc_indices = [int(output.doc_indices[i]) for i in found]
+        doc_scores = [float(output.doc_scores[i]) for i in found] if output.doc_scores is not None else None
+        selected = mmr_rerank(query_embedding, self.transformed_docs.get_vectors(doc_indices), top_k, lambda_mult)
+        output.doc_indices = [doc_indices[i] for i in selected]
+        if doc_scores is not None:
+            output.doc_scores = [doc_scores[i] for i in selected]
+
+    def call(self, query: str, language: str = "en", top_k: int = None) -> Tuple[List]:
         """
         Process a query using RAG.
 
         Args:
             query: The user's query
+            top_k: Number of documents to retrieve, defaults to `retriever.top_k`
 
         Returns:
             Tuple of (RAGAnswer, retrieved_documents)
         """
         try:
-            retrieved_documents = self.retriever(query)
-
-            # Fill in the documents
-            retrieved_documents[0].documents = [
-                self.transformed_docs[doc_index]
-                for doc_index in retrieved_documents[0].doc_indices
-            ]
-
-            return retrieved_documents
+            return self.batch_call([query], top_k=top_k)
 
         except Exception as e:
             logger.error(f"Error in RAG call: {str(e)}")
@@ -349,3 +565,28 @@ IMPORTANT FORMATTING RULES:
                 answer=f"I apologize, but I encountered an error while processing your question. Please try again or rephrase your question."
             )
             return error_response, []
+
+    def batch_call(self, queries: List[str], top_k: int = None, chunk_filter: ChunkFilter = None) -> List[RetrieverOutput]:
+        """
+        Retrieve documents for several queries against the prepared repository at once.
+
+        Args:
+            queries: The queries, e.g. one per wiki page
+            top_k: Number of documents per query, defaults to `retriever.top_k`
+            chunk_filter: Restricts the chunks that may be returned, defaults to the filter
+                set by `prepare_retriever`
+
+        Returns:
+            List[RetrieverOutput]: One output per query with `documents` filled in
+        """
+        if not queries:
+            return []
+        retrieved_documents = self.retrieve_batch(queries, top_k=top_k, chunk_filter=chunk_filter)
+        for output in retrieved_documents:
+            # FAISS pads with -1 when fewer than top_k chunks match
+            found = [i for i, doc_index in enumerate(output.doc_indices) if doc_index >= 0]
+            output.doc_indices = [output.doc_indices[i] for i in found]
+            if output.doc_scores is not None:
+                output.doc_scores = [float(output.doc_scores[i]) for i in found]
+            output.documents = [self.transformed_docs[doc_index] for doc_index in output.doc_indices]
+        return retrieved_documents
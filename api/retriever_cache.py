@@ -0,0 +1,273 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+from api.config import configs
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+@dataclass
+class CacheEntry:
+    """A cached retriever together with its accounting information."""
+    value: Any
+    size_bytes: int
+    db_path: Optional[str]
+    db_mtime: Optional[float]
+
+def make_cache_key(db_path: str, embedder_config: Dict) -> Tuple:
+    """
+    Build the cache key for a repository database and the embedder used to query it.
+
+    Args:
+        db_path (str): Path of the repository database file
+        embedder_config (dict): Embedder configuration (`configs["embedder"]` or `configs["embedder_ollama"]`)
+
+    Returns:
+        tuple: A hashable key
+    """
+    model_kwargs = embedder_config.get("model_kwargs", {})
+    return (
+        os.path.abspath(db_path),
+        embedder_config.get("client_class"),
+        model_kwargs.get("model"),
+        model_kwargs.get("dimensions"),
+    )
+
+def _get_mtime(path: Optional[str]) -> Optional[float]:
+    if not path:
+        return None
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+class RetrieverCache:
+    """
+    Process-wide, thread-safe LRU cache of prepared retrievers.
+
+    Entries are evicted in least-recently-used order once either the approximate
+    memory budget or the maximum number of entries is exceeded. An entry is also
+    dropped when the database file it was loaded from has been rewritten.
+    """
+
+    def __init__(self, max_memory_mb: float = 2048, max_entries: int = 16):
+        """
+        Args:
+            max_memory_mb (float): Approximate memory budget for all cached entries, in MB
+            max_entries (int): Maximum number of cached entries
+        """
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._lock = threading.RLock()
+        # Build lock per key and the number of threads holding or waiting for it
+        self._build_locks: Dict[Hashable, Tuple[threading.Lock, int]] = {}
+        self._memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Return the cached value for a key, or None if it is missing or stale.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.db_path and _get_mtime(entry.db_path) != entry.db_mtime:
+                logger.info(f"Database {entry.db_path} changed on disk, dropping cached retriever")
+                self._remove(key)
+                self.invalidations += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def put(self, key: Hashable, value: Any, size_bytes: int, db_path: Optional[str] = None) -> None:
+        """
+        Insert a value, evicting least-recently-used entries to stay within budget.
+
+        Args:
+            key: Cache key, see `make_cache_key`
+            value: The value to cache
+            size_bytes (int): Approximate memory held by the value
+            db_path (str, optional): Database file backing the value, used to detect rebuilds
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size_bytes > self.max_memory_bytes:
+                logger.warning(
+                    f"Retriever of {size_bytes / 1024 / 1024:.1f} MB exceeds the cache budget "
+                    f"of {self.max_memory_bytes / 1024 / 1024:.1f} MB, not caching it"
+                )
+                return
+            self._entries[key] = CacheEntry(
+                value=value,
+                size_bytes=size_bytes,
+                db_path=db_path,
+                db_mtime=_get_mtime(db_path),
+            )
+            self._memory_bytes += size_bytes
+            while self._entries and (
+                self._memory_bytes > self.max_memory_bytes or len(self._entries) > self.max_entries
+            ):
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._memory_bytes -= evicted.size_bytes
+                self.evictions += 1
+                logger.info(f"Evicted cached retriever for {evicted_key[0]}")
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Tuple[Any, int]],
+                      db_path: Optional[str] = None) -> Any:
+        """
+        Return the cached value for a key, building it with `factory` on a miss.
+
+        Concurrent misses for the same key build the value only once; other callers
+        wait for it instead of loading the same database in parallel.
+
+        Args:
+            key: Cache key, see `make_cache_key`
+            factory: Callable returning a `(value, size_bytes)` tuple
+            db_path (str, optional): Database file backing the value, used to detect rebuilds
+
+        Returns:
+            The cached or freshly built value
+        """
+        value = self.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+
+        with self.build_lock(key):
+            # Another thread may have built the value while we were waiting
+            value = self.get(key)
+            if value is not None:
+                with self._lock:
+                    self.hits += 1
+                return value
+
+            with self._lock:
+                self.misses += 1
+            value, size_bytes = factory()
+            self.put(key, value, size_bytes, db_path=db_path)
+            return value
+
+    @contextmanager
+    def build_lock(self, key: Hashable) -> Iterator[None]:
+        """
+        Hold the build lock of a key, waiting for any other thread holding it.
+
+        `get_or_create` builds values under it; callers that rewrite the data behind
+        a value hold it too, e.g. keyed by the database path, so they never run
+        concurrently with each other.
+
+        Args:
+            key: Cache key, or any other hashable naming the work to serialize
+        """
+        with self._lock:
+            lock, users = self._build_locks.get(key, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self._build_locks[key] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                lock, users = self._build_locks[key]
+                if users > 1:
+                    self._build_locks[key] = (lock, users - 1)
+                else:
+                    del self._build_locks[key]
+
+    def invalidate(self, db_path: str) -> int:
+        """
+        Drop every cached entry loaded from the given database file.
+
+        Args:
+            db_path (str): Path of the database file that was rebuilt
+
+        Returns:
+            int: The number of entries removed
+        """
+        db_path = os.path.abspath(db_path)
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == db_path]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+        if keys:
+            logger.info(f"Invalidated {len(keys)} cached retriever(s) for {db_path}")
+        return len(keys)
+
+    def clear(self) -> None:
+        """Drop all cached entries."""
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current memory usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "memory_mb": round(self._memory_bytes / 1024 / 1024, 2),
+                "max_memory_mb": round(self.max_memory_bytes / 1024 / 1024, 2),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self._memory_bytes -= entry.size_bytes
+
+def estimate_retriever_size(documents, retriever) -> int:
+    """
+    Estimate the memory held by the transformed documents of a repository and their retriever.
+
+    Args:
+        documents: The transformed documents, a `ChunkStore`, a `ShardedChunkStore` or a list of `Document`
+        retriever: The FAISS retriever built over them
+
+    Returns:
+        int: Approximate size in bytes
+    """
+    if hasattr(documents, "resident_nbytes"):
+        # Memory-mapped store: chunk texts are read on a hit, so the vectors dominate
+        size = documents.resident_nbytes
+        if getattr(retriever, "rerank", False):
+            # Quantized codes are held in RAM; full-precision vectors are only read to re-rank
+            index_files = getattr(documents, "index_files", None) or [(documents.index_path, documents.vectors.nbytes)]
+            for index_path, vectors_nbytes in index_files:
+                if os.path.exists(index_path):
+                    size += os.path.getsize(index_path) - vectors_nbytes
+    else:
+        size = 0
+        for doc in documents:
+            # Python floats in `doc.vector` cost roughly 32 bytes each (object + list slot)
+            size += len(doc.text or "") + 32 * len(doc.vector or [])
+    xb = getattr(retriever, "xb", None)
+    if xb is not None:
+        # The FAISS flat index keeps its own copy of the matrix
+        size += 2 * xb.nbytes
+    return size
+
+_cache_config = configs.get("retriever_cache", {})
+
+# Shared by all requests in this process
+retriever_cache = RetrieverCache(
+    max_memory_mb=_cache_config.get("max_memory_mb", 2048),
+    max_entries=_cache_config.get("max_entries", 16),
+)
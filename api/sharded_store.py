@@ -0,0 +1,571 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+from adalflow.core.types import Document, RetrieverOutput
+
+from api.chunk_filter import ChunkFilter
+from api.chunk_store import CHUNK_DTYPE, INDEX_FILE, MAX_CACHED_MASKS, ChunkStore, unique_tmp_path
+from api.config import configs
+from api.lexical_index import LexicalIndex
+from api.vector_index import PrebuiltFAISSRetriever
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Bump whenever the layout of the shards manifest changes
+SHARDS_FORMAT_VERSION = 1
+
+SHARDS_MANIFEST_FILE = "shards.json"
+
+SHARDING_STRATEGIES = ["none", "top_level", "path_map"]
+
+# Shard of the files at the repository root (top_level) or matched by no prefix (path_map)
+ROOT_SHARD = "_root"
+DEFAULT_SHARD = "_default"
+
+DEFAULT_SHARDING_CONFIG = {
+    "strategy": "none",
+    "path_map": {},
+    "max_workers": 8,
+}
+
+def get_sharding_config() -> Dict[str, Any]:
+    """
+    Get the sharding configuration, with defaults for missing keys.
+
+    Returns:
+        dict: The sharding configuration
+    """
+    sharding_config = {**DEFAULT_SHARDING_CONFIG, **configs.get("sharding", {})}
+    if sharding_config["strategy"] not in SHARDING_STRATEGIES:
+        logger.warning(f"Unknown sharding strategy {sharding_config['strategy']}, using 'none'")
+        sharding_config["strategy"] = "none"
+    return sharding_config
+
+def get_shards_manifest_path(shards_dir: str) -> str:
+    """Path of the manifest that lists the shards of a sharded store."""
+    return os.path.join(shards_dir, SHARDS_MANIFEST_FILE)
+
+def shards_exist(shards_dir: str) -> bool:
+    """Whether a complete sharded store exists at the given path."""
+    return os.path.exists(get_shards_manifest_path(shards_dir))
+
+def _normalize_path(path: str) -> str:
+    path = path.strip().replace("\\", "/")
+    while path.startswith("./"):
+        path = path[2:]
+    return path.strip("/")
+
+def _shard_dir_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name) or DEFAULT_SHARD
+
+def get_shard_assignment(file_path: str, sharding_config: Dict[str, Any]) -> Tuple[str, Optional[str]]:
+    """
+    Find the shard a file belongs to.
+
+    Args:
+        file_path (str): Path relative to the repository root
+        sharding_config (dict): See `get_sharding_config`
+
+    Returns:
+        Tuple[str, Optional[str]]: The shard name and the directory that put the file in it,
+            or None when the shard is not tied to a directory
+    """
+    file_path = _normalize_path(file_path)
+    if sharding_config["strategy"] == "path_map":
+        best = None
+        for prefix in sharding_config["path_map"]:
+            normalized = _normalize_path(prefix)
+            if (file_path == normalized or file_path.startswith(normalized + "/")) and (
+                best is None or len(normalized) > len(best[1])
+            ):
+                best = (prefix, normalized)
+        if best is None:
+            return DEFAULT_SHARD, None
+        return sharding_config["path_map"][best[0]], best[1]
+
+    if "/" not in file_path:
+        return ROOT_SHARD, None
+    top_level = file_path.split("/", 1)[0]
+    return top_level, top_level
+
+def partition_documents(documents: Sequence[Document], sharding_config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Split repository documents into shards.
+
+    Args:
+        documents (Sequence[Document]): Documents from `read_all_documents`
+        sharding_config (dict): See `get_sharding_config`
+
+    Returns:
+        dict: Shard name to `{"documents": [...], "directories": [...]}`; `directories` is None
+            if the shard holds files outside any known directory
+    """
+    shards: Dict[str, Dict[str, Any]] = {}
+    for document in documents:
+        name, directory = get_shard_assignment((document.meta_data or {}).get("file_path", ""), sharding_config)
+        shard = shards.setdefault(name, {"documents": [], "directories": set()})
+        shard["documents"].append(document)
+        if shard["directories"] is not None:
+            if directory is None:
+                shard["directories"] = None
+            else:
+                shard["directories"].add(directory)
+    for shard in shards.values():
+        if shard["directories"] is not None:
+            shard["directories"] = sorted(shard["directories"])
+    return shards
+
+def documents_fingerprint(documents: Sequence[Document], embedder_config: Optional[Dict[str, Any]], embed: bool) -> str:
+    """
+    Fingerprint the inputs of one shard, so an unchanged shard is not re-embedded.
+
+    Args:
+        documents (Sequence[Document]): The shard's documents
+        embedder_config (dict, optional): Embedder configuration the chunks are embedded with
+        embed (bool): Whether the chunks are embedded
+
+    Returns:
+        str: Hex digest over the file paths and texts, the splitter and the embedder
+    """
+    digest = hashlib.sha256()
+    model_kwargs = (embedder_config or {}).get("model_kwargs", {}) if embed else {}
+    digest.update(json.dumps([
+        configs.get("text_splitter"),
+        (embedder_config or {}).get("client_class") if embed else None,
+        model_kwargs.get("model"),
+        model_kwargs.get("dimensions"),
+    ], sort_keys=True).encode("utf-8"))
+    for document in sorted(documents, key=lambda d: (d.meta_data or {}).get("file_path", "")):
+        digest.update(((document.meta_data or {}).get("file_path", "") + "\0").encode("utf-8"))
+        digest.update(hashlib.sha256((document.text or "").encode("utf-8")).digest())
+    return digest.hexdigest()
+
+def write_shards_manifest(shards_dir: str, shards: List[Dict[str, Any]], sharding_config: Dict[str, Any]) -> None:
+    """
+    Write the shards manifest atomically; written last, it marks the sharded store complete.
+
+    Args:
+        shards_dir (str): Directory of the sharded store
+        shards (List[dict]): One entry per shard (`name`, `directories`, `fingerprint`,
+            `count`, `dimensions`, `nbytes`)
+        sharding_config (dict): The configuration the shards were built with
+    """
+    manifest_path = get_shards_manifest_path(shards_dir)
+    tmp_path = unique_tmp_path(manifest_path)
+    with open(tmp_path, "w") as f:
+        json.dump({
+            "version": SHARDS_FORMAT_VERSION,
+            "strategy": sharding_config["strategy"],
+            "path_map": sharding_config["path_map"],
+            "shards": shards,
+            "created_at": time.time(),
+        }, f)
+    os.replace(tmp_path, manifest_path)
+
+def read_shards_manifest(shards_dir: str) -> Optional[Dict[str, Any]]:
+    """Read the shards manifest, or return None if it is missing or unreadable."""
+    try:
+        with open(get_shards_manifest_path(shards_dir), "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != SHARDS_FORMAT_VERSION:
+        return None
+    return manifest
+
+def get_shard_store_dir(shards_dir: str, name: str) -> str:
+    """Directory of one shard's chunk store."""
+    return os.path.join(shards_dir, _shard_dir_name(name))
+
+def remove_stale_shards(shards_dir: str, keep: Sequence[str]) -> None:
+    """Delete shard directories that are not listed in `keep`."""
+    keep = {_shard_dir_name(name) for name in keep}
+    for entry in os.listdir(shards_dir):
+        path = os.path.join(shards_dir, entry)
+        if os.path.isdir(path) and entry not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+_sharding_config = get_sharding_config()
+
+# Shared by all requests; each task searches one shard
+_executor = ThreadPoolExecutor(
+    max_workers=_sharding_config["max_workers"],
+    thread_name_prefix="shard-search",
+)
+
+class ShardedChunkStore:
+    """
+    Read-only view over the per-directory chunk stores of a large repository.
+
+    Chunks are numbered globally in shard order, so the store can be used wherever
+    a `ChunkStore` is expected. Shard stores are opened on first access.
+    """
+
+    def __init__(self, shards_dir: str):
+        """
+        Args:
+            shards_dir (str): Directory of the sharded store
+        """
+        self.shards_dir = shards_dir
+        self.manifest = read_shards_manifest(shards_dir)
+        if self.manifest is None:
+            raise ValueError(f"Missing or unsupported shards manifest in {shards_dir}")
+        self.shards: List[Dict[str, Any]] = self.manifest["shards"]
+        counts = [int(shard["count"]) for shard in self.shards]
+        # offsets[i] is the global index of shard i's first chunk
+        self.offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]).astype(np.int64)
+        self._stores: List[Optional[ChunkStore]] = [None] * len(self.shards)
+        self._stores_lock = threading.Lock()
+        self._masks: "OrderedDict[ChunkFilter, np.ndarray]" = OrderedDict()
+        self._masks_lock = threading.Lock()
+
+    @property
+    def num_shards(self) -> int:
+        return len(self.shards)
+
+    @property
+    def dimensions(self) -> int:
+        dimensions = {int(shard["dimensions"]) for shard in self.shards if shard["count"]}
+        return dimensions.pop() if len(dimensions) == 1 else 0
+
+    @property
+    def has_vectors(self) -> bool:
+        """Whether every non-empty shard holds embeddings of the same size."""
+        return self.dimensions > 0
+
+    @property
+    def has_char_spans(self) -> bool:
+        return all(self.get_shard(i).has_char_spans for i in range(self.num_shards) if self.shards[i]["count"])
+
+    @property
+    def nbytes(self) -> int:
+        """Total size of the shard stores, as recorded when they were written."""
+        return int(sum(shard["nbytes"] for shard in self.shards))
+
+    @property
+    def resident_nbytes(self) -> int:
+        """
+        Size of what stays resident while the store is searched: the vectors and chunk
+        tables of every shard, and the hot texts of the shards opened so far.
+        """
+        size = 0
+        for shard_id, shard in enumerate(self.shards):
+            store = self._stores[shard_id]
+            if store is not None:
+                size += store.resident_nbytes
+            else:
+                size += int(shard["count"]) * (int(shard["dimensions"]) * 4 + CHUNK_DTYPE.itemsize + 8)
+        return size
+
+    @property
+    def index_files(self) -> List[Tuple[str, int]]:
+        """(FAISS index path, full-precision vectors size) of every shard."""
+        return [
+            (os.path.join(get_shard_store_dir(self.shards_dir, shard["name"]), INDEX_FILE),
+             int(shard["count"]) * int(shard["dimensions"]) * 4)
+            for shard in self.shards
+        ]
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def get_shard(self, shard_id: int) -> ChunkStore:
+        """Open, or return the already opened, chunk store of one shard."""
+        store = self._stores[shard_id]
+        if store is None:
+            with self._stores_lock:
+                store = self._stores[shard_id]
+                if store is None:
+                    store = ChunkStore(get_shard_store_dir(self.shards_dir, self.shards[shard_id]["name"]))
+                    if len(store) != int(self.shards[shard_id]["count"]):
+                        raise ValueError(f"Shard {self.shards[shard_id]['name']} does not match the shards manifest")
+                    self._stores[shard_id] = store
+        return store
+
+    def locate(self, index: int) -> Tuple[int, int]:
+        """
+        Map a global chunk index to (shard id, index within the shard).
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Chunk index {index} out of range")
+        shard_id = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        return shard_id, index - int(self.offsets[shard_id])
+
+    def get_text(self, index: int) -> str:
+        shard_id, local_index = self.locate(index)
+        return self.get_shard(shard_id).get_text(local_index)
+
+    def get_vectors(self, indices: Sequence[int]) -> np.ndarray:
+        """Read the embeddings of several chunks as a float32 matrix."""
+        vectors = np.zeros((len(indices), self.dimensions), dtype=np.float32)
+        for row, index in enumerate(indices):
+            shard_id, local_index = self.locate(int(index))
+            vectors[row] = self.get_shard(shard_id).vectors[local_index]
+        return vectors
+
+    def get_token_count(self, index: int) -> int:
+        shard_id, local_index = self.locate(index)
+        return self.get_shard(shard_id).get_token_count(local_index)
+
+    def get_char_span(self, index: int) -> tuple:
+        shard_id, local_index = self.locate(index)
+        return self.get_shard(shard_id).get_char_span(local_index)
+
+    def get_meta_data(self, index: int) -> Dict[str, Any]:
+        shard_id, local_index = self.locate(index)
+        return self.get_shard(shard_id).get_meta_data(local_index)
+
+    def get_document(self, index: int) -> Document:
+        shard_id, local_index = self.locate(index)
+        document = self.get_shard(shard_id).get_document(local_index)
+        document.id = str(int(self.offsets[shard_id]) + local_index)
+        return document
+
+    def __getitem__(self, index: int) -> Document:
+        return self.get_document(int(index))
+
+    def __iter__(self) -> Iterator[Document]:
+        for index in range(len(self)):
+            yield self.get_document(index)
+
+    def is_excluded(self, shard_id: int, chunk_filter: ChunkFilter) -> bool:
+        """
+        Check from the manifest alone whether a filter rules out a whole shard.
+        """
+        directories = self.shards[shard_id].get("directories")
+        return bool(directories) and all(chunk_filter.excludes_directory(d) for d in directories)
+
+    def get_chunk_mask(self, chunk_filter: ChunkFilter) -> np.ndarray:
+        """
+        Get the chunks a filter lets through, over global chunk indices.
+
+        Shards whose directories the filter rules out are not opened.
+
+        Args:
+            chunk_filter (ChunkFilter): The query-time filter
+
+        Returns:
+            np.ndarray: Read-only boolean mask over chunk indices
+        """
+        with self._masks_lock:
+            mask = self._masks.get(chunk_filter)
+            if mask is not None:
+                self._masks.move_to_end(chunk_filter)
+                return mask
+
+        parts = []
+        for shard_id, shard in enumerate(self.shards):
+            if not shard["count"] or self.is_excluded(shard_id, chunk_filter):
+                parts.append(np.zeros(int(shard["count"]), dtype=bool))
+            else:
+                parts.append(self.get_shard(shard_id).get_chunk_mask(chunk_filter))
+        mask = np.concatenate(parts) if parts else np.zeros(0, dtype=bool)
+        mask.flags.writeable = False
+
+        with self._masks_lock:
+            self._masks[chunk_filter] = mask
+            while len(self._masks) > MAX_CACHED_MASKS:
+                self._masks.popitem(last=False)
+        return mask
+
+    def searchable_shards(self, chunk_mask: Optional[np.ndarray]) -> List[Tuple[int, Optional[np.ndarray]]]:
+        """
+        List the shards a search has to visit, with each shard's slice of the mask.
+
+        Args:
+            chunk_mask (np.ndarray, optional): Boolean mask over global chunk indices
+
+        Returns:
+            List[Tuple[int, Optional[np.ndarray]]]: (shard id, shard mask or None) for every
+                non-empty shard with at least one selectable chunk
+        """
+        shards = []
+        for shard_id, shard in enumerate(self.shards):
+            if not shard["count"]:
+                continue
+            if chunk_mask is None:
+                shards.append((shard_id, None))
+                continue
+            shard_mask = chunk_mask[self.offsets[shard_id]:self.offsets[shard_id + 1]]
+            if shard_mask.any():
+                shards.append((shard_id, None if shard_mask.all() else shard_mask))
+        return shards
+
+    def close(self) -> None:
+        """Release the text mappings of the opened shard stores."""
+        for store in self._stores:
+            if store is not None:
+                store.close()
+
+def _merge_rankings(rankings: List[Tuple[np.ndarray, np.ndarray]], top_k: int) -> Tuple[List[int], List[float]]:
+    # Rankings hold global indices; scores are higher-is-better and comparable across shards
+    if not rankings:
+        return [], []
+    indices = np.concatenate([indices for indices, _ in rankings])
+    scores = np.concatenate([scores for _, scores in rankings]).astype(np.float32)
+    best = np.argsort(-scores, kind="stable")[:top_k]
+    return indices[best].tolist(), scores[best].tolist()
+
+class ShardedRetriever:
+    """
+    Vector search over a `ShardedChunkStore`, one FAISS index per shard.
+
+    A shard's index is loaded the first time a search reaches the shard. Searches
+    visit the shards their chunk mask leaves anything selectable in, concurrently,
+    and merge the per-shard top-k lists by cosine score.
+    """
+
+    def __init__(self, store: ShardedChunkStore, load_index: Callable[[ChunkStore], Optional[faiss.Index]],
+                 top_k: int = 5, rerank: bool = False, rerank_factor: int = 4, exact_search_max_chunks: int = 20000):
+        """
+        Args:
+            store (ShardedChunkStore): The sharded store
+            load_index (Callable): Loads (or rebuilds) the FAISS index of one shard's chunk store
+            top_k (int): Default number of results per query
+            rerank (bool): Re-rank quantized results against the full-precision vectors
+            rerank_factor (int): Candidates fetched per result when re-ranking
+            exact_search_max_chunks (int): See `PrebuiltFAISSRetriever`
+        """
+        self.store = store
+        self.load_index = load_index
+        self.top_k = top_k
+        self.rerank = rerank
+        self.rerank_factor = rerank_factor
+        self.exact_search_max_chunks = exact_search_max_chunks
+        self._retrievers: Dict[int, Optional[PrebuiltFAISSRetriever]] = {}
+        self._locks = [threading.Lock() for _ in range(store.num_shards)]
+
+    def get_shard_retriever(self, shard_id: int) -> Optional[PrebuiltFAISSRetriever]:
+        """Load, or return the already loaded, retriever of one shard; None if it has no index."""
+        if shard_id in self._retrievers:
+            return self._retrievers[shard_id]
+        with self._locks[shard_id]:
+            if shard_id not in self._retrievers:
+                shard_store = self.store.get_shard(shard_id)
+                index = self.load_index(shard_store)
+                self._retrievers[shard_id] = None if index is None else PrebuiltFAISSRetriever(
+                    index,
+                    top_k=self.top_k,
+                    documents=shard_store,
+                    vectors=shard_store.vectors,
+                    rerank=self.rerank,
+                    rerank_factor=self.rerank_factor,
+                    exact_search_max_chunks=self.exact_search_max_chunks,
+                )
+                logger.info(f"Loaded index of shard {self.store.shards[shard_id]['name']} ({len(shard_store)} chunks)")
+        return self._retrievers[shard_id]
+
+    def _search_shard(self, shard_id: int, xq: np.ndarray, top_k: int,
+                      shard_mask: Optional[np.ndarray]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        retriever = self.get_shard_retriever(shard_id)
+        if retriever is None:
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in range(xq.shape[0])]
+        offset = int(self.store.offsets[shard_id])
+        rankings = []
+        for output in retriever.retrieve_embedding_queries(xq, top_k=top_k, chunk_mask=shard_mask):
+            indices = np.asarray(output.doc_indices, dtype=np.int64)
+            scores = np.asarray(output.doc_scores, dtype=np.float32)
+            found = indices >= 0
+            rankings.append((indices[found] + offset, scores[found]))
+        return rankings
+
+    def retrieve_embedding_queries(self, input, top_k: Optional[int] = None,
+                                   chunk_mask: Optional[np.ndarray] = None) -> List[RetrieverOutput]:
+        """
+        Search the shards with query embeddings.
+
+        Args:
+            input: One embedding or a list of embeddings
+            top_k (int, optional): Number of results per query, defaults to `self.top_k`
+            chunk_mask (np.ndarray, optional): Boolean mask over global chunk indices
+
+        Returns:
+            List[RetrieverOutput]: One output per query, with global chunk indices
+        """
+        xq = np.array(input, dtype=np.float32)
+        if xq.ndim == 1:
+            xq = xq.reshape(1, -1)
+        top_k = top_k or self.top_k
+        shards = self.store.searchable_shards(chunk_mask)
+        futures = [_executor.submit(self._search_shard, shard_id, xq, top_k, shard_mask) for shard_id, shard_mask in shards]
+        per_shard = [future.result() for future in futures]
+
+        outputs = []
+        for row in range(xq.shape[0]):
+            doc_indices, doc_scores = _merge_rankings([rankings[row] for rankings in per_shard], top_k)
+            outputs.append(RetrieverOutput(doc_indices=doc_indices, doc_scores=doc_scores))
+        return outputs
+
+class ShardedLexicalIndex:
+    """
+    BM25 search over a `ShardedChunkStore`, one `LexicalIndex` per shard.
+
+    Term statistics are per shard, so scores of different shards are approximately
+    rather than exactly comparable; shard indexes are loaded on first search.
+    """
+
+    def __init__(self, store: ShardedChunkStore, load_index: Callable[[ChunkStore], Optional[LexicalIndex]]):
+        """
+        Args:
+            store (ShardedChunkStore): The sharded store
+            load_index (Callable): Loads (or rebuilds) the BM25 index of one shard's chunk store
+        """
+        self.store = store
+        self.load_index = load_index
+        self._indexes: Dict[int, Optional[LexicalIndex]] = {}
+        self._locks = [threading.Lock() for _ in range(store.num_shards)]
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the shard indexes loaded so far."""
+        return sum(index.nbytes for index in self._indexes.values() if index is not None)
+
+    def get_shard_index(self, shard_id: int) -> Optional[LexicalIndex]:
+        """Load, or return the already loaded, BM25 index of one shard."""
+        if shard_id in self._indexes:
+            return self._indexes[shard_id]
+        with self._locks[shard_id]:
+            if shard_id not in self._indexes:
+                self._indexes[shard_id] = self.load_index(self.store.get_shard(shard_id))
+        return self._indexes[shard_id]
+
+    def _search_shard(self, shard_id: int, query: str, top_k: int,
+                      shard_mask: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        index = self.get_shard_index(shard_id)
+        if index is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        indices, scores = index.search(query, top_k, chunk_mask=shard_mask)
+        return indices + int(self.store.offsets[shard_id]), scores
+
+    def search(self, query: str, top_k: int, chunk_mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rank chunks by BM25 score for a query across the shards.
+
+        Args:
+            query (str): The query text
+            top_k (int): Number of results
+            chunk_mask (np.ndarray, optional): Boolean mask over global chunk indices
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Global chunk indices and scores, best first
+        """
+        futures = [
+            _executor.submit(self._search_shard, shard_id, query, top_k, shard_mask)
+            for shard_id, shard_mask in self.store.searchable_shards(chunk_mask)
+        ]
+        doc_indices, doc_scores = _merge_rankings([future.result() for future in futures], top_k)
+        return np.asarray(doc_indices, dtype=np.int64), np.asarray(doc_scores, dtype=np.float32)
@@ -11,11 +11,14 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
-from api.config import get_model_config
-from api.data_pipeline import count_tokens, get_file_content
+from api.config import configs, get_model_config
+from api.context_builder import format_context, get_context_budget, merge_retrieved_chunks, pack_spans
+from api.data_pipeline import get_file_content
 from api.openai_client import OpenAIClient
 from api.openrouter_client import OpenRouterClient
-from api.rag import RAG
+from api.rag import RAG, format_server_timing
+from api.tokenization import count_tokens
+from api.workspace import FederatedRetriever, resolve_repos
 
 # Configure logging
 logging.basicConfig(
@@ -58,6 +61,8 @@ class ChatCompletionRequest(BaseModel):
     Model for requesting a chat completion.
     """
     repo_url: str = Field(..., description="URL of the repository to query")
+    repo_urls: Optional[List[str]] = Field(None, description="Additional repositories searched together with repo_url")
+    workspace: Optional[str] = Field(None, description="Saved workspace whose repositories are searched together with repo_url")
     messages: List[ChatMessage] = Field(..., description="List of chat messages")
     filePath: Optional[str] = Field(None, description="Optional path to a file in the repository to include in the prompt")
     token: Optional[str] = Field(None, description="Personal access token for private repositories")
@@ -86,6 +91,11 @@ async def chat_completions_stream(request: ChatCompletionRequest):
                     logger.warning(f"Request exceeds recommended token limit ({tokens} > 7500)")
                     input_too_large = True
 
+        try:
+            repos = resolve_repos(request.repo_url, request.type, request.repo_urls, request.workspace)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
         # Create a new RAG instance for this request
         try:
             request_rag = RAG(provider=request.provider, model=request.model)
@@ -102,6 +112,16 @@ async def chat_completions_stream(request: ChatCompletionRequest):
 
             request_rag.prepare_retriever(request.repo_url, request.type, request.token, excluded_dirs, excluded_files)
             logger.info(f"Retriever prepared for {request.repo_url}")
+
+            # Search other repositories of the request in the same query
+            federated_retriever = None
+            if len(repos) > 1:
+                federated_retriever = FederatedRetriever(provider=request.provider, model=request.model)
+                federated_retriever.prepare(
+                    repos, request.token, chunk_filter=request_rag.chunk_filter, token_type=request.type,
+                    # The request's own repository is already prepared
+                    prepared={request.repo_url: request_rag},
+                )
         except Exception as e:
             logger.error(f"Error preparing retriever: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Error preparing retriever: {str(e)}")
@@ -164,7 +184,10 @@ async def chat_completions_stream(request: ChatCompletionRequest):
 
         # Only retrieve documents if input is not too large
         context_text = ""
+        context_spans = []
         retrieved_documents = None
+        retrieval_timings = {}
+        packing_config = configs.get("context_packing", {})
 
         if not input_too_large:
             try:
@@ -178,42 +201,45 @@ async def chat_completions_stream(request: ChatCompletionRequest):
                 # Try to perform RAG retrieval
                 try:
                     # This will use the actual RAG implementation
-                    retrieved_documents = request_rag(rag_query, language=request.language)
-
-                    if retrieved_documents and retrieved_documents[0].documents:
-                        # Format context for the prompt in a more structured way
-                        documents = retrieved_documents[0].documents
-                        logger.info(f"Retrieved {len(documents)} documents")
-
-                        # Group documents by file path
-                        docs_by_file = {}
-                        for doc in documents:
-                            file_path = doc.meta_data.get('file_path', 'unknown')
-                            if file_path not in docs_by_file:
-                                docs_by_file[file_path] = []
-                            docs_by_file[file_path].append(doc)
-
-                        # Format context text with file path grouping
-                        context_parts = []
-                        for file_path, docs in docs_by_file.items():
-                            # Add file header with metadata
-                            header = f"## File Path: {file_path}\n\n"
-                            # Add document content
-                            content = "\n\n".join([doc.text for doc in docs])
-
-                            context_parts.append(f"{header}{content}")
-
-                        # Join all parts with clear separation
-                        context_text = "\n\n" + "-" * 10 + "\n\n".join(context_parts)
+                    # Over-retrieve; the context packer decides how much fits the prompt
+                    if federated_retriever is not None:
+                        # Chunks of all repositories ranked together, paths prefixed with the repository
+                        federated_hits = federated_retriever.retrieve_batch(
+                            [rag_query], top_k=packing_config.get("candidate_top_k")
+                        )[0]
+                        logger.info(f"Retrieved {len(federated_hits)} documents from {len(federated_retriever.rags)} repositories")
+                        retrieval_timings = federated_retriever.timings
+                        context_spans = federated_retriever.build_context_spans(federated_hits)
+                        if not context_spans:
+                            logger.warning("No documents retrieved from RAG")
                     else:
-                        logger.warning("No documents retrieved from RAG")
+                        retrieved_documents = request_rag(
+                            rag_query, language=request.language, top_k=packing_config.get("candidate_top_k")
+                        )
+                        retrieval_timings = request_rag.timings
+
+                        if retrieved_documents and retrieved_documents[0].documents:
+                            # Format context for the prompt in a more structured way
+                            documents = retrieved_documents[0].documents
+                            logger.info(f"Retrieved {len(documents)} documents")
+
+                            # Coalesce overlapping chunks of the same file; they are packed into the prompt below
+                            context_spans = merge_retrieved_chunks(
+                                request_rag.transformed_docs,
+                                retrieved_documents[0].doc_indices,
+                                retrieved_documents[0].doc_scores,
+                            )
+                        else:
+                            logger.warning("No documents retrieved from RAG")
+                    if retrieval_timings:
+                        logger.info(f"Retrieval timings: {format_server_timing(retrieval_timings)}")
                 except Exception as e:
                     logger.error(f"Error in RAG retrieval: {str(e)}")
                     # Continue without RAG if there's an error
 
             except Exception as e:
                 logger.error(f"Error retrieving documents: {str(e)}")
-                context_text = ""
+                context_spans = []
 
         # Get repository information
         repo_url = request.repo_url
@@ -391,6 +417,21 @@ This file contains...
             if not isinstance(turn_id, int) and hasattr(turn, 'user_query') and hasattr(turn, 'assistant_response'):
                 conversation_history += f"<turn>\n<user>{turn.user_query.query_str}</user>\n<assistant>{turn.assistant_response.response_str}</assistant>\n</turn>\n"
 
+        # Pack the best context spans into what the model's context window leaves for them
+        if context_spans:
+            prompt_tokens = count_tokens(
+                f"{system_prompt}{conversation_history}{file_content}{query}", request.provider == "ollama"
+            )
+            context_budget = get_context_budget(request.provider, request.model, prompt_tokens)
+            context_spans = pack_spans(
+                context_spans,
+                context_budget,
+                max_score_gap=packing_config.get("max_score_gap", 0),
+                local_ollama=request.provider == "ollama",
+            )
+            if context_spans:
+                context_text = format_context(context_spans)
+
         # Create the prompt with context
         prompt = f"/no_think {system_prompt}\n\n"
         
@@ -642,7 +683,8 @@ This file contains...
                     yield f"\nError: {error_message}"
 
         # Return streaming response
-        return StreamingResponse(response_stream(), media_type="text/event-stream")
+        headers = {"Server-Timing": format_server_timing(retrieval_timings)} if retrieval_timings else None
+        return StreamingResponse(response_stream(), media_type="text/event-stream", headers=headers)
 
     except HTTPException:
         raise
@@ -0,0 +1,215 @@
+import logging
+from copy import deepcopy
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+
+import tiktoken
+from adalflow.core.component import DataComponent
+from adalflow.core.types import Document
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Token counts are approximations for Ollama models, which ship their own tokenizers
+OLLAMA_ENCODING = "cl100k_base"
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Threads used by tiktoken's batch encoders; the Rust encoder releases the GIL
+ENCODE_THREADS = 8
+
+@lru_cache(maxsize=None)
+def get_encoding(local_ollama: bool = False) -> tiktoken.Encoding:
+    """
+    Get the tiktoken encoder used for counting and splitting, created once per process.
+
+    Args:
+        local_ollama (bool): Whether the tokens are for local Ollama models
+
+    Returns:
+        tiktoken.Encoding: The encoder
+    """
+    if local_ollama:
+        return tiktoken.get_encoding(OLLAMA_ENCODING)
+    return tiktoken.encoding_for_model(EMBEDDING_MODEL)
+
+def encode_batch(texts: List[str], local_ollama: bool = False, num_threads: int = ENCODE_THREADS) -> List[List[int]]:
+    """
+    Encode several texts at once on tiktoken's encoder threads.
+
+    Special tokens such as "<|endoftext|>" in source files are encoded as plain text.
+
+    Args:
+        texts (List[str]): The texts
+        local_ollama (bool): Whether the tokens are for local Ollama models
+        num_threads (int): Encoder threads
+
+    Returns:
+        List[List[int]]: The tokens of each text
+    """
+    return get_encoding(local_ollama).encode_ordinary_batch(texts, num_threads=num_threads)
+
+def count_tokens(text: str, local_ollama: bool = False) -> int:
+    """
+    Count the number of tokens in a text string using tiktoken.
+
+    Args:
+        text (str): The text to count tokens for.
+        local_ollama (bool, optional): Whether using local Ollama embeddings. Default is False.
+
+    Returns:
+        int: The number of tokens in the text.
+    """
+    try:
+        return len(get_encoding(local_ollama).encode_ordinary(text))
+    except Exception as e:
+        # Fallback to a simple approximation if tiktoken fails
+        logger.warning(f"Error counting tokens with tiktoken: {e}")
+        # Rough approximation: 4 characters per token
+        return len(text) // 4
+
+def count_tokens_batch(texts: List[str], local_ollama: bool = False) -> List[int]:
+    """
+    Count the tokens of several texts with one batch encode.
+
+    Args:
+        texts (List[str]): The texts
+        local_ollama (bool): Whether using local Ollama embeddings
+
+    Returns:
+        List[int]: The number of tokens of each text
+    """
+    try:
+        return [len(tokens) for tokens in encode_batch(texts, local_ollama)]
+    except Exception as e:
+        logger.warning(f"Error counting tokens with tiktoken: {e}")
+        return [len(text) // 4 for text in texts]
+
+def truncate_to_tokens(text: str, max_tokens: int, local_ollama: bool = False) -> str:
+    """
+    Cut a text after its first `max_tokens` tokens.
+
+    The result is a prefix of the text, the same for the same text and limit.
+
+    Args:
+        text (str): The text
+        max_tokens (int): Maximum tokens to keep
+        local_ollama (bool): Whether the tokens are for local Ollama models
+
+    Returns:
+        str: The text, or its prefix of `max_tokens` tokens if it is longer
+    """
+    tokens = get_encoding(local_ollama).encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text
+    _, offsets = get_encoding(local_ollama).decode_with_offsets(tokens[:max_tokens + 1])
+    return text[:offsets[max_tokens]]
+
+def make_token_batches(token_counts: Sequence[int], max_tokens: int, max_items: int) -> List[Tuple[int, int]]:
+    """
+    Group consecutive items into batches bounded by a token budget and an item count.
+
+    An item larger than the token budget gets a batch of its own.
+
+    Args:
+        token_counts (Sequence[int]): Tokens of each item
+        max_tokens (int): Maximum total tokens per batch
+        max_items (int): Maximum items per batch
+
+    Returns:
+        List[Tuple[int, int]]: (start, end) index ranges of the batches, in order
+    """
+    batches = []
+    start = 0
+    tokens = 0
+    for i, count in enumerate(token_counts):
+        if i > start and (i - start >= max_items or tokens + count > max_tokens):
+            batches.append((start, i))
+            start = i
+            tokens = 0
+        tokens += count
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+class TokenTextSplitter(DataComponent):
+    """
+    Splits documents into chunks of at most `chunk_size` tokens.
+
+    Documents are encoded in batches and each chunk is cut from the source text at
+    token boundaries, so chunks are exact substrings of their document. Every chunk
+    carries its token count in `estimated_num_tokens` and its character span in the
+    `start_char` and `end_char` metadata, so later stages need not tokenize or search
+    for it again.
+    """
+
+    def __init__(self, chunk_size: int = 512, chunk_overlap: int = 128, local_ollama: bool = False,
+                 batch_size: int = 64):
+        """
+        Args:
+            chunk_size (int): Maximum tokens per chunk
+            chunk_overlap (int): Tokens shared by consecutive chunks of a document
+            local_ollama (bool): Whether the chunks are embedded by local Ollama models
+            batch_size (int): Documents encoded per batch
+        """
+        super().__init__()
+        if chunk_size <= 0 or not 0 <= chunk_overlap < chunk_size:
+            raise ValueError(f"Invalid chunking: chunk_size={chunk_size}, chunk_overlap={chunk_overlap}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.local_ollama = local_ollama
+        self.batch_size = batch_size
+
+    def split_tokens(self, text: str, tokens: List[int]) -> List[Tuple[int, int, int]]:
+        """
+        Cut a text into token windows.
+
+        Args:
+            text (str): The text
+            tokens (List[int]): Its tokens
+
+        Returns:
+            List[Tuple[int, int, int]]: (start char, end char, token count) per chunk
+        """
+        if not tokens:
+            return []
+        _, offsets = get_encoding(self.local_ollama).decode_with_offsets(tokens)
+        step = self.chunk_size - self.chunk_overlap
+        spans = []
+        for start in range(0, len(tokens), step):
+            end = min(start + self.chunk_size, len(tokens))
+            spans.append((offsets[start], offsets[end] if end < len(tokens) else len(text), end - start))
+            if end == len(tokens):
+                break
+        return spans
+
+    def call(self, documents: List[Document]) -> List[Document]:
+        """
+        Split documents into chunks.
+
+        Args:
+            documents (List[Document]): The documents
+
+        Returns:
+            List[Document]: The chunks, in document order; `order` numbers the chunks of each document
+        """
+        chunks = []
+        for batch_start in range(0, len(documents), self.batch_size):
+            batch = documents[batch_start:batch_start + self.batch_size]
+            for doc, tokens in zip(batch, encode_batch([doc.text or "" for doc in batch], self.local_ollama)):
+                for order, (start_char, end_char, num_tokens) in enumerate(self.split_tokens(doc.text or "", tokens)):
+                    meta_data = deepcopy(doc.meta_data) or {}
+                    meta_data["start_char"] = start_char
+                    meta_data["end_char"] = end_char
+                    chunks.append(Document(
+                        text=doc.text[start_char:end_char],
+                        meta_data=meta_data,
+                        parent_doc_id=f"{doc.id}",
+                        order=order,
+                        vector=[],
+                        estimated_num_tokens=num_tokens,
+                    ))
+        logger.info(f"Split {len(documents)} documents into {len(chunks)} chunks of at most {self.chunk_size} tokens")
+        return chunks
+
+    def _extra_repr(self) -> str:
+        return f"chunk_size={self.chunk_size}, chunk_overlap={self.chunk_overlap}"
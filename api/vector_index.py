@@ -0,0 +1,585 @@
+import hashlib
+import json
+import logging
+import os
+import uuid
+from typing import Any, Dict, Optional, Sequence
+
+import faiss
+import numpy as np
+from adalflow.components.retriever.faiss_retriever import FAISSRetriever
+
+from api.config import configs
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Bump whenever the on-disk index layout or its metadata changes
+INDEX_FORMAT_VERSION = 3
+
+INDEX_TYPES = ["flat", "hnsw", "ivf", "auto"]
+
+# Defaults for `configs["retriever"]`; see api/config/embedder.json
+DEFAULT_INDEX_CONFIG = {
+    "index_type": "auto",
+    # "auto" uses flat search below hnsw_min_chunks, HNSW up to ivf_min_chunks and IVF above
+    "auto": {"hnsw_min_chunks": 50000, "ivf_min_chunks": 500000},
+    "hnsw": {"m": 32, "ef_construction": 200, "ef_search": 128},
+    # nlist 0 picks roughly 4 * sqrt(num_chunks) lists
+    "ivf": {"nlist": 0, "nprobe": 16, "max_training_points": 256},
+    # type: "none", "sq8" (int8), "fp16" or "pq"; pq_m 0 uses one sub-quantizer per 8 dimensions.
+    # Quantized indexes over-fetch rerank_factor * top_k candidates and re-rank them
+    # against the full-precision vectors of the chunk store.
+    "quantization": {"type": "none", "pq_m": 0, "pq_nbits": 8, "rerank_factor": 4},
+    # Filtered searches selecting at most this many chunks scan them exactly instead of using the index
+    "filter": {"exact_search_max_chunks": 20000},
+    # Maximal marginal relevance: over-fetch fetch_factor * top_k results and re-rank them
+    # for diversity; lambda 1.0 is pure relevance, lower values penalize near-duplicates more
+    "mmr": {"enabled": False, "lambda": 0.7, "fetch_factor": 3},
+}
+
+QUANTIZATION_TYPES = ["none", "sq8", "fp16", "pq"]
+
+def get_index_meta_path(index_file: str) -> str:
+    """Path of the metadata sidecar of a serialized index."""
+    return f"{index_file}.json"
+
+def file_checksum(path: str, block_size: int = 1 << 20) -> str:
+    """
+    Compute the SHA-256 checksum of a file.
+
+    Args:
+        path (str): The file to hash
+        block_size (int): Read size in bytes
+
+    Returns:
+        str: The hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def get_index_config(retriever_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Merge the retriever configuration over the index defaults.
+
+    Args:
+        retriever_config (dict, optional): Defaults to `configs["retriever"]`
+
+    Returns:
+        dict: The complete index configuration
+    """
+    if retriever_config is None:
+        retriever_config = configs.get("retriever", {})
+    index_config = {}
+    for key, default in DEFAULT_INDEX_CONFIG.items():
+        value = retriever_config.get(key, default)
+        index_config[key] = {**default, **value} if isinstance(default, dict) else value
+    if index_config["index_type"] not in INDEX_TYPES:
+        raise ValueError(f"Invalid index_type '{index_config['index_type']}', expected one of {INDEX_TYPES}")
+    if index_config["quantization"]["type"] not in QUANTIZATION_TYPES:
+        raise ValueError(
+            f"Invalid quantization type '{index_config['quantization']['type']}', expected one of {QUANTIZATION_TYPES}"
+        )
+    return index_config
+
+def is_quantized(index_config: Dict[str, Any]) -> bool:
+    """Whether indexes built with this configuration store compressed vectors."""
+    return index_config["quantization"]["type"] != "none"
+
+def get_encoding_spec(num_vectors: int, dimensions: int, index_config: Dict[str, Any]) -> str:
+    """
+    Get the FAISS factory suffix that encodes the stored vectors.
+
+    Args:
+        num_vectors (int): Number of chunks to index
+        dimensions (int): Embedding dimensions
+        index_config (dict): See `get_index_config`
+
+    Returns:
+        str: "Flat", "SQ8", "SQfp16" or e.g. "PQ32x8"
+    """
+    quantization = index_config["quantization"]
+    quantization_type = quantization["type"]
+    if quantization_type == "pq":
+        nbits = quantization["pq_nbits"]
+        m = quantization["pq_m"] or max(1, dimensions // 8)
+        if dimensions % m:
+            raise ValueError(f"pq_m ({m}) must divide the embedding dimensions ({dimensions})")
+        # PQ codebooks need enough training points per centroid
+        if num_vectors < 39 * (1 << nbits):
+            logger.info(f"Too few chunks ({num_vectors}) to train PQ codebooks, using SQ8 instead")
+            return "SQ8"
+        return f"PQ{m}x{nbits}"
+    if quantization_type == "sq8":
+        return "SQ8"
+    if quantization_type == "fp16":
+        return "SQfp16"
+    return "Flat"
+
+def resolve_index_type(num_vectors: int, index_config: Dict[str, Any]) -> str:
+    """
+    Resolve "auto" to a concrete index type from the number of vectors.
+
+    Args:
+        num_vectors (int): Number of chunks to index
+        index_config (dict): See `get_index_config`
+
+    Returns:
+        str: "flat", "hnsw" or "ivf"
+    """
+    index_type = index_config["index_type"]
+    if index_type != "auto":
+        return index_type
+    if num_vectors >= index_config["auto"]["ivf_min_chunks"]:
+        return "ivf"
+    if num_vectors >= index_config["auto"]["hnsw_min_chunks"]:
+        return "hnsw"
+    return "flat"
+
+def get_index_spec(num_vectors: int, dimensions: int, index_config: Dict[str, Any]) -> str:
+    """
+    Get the FAISS index factory string for a corpus and configuration.
+
+    The spec is stored with a persisted index, so changing the configuration
+    triggers a rebuild on the next load.
+
+    Args:
+        num_vectors (int): Number of chunks to index
+        dimensions (int): Embedding dimensions
+        index_config (dict): See `get_index_config`
+
+    Returns:
+        str: e.g. "Flat", "HNSW32", "IVF1024,Flat" or "IVF1024,SQ8"
+    """
+    index_type = resolve_index_type(num_vectors, index_config)
+    encoding = get_encoding_spec(num_vectors, dimensions, index_config)
+    if index_type == "hnsw":
+        return f"HNSW{index_config['hnsw']['m']}" + ("" if encoding == "Flat" else f",{encoding}")
+    if index_type == "ivf":
+        nlist = index_config["ivf"]["nlist"] or int(4 * np.sqrt(num_vectors))
+        # FAISS wants at least 39 training points per list
+        nlist = max(1, min(nlist, num_vectors // 39))
+        return f"IVF{nlist},{encoding}"
+    return encoding
+
+def _training_sample(xb: np.ndarray, num_points: int) -> np.ndarray:
+    if xb.shape[0] <= num_points:
+        return np.ascontiguousarray(xb, dtype=np.float32)
+    rows = np.sort(np.random.RandomState(0).choice(xb.shape[0], num_points, replace=False))
+    return np.ascontiguousarray(xb[rows], dtype=np.float32)
+
+def build_index(xb: np.ndarray, index_config: Optional[Dict[str, Any]] = None) -> faiss.Index:
+    """
+    Build an inner-product FAISS index over normalized vectors.
+
+    Args:
+        xb (np.ndarray): Unit-normalized float32 matrix, e.g. `ChunkStore.vectors`
+        index_config (dict, optional): See `get_index_config`; defaults to `configs["retriever"]`
+
+    Returns:
+        faiss.Index: The populated index
+    """
+    index_config = index_config or get_index_config()
+    spec = get_index_spec(xb.shape[0], xb.shape[1], index_config)
+    index = faiss.index_factory(xb.shape[1], spec, faiss.METRIC_INNER_PRODUCT)
+
+    if spec.startswith("HNSW"):
+        index.hnsw.efConstruction = index_config["hnsw"]["ef_construction"]
+    if not index.is_trained:
+        ivf = faiss.try_extract_index_ivf(index)
+        num_points = (ivf.nlist if ivf is not None else 1) * index_config["ivf"]["max_training_points"]
+        # Quantizers (SQ ranges, PQ codebooks) need a larger sample than the IVF centroids alone
+        if is_quantized(index_config):
+            num_points = max(num_points, 65536)
+        index.train(_training_sample(xb, num_points))
+
+    # Add in blocks so a memory-mapped matrix is never copied in full
+    block_size = 65536
+    for start in range(0, xb.shape[0], block_size):
+        index.add(np.ascontiguousarray(xb[start:start + block_size], dtype=np.float32))
+    logger.info(f"Built {spec} FAISS index over {index.ntotal} vectors")
+    configure_search(index, index_config)
+    return index
+
+def configure_search(index: faiss.Index, index_config: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Apply the search-time parameters (HNSW efSearch, IVF nprobe) to an index.
+
+    Args:
+        index (faiss.Index): A built or loaded index
+        index_config (dict, optional): See `get_index_config`; defaults to `configs["retriever"]`
+    """
+    index_config = index_config or get_index_config()
+    parameter_space = faiss.ParameterSpace()
+    if hasattr(faiss.downcast_index(index), "hnsw"):
+        parameter_space.set_index_parameter(index, "efSearch", index_config["hnsw"]["ef_search"])
+    elif faiss.try_extract_index_ivf(index) is not None:
+        parameter_space.set_index_parameter(index, "nprobe", index_config["ivf"]["nprobe"])
+
+def save_index(index: faiss.Index, index_file: str, source_file: str, spec: Optional[str] = None) -> None:
+    """
+    Serialize a FAISS index together with metadata tying it to its source vectors.
+
+    The metadata records the format version and the checksum of the source
+    file, so an index is never served against different vectors.
+
+    Args:
+        index (faiss.Index): The index to save
+        index_file (str): Where to write the index
+        source_file (str): The vectors file the index was built from
+        spec (str, optional): FAISS factory string the index was built with, see `get_index_spec`
+    """
+    meta_file = get_index_meta_path(index_file)
+    source_stat = os.stat(source_file)
+    meta = {
+        "version": INDEX_FORMAT_VERSION,
+        "source_checksum": file_checksum(source_file),
+        "source_size": source_stat.st_size,
+        "source_mtime_ns": source_stat.st_mtime_ns,
+        "ntotal": int(index.ntotal),
+        "dimensions": int(index.d),
+        "metric": "cosine",
+        "spec": spec,
+    }
+
+    # Write to temporary files first so readers never see a half-written index;
+    # the names are unique so concurrent builds of the same store don't clash
+    suffix = f"tmp-{os.getpid()}-{uuid.uuid4().hex}"
+    tmp_index_file = f"{index_file}.{suffix}"
+    tmp_meta_file = f"{meta_file}.{suffix}"
+    faiss.write_index(index, tmp_index_file)
+    with open(tmp_meta_file, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_index_file, index_file)
+    os.replace(tmp_meta_file, meta_file)
+    logger.info(f"Saved FAISS index with {index.ntotal} vectors to {index_file}")
+
+def _read_index_meta(index_file: str) -> Optional[Dict[str, Any]]:
+    meta_file = get_index_meta_path(index_file)
+    if not os.path.exists(meta_file):
+        return None
+    try:
+        with open(meta_file, "r") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Could not read FAISS index metadata {meta_file}: {e}")
+        return None
+
+def is_index_current(index_file: str, source_file: str) -> bool:
+    """
+    Check whether a persisted index was built from the current source vectors.
+
+    Size and modification time are compared first; the checksum is only
+    recomputed when they differ (e.g. after the files were copied).
+
+    Args:
+        index_file (str): Path of the serialized index
+        source_file (str): Path of the vectors file
+
+    Returns:
+        bool: True if the index exists and matches the source
+    """
+    meta = _read_index_meta(index_file)
+    if not meta or meta.get("version") != INDEX_FORMAT_VERSION:
+        return False
+    if not os.path.exists(index_file):
+        return False
+    try:
+        source_stat = os.stat(source_file)
+    except OSError:
+        return False
+    if source_stat.st_size != meta.get("source_size"):
+        return False
+    if source_stat.st_mtime_ns == meta.get("source_mtime_ns"):
+        return True
+    return file_checksum(source_file) == meta.get("source_checksum")
+
+def load_index(index_file: str, source_file: str, expected_ntotal: Optional[int] = None,
+               expected_spec: Optional[str] = None, mmap: bool = True) -> Optional[faiss.Index]:
+    """
+    Load a persisted FAISS index, memory-mapped when possible.
+
+    Memory-mapped indexes are backed by the OS page cache, so several worker
+    processes serving the same repository share one copy of the vectors.
+    Quantized indexes are small and are better read fully into RAM (`mmap=False`).
+
+    Args:
+        index_file (str): Path of the serialized index
+        source_file (str): Path of the vectors file the index must match
+        expected_ntotal (int, optional): Number of vectors the index must contain
+        expected_spec (str, optional): FAISS factory string the index must have been built with
+        mmap (bool): Whether to memory-map the index file
+
+    Returns:
+        Optional[faiss.Index]: The index, or None if it is missing or stale
+    """
+    if not is_index_current(index_file, source_file):
+        logger.info(f"No current FAISS index found at {index_file}")
+        return None
+    if expected_spec is not None:
+        spec = (_read_index_meta(index_file) or {}).get("spec")
+        if spec != expected_spec:
+            logger.info(f"FAISS index {index_file} was built as {spec}, configuration asks for {expected_spec}")
+            return None
+
+    index = None
+    if mmap:
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            index = faiss.read_index(index_file, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+        except Exception as e:
+            logger.warning(f"Could not memory-map {index_file}, reading it into memory: {e}")
+    if index is None:
+        try:
+            index = faiss.read_index(index_file)
+        except Exception as e:
+            logger.error(f"Error reading FAISS index {index_file}: {e}")
+            return None
+
+    if expected_ntotal is not None and index.ntotal != expected_ntotal:
+        logger.warning(
+            f"FAISS index {index_file} has {index.ntotal} vectors, expected {expected_ntotal}; ignoring it"
+        )
+        return None
+    logger.info(f"Loaded FAISS index with {index.ntotal} vectors from {index_file}")
+    return index
+
+def get_search_parameters(index: faiss.Index, selector: faiss.IDSelector) -> Optional[faiss.SearchParameters]:
+    """
+    Build search parameters that restrict a search to the selected ids.
+
+    Per-search parameters replace the ones set on the index, so the current
+    nprobe / efSearch are carried over.
+
+    Args:
+        index (faiss.Index): The index to search
+        selector (faiss.IDSelector): The ids the search may return
+
+    Returns:
+        faiss.SearchParameters: Parameters of the type the index expects, or None if
+            the index cannot filter by id (flat PQ)
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    downcast = faiss.downcast_index(index)
+    if hasattr(downcast, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=downcast.hnsw.efSearch)
+    if isinstance(downcast, faiss.IndexPQ):
+        return None
+    return faiss.SearchParameters(sel=selector)
+
+class PrebuiltFAISSRetriever(FAISSRetriever):
+    """
+    FAISSRetriever over an index that was built ahead of time, e.g. loaded from disk.
+
+    `vectors` is the full-precision matrix the index was built from (usually memory-mapped).
+    With `rerank` (for quantized indexes), `rerank_factor * top_k` candidates are fetched
+    from the index and re-ranked by exact cosine similarity; only the candidate rows are
+    read from the matrix. Searches restricted by a chunk mask scan the selected rows
+    exactly when there are at most `exact_search_max_chunks` of them, and otherwise pass
+    the mask to FAISS as an id selector.
+    """
+
+    def __init__(self, index: Optional[faiss.Index], top_k: int = 5, documents: Optional[Sequence[Any]] = None,
+                 embedder=None, vectors: Optional[np.ndarray] = None, rerank: bool = False, rerank_factor: int = 4,
+                 exact_search_max_chunks: int = 20000):
+        super().__init__(embedder=embedder, top_k=top_k, metric="prob")
+        self.documents = documents
+        self.vectors = vectors
+        self.rerank = rerank and vectors is not None
+        self.rerank_factor = max(1, rerank_factor)
+        self.exact_search_max_chunks = exact_search_max_chunks
+        if index is not None:
+            self.index = index
+            self.dimensions = index.d
+            self.total_documents = index.ntotal
+            self.indexed = True
+
+    def retrieve_embedding_queries(self, input, top_k: Optional[int] = None, chunk_mask: Optional[np.ndarray] = None):
+        """
+        Search the index with query embeddings.
+
+        Args:
+            input: One embedding or a list of embeddings
+            top_k (int, optional): Number of results per query, defaults to `self.top_k`
+            chunk_mask (np.ndarray, optional): Boolean mask of the chunks that may be returned
+
+        Returns:
+            List[RetrieverOutput]: One output per query
+        """
+        if not self.indexed or self.index.ntotal == 0:
+            raise ValueError("Index is empty. Please set the chunks to build the index from")
+        # The index holds unit vectors; normalize queries too so scores are cosine similarities
+        xq = np.array(input, dtype=np.float32)
+        if xq.ndim == 1:
+            xq = xq.reshape(1, -1)
+        faiss.normalize_L2(xq)
+
+        top_k = top_k or self.top_k
+        params = None
+        if chunk_mask is not None:
+            selected = np.flatnonzero(chunk_mask)
+            if selected.size > self.exact_search_max_chunks or self.vectors is None:
+                # The bitmap must stay referenced until the search has run
+                bitmap = np.packbits(chunk_mask, bitorder="little")
+                selector = faiss.IDSelectorBitmap(chunk_mask.size, faiss.swig_ptr(bitmap))
+                params = get_search_parameters(self.index, selector)
+            if params is None:
+                if self.vectors is None:
+                    raise ValueError("Filtered search over this index type needs the full-precision vectors")
+                D, Ind = self._exact_search(xq, top_k, selected)
+                return self._to_output(D, Ind)
+
+        if self.rerank:
+            D, Ind = self._search_and_rerank(xq, top_k, params)
+        else:
+            D, Ind = self.index.search(xq, top_k, params=params)
+        return self._to_output(D, Ind)
+
+    def _to_output(self, D: np.ndarray, Ind: np.ndarray):
+        if self.metric == "prob":
+            D = self._convert_cosine_similarity_to_probability(D)
+        return self._to_retriever_output(Ind, D)
+
+    def _exact_search(self, xq: np.ndarray, top_k: int, ids: np.ndarray):
+        D = np.full((xq.shape[0], top_k), -1.0, dtype=np.float32)
+        Ind = np.full((xq.shape[0], top_k), -1, dtype=np.int64)
+        if not ids.size:
+            return D, Ind
+        scores = np.asarray(self.vectors[ids], dtype=np.float32) @ xq.T
+        k = min(top_k, ids.size)
+        for row in range(xq.shape[0]):
+            column = scores[:, row]
+            best = np.argpartition(-column, k - 1)[:k]
+            best = best[np.argsort(-column[best], kind="stable")]
+            Ind[row, :k] = ids[best]
+            D[row, :k] = column[best]
+        return D, Ind
+
+    def _search_and_rerank(self, xq: np.ndarray, top_k: int, params: Optional[faiss.SearchParameters] = None):
+        _, candidates = self.index.search(xq, top_k * self.rerank_factor, params=params)
+        D = np.full((xq.shape[0], top_k), -1.0, dtype=np.float32)
+        Ind = np.full((xq.shape[0], top_k), -1, dtype=np.int64)
+        for row, ids in enumerate(candidates):
+            # Sorted ids keep reads from the memory-mapped matrix sequential
+            ids = np.unique(ids[ids >= 0])
+            if not ids.size:
+                continue
+            exact_scores = np.asarray(self.vectors[ids], dtype=np.float32) @ xq[row]
+            best = np.argsort(-exact_scores, kind="stable")[:top_k]
+            Ind[row, :best.size] = ids[best]
+            D[row, :best.size] = exact_scores[best]
+        return D, Ind
+
+def mmr_rerank(query_vector: np.ndarray, candidate_vectors: np.ndarray, top_k: int,
+               lambda_mult: float = 0.7) -> np.ndarray:
+    """
+    Select a relevant but diverse subset of candidates by maximal marginal relevance.
+
+    Relevance to the query and pairwise similarities are computed as one matrix product
+    over the candidates; each greedy step then only updates a vector of each candidate's
+    highest similarity to the already selected ones.
+
+    Args:
+        query_vector (np.ndarray): The query embedding
+        candidate_vectors (np.ndarray): Unit-normalized candidate embeddings, one row per candidate
+        top_k (int): Number of candidates to select
+        lambda_mult (float): Weight of relevance against novelty, between 0 and 1
+
+    Returns:
+        np.ndarray: Positions of the selected candidates, in selection order
+    """
+    candidates = np.asarray(candidate_vectors, dtype=np.float32)
+    num_candidates = candidates.shape[0]
+    top_k = min(top_k, num_candidates)
+    if top_k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    query = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    # Row 0 is the query; the remaining rows and columns are the candidates
+    stacked = np.vstack([query, candidates])
+    similarities = stacked[1:] @ stacked.T
+    relevance = similarities[:, 0]
+    pairwise = similarities[:, 1:]
+
+    selected = np.empty(top_k, dtype=np.int64)
+    max_similarity = np.zeros(num_candidates, dtype=np.float32)
+    available = np.ones(num_candidates, dtype=bool)
+    for step in range(top_k):
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected[step] = best
+        available[best] = False
+        np.maximum(max_similarity, pairwise[best], out=max_similarity)
+    return selected
+
+def quantization_report(xb: np.ndarray, top_k: int = 10, num_queries: int = 200,
+                        index_config: Optional[Dict[str, Any]] = None) -> list:
+    """
+    Measure recall and memory of every quantization setting on a set of vectors.
+
+    Queries are sampled from the vectors themselves; ground truth is exact flat search.
+
+    Args:
+        xb (np.ndarray): Unit-normalized float32 matrix, e.g. `ChunkStore.vectors`
+        top_k (int): Recall is measured at this depth
+        num_queries (int): Number of sampled queries
+        index_config (dict, optional): Base configuration; only the quantization type is varied
+
+    Returns:
+        list: One dict per setting with spec, bytes per vector, index size and recall
+            with and without re-ranking
+    """
+    index_config = index_config or get_index_config()
+    xb = np.ascontiguousarray(xb, dtype=np.float32)
+    rows = np.random.RandomState(1).choice(xb.shape[0], min(num_queries, xb.shape[0]), replace=False)
+    xq = xb[rows]
+    _, truth = build_index(xb, {**index_config, "index_type": "flat",
+                                "quantization": {**index_config["quantization"], "type": "none"}}).search(xq, top_k)
+
+    report = []
+    for quantization_type in QUANTIZATION_TYPES:
+        config = {**index_config, "quantization": {**index_config["quantization"], "type": quantization_type}}
+        index = build_index(xb, config)
+        index_bytes = len(faiss.serialize_index(index))
+        result = {
+            "quantization": quantization_type,
+            "spec": get_index_spec(xb.shape[0], xb.shape[1], config),
+            "bytes_per_vector": round(index_bytes / xb.shape[0], 1),
+            "index_mb": round(index_bytes / 1024 / 1024, 2),
+        }
+        for rerank in (False, True):
+            retriever = PrebuiltFAISSRetriever(
+                index, top_k=top_k, vectors=xb,
+                rerank=rerank and is_quantized(config),
+                rerank_factor=config["quantization"]["rerank_factor"],
+            )
+            outputs = retriever.retrieve_embedding_queries(xq)
+            hits = sum(len(set(out.doc_indices) & set(expected)) for out, expected in zip(outputs, truth.tolist()))
+            result["recall_rerank" if rerank else "recall"] = round(hits / truth.size, 4)
+        report.append(result)
+    return report
+
+if __name__ == "__main__":
+    import argparse
+
+    from api.chunk_store import ChunkStore
+
+    parser = argparse.ArgumentParser(description="Recall vs. memory report for quantized indexes")
+    parser.add_argument("store_dir", help="Chunk store directory, e.g. ~/.adalflow/databases/{repo}.store")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    store = ChunkStore(os.path.expanduser(args.store_dir))
+    print(f"{len(store)} vectors x {store.dimensions} dimensions, recall@{args.top_k}")
+    print(f"{'quantization':<14}{'spec':<22}{'bytes/vec':>10}{'index MB':>10}{'recall':>9}{'reranked':>10}")
+    for row in quantization_report(store.vectors, top_k=args.top_k, num_queries=args.queries):
+        print(f"{row['quantization']:<14}{row['spec']:<22}{row['bytes_per_vector']:>10}"
+              f"{row['index_mb']:>10}{row['recall']:>9}{row['recall_rerank']:>10}")
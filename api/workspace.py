@@ -0,0 +1,359 @@
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+from adalflow.core.types import Document
+from adalflow.utils import get_adalflow_default_root_path
+from pydantic import BaseModel, Field
+
+from api.chunk_filter import ChunkFilter
+from api.config import configs
+from api.context_builder import ContextSpan, merge_retrieved_chunks
+from api.rag import RAG
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+WORKSPACE_DIR = os.path.join(get_adalflow_default_root_path(), "workspaces")
+
+_WORKSPACE_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$")
+
+class WorkspaceRepo(BaseModel):
+    """
+    Model for one repository of a workspace.
+    """
+    repo_url: str = Field(..., description="URL or local path of the repository")
+    type: str = Field("github", description="Type of repository (e.g., 'github', 'gitlab', 'bitbucket', 'local')")
+
+class Workspace(BaseModel):
+    """
+    Model for a saved set of repositories that are searched together.
+    """
+    name: str = Field(..., description="Workspace name; letters, digits, '.', '_' and '-'")
+    description: Optional[str] = Field(None, description="Optional description")
+    repos: List[WorkspaceRepo] = Field(..., description="Repositories of the workspace")
+
+def _get_workspace_path(name: str) -> str:
+    if not _WORKSPACE_NAME_PATTERN.match(name or ""):
+        raise ValueError(f"Invalid workspace name: {name!r}")
+    return os.path.join(WORKSPACE_DIR, f"{name}.json")
+
+def list_workspaces() -> List[Workspace]:
+    """
+    List the saved workspaces, sorted by name.
+    """
+    if not os.path.isdir(WORKSPACE_DIR):
+        return []
+    workspaces = []
+    for filename in sorted(os.listdir(WORKSPACE_DIR)):
+        if not filename.endswith(".json"):
+            continue
+        workspace = get_workspace(filename[:-len(".json")])
+        if workspace is not None:
+            workspaces.append(workspace)
+    return workspaces
+
+def get_workspace(name: str) -> Optional[Workspace]:
+    """
+    Load a saved workspace.
+
+    Args:
+        name (str): The workspace name
+
+    Returns:
+        Workspace: The workspace, or None if it does not exist or cannot be read
+    """
+    path = _get_workspace_path(name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return Workspace(**json.load(f))
+    except Exception as e:
+        logger.error(f"Error reading workspace {path}: {e}")
+        return None
+
+def save_workspace(workspace: Workspace) -> None:
+    """
+    Save a workspace, replacing any workspace with the same name.
+
+    Access tokens are not part of a workspace; they are passed with each request.
+    """
+    path = _get_workspace_path(workspace.name)
+    os.makedirs(WORKSPACE_DIR, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(workspace.model_dump(), f, indent=2)
+    os.replace(tmp_path, path)
+    logger.info(f"Saved workspace {workspace.name} with {len(workspace.repos)} repositories")
+
+def delete_workspace(name: str) -> bool:
+    """
+    Delete a saved workspace.
+
+    Returns:
+        bool: True if the workspace existed
+    """
+    path = _get_workspace_path(name)
+    if not os.path.exists(path):
+        return False
+    os.remove(path)
+    logger.info(f"Deleted workspace {name}")
+    return True
+
+def resolve_repos(repo_url: Optional[str] = None, repo_type: str = "github", repo_urls: Optional[Sequence[str]] = None,
+                  workspace: Optional[str] = None) -> List[WorkspaceRepo]:
+    """
+    Collect the repositories named by a request, without duplicates.
+
+    Args:
+        repo_url (str, optional): The request's main repository, listed first
+        repo_type (str): Type of `repo_url` and of the `repo_urls` entries
+        repo_urls (Sequence[str], optional): Additional repositories
+        workspace (str, optional): Name of a saved workspace whose repositories are added
+
+    Returns:
+        List[WorkspaceRepo]: The repositories, in request order
+
+    Raises:
+        ValueError: If the workspace does not exist or too many repositories are named
+    """
+    repos = [WorkspaceRepo(repo_url=url, type=repo_type) for url in [repo_url, *(repo_urls or [])] if url]
+    if workspace:
+        saved = get_workspace(workspace)
+        if saved is None:
+            raise ValueError(f"Workspace not found: {workspace}")
+        repos.extend(saved.repos)
+
+    unique = {}
+    for repo in repos:
+        unique.setdefault(repo.repo_url.rstrip("/"), repo)
+    unique = list(unique.values())
+    max_repos = configs.get("federation", {}).get("max_repos", 16)
+    if len(unique) > max_repos:
+        raise ValueError(f"Too many repositories in one request: {len(unique)} > {max_repos}")
+    return unique
+
+def get_repo_label(repo_url: str) -> str:
+    """
+    Short name of a repository used to prefix its file paths, e.g. "owner/repo".
+    """
+    path = repo_url.rstrip("/")
+    if path.endswith(".git"):
+        path = path[:-len(".git")]
+    if "://" in path:
+        return "/".join(path.split("://", 1)[1].split("/")[1:][-2:]) or path
+    return os.path.basename(path) or path
+
+@dataclass
+class FederatedHit:
+    """
+    One chunk retrieved by a federated search.
+
+    Attributes:
+        repo_url: Repository the chunk belongs to
+        doc_index: Index of the chunk in that repository's chunk store
+        score: Score after per-repository normalization, comparable across repositories
+        raw_score: Score reported by the repository's own retriever
+        document: The chunk
+    """
+    repo_url: str
+    doc_index: int
+    score: float
+    raw_score: Optional[float]
+    document: Document
+
+def normalize_scores(scores: Sequence[float], mode: str) -> List[float]:
+    """
+    Map one repository's retrieval scores onto a scale shared by all repositories.
+
+    Vector scores are cosine similarities of the same embedder and hybrid scores are
+    rank-based fusion scores, so both already compare across indexes. BM25 scores
+    depend on each corpus' term statistics and are divided by the repository's best
+    score instead.
+
+    Args:
+        scores (Sequence[float]): Scores of one query against one repository, best first
+        mode (str): Retrieval mode that produced the scores
+
+    Returns:
+        List[float]: The normalized scores
+    """
+    scores = [float(score) for score in scores]
+    if mode == "lexical" and scores and scores[0] > 0:
+        return [score / scores[0] for score in scores]
+    return scores
+
+_federation_config = configs.get("federation", {})
+
+# Shared by all requests; each task searches one repository's index
+_executor = ThreadPoolExecutor(
+    max_workers=_federation_config.get("max_workers", 8),
+    thread_name_prefix="federated-retrieval",
+)
+
+class FederatedRetriever:
+    """
+    Searches the indexes of several repositories for the same queries and merges the results.
+
+    Each repository keeps its own chunk store and indexes, prepared, cached and rebuilt
+    exactly as for a single-repository request; only the ranked results are combined.
+    """
+
+    def __init__(self, provider: str = "google", model: Optional[str] = None):
+        """
+        Args:
+            provider (str): Model provider; decides the embedder, which must be the same for all repositories
+            model (str, optional): Model name for the provider
+        """
+        self.provider = provider
+        self.model = model
+        self.rags: Dict[str, RAG] = {}
+        # Stage durations of the last `retrieve_batch`, in milliseconds, per repository
+        self.timings: Dict[str, float] = {}
+
+    def prepare(self, repos: Sequence[WorkspaceRepo], access_token: Optional[str] = None,
+                chunk_filter: Optional[ChunkFilter] = None, token_type: Optional[str] = None,
+                prepared: Optional[Dict[str, RAG]] = None) -> None:
+        """
+        Prepare the retriever of every repository concurrently.
+
+        Repositories that fail to prepare are logged and left out of the search.
+
+        Args:
+            repos (Sequence[WorkspaceRepo]): The repositories
+            access_token (str, optional): Token for private repositories
+            chunk_filter (ChunkFilter, optional): Filter applied in every repository
+            token_type (str, optional): Only repositories of this type receive `access_token`;
+                all do if None
+            prepared (Dict[str, RAG], optional): Already prepared RAGs by repository URL,
+                e.g. the request's own repository, used as they are
+
+        Raises:
+            ValueError: If no repository could be prepared
+        """
+        def prepare_one(repo: WorkspaceRepo) -> RAG:
+            rag = RAG(provider=self.provider, model=self.model)
+            token = access_token if token_type is None or repo.type == token_type else None
+            rag.prepare_retriever(repo.repo_url, repo.type, token, chunk_filter=chunk_filter)
+            return rag
+
+        prepared = prepared or {}
+        futures = {
+            repo.repo_url: _executor.submit(prepare_one, repo)
+            for repo in repos if repo.repo_url not in prepared
+        }
+        self.rags = {}
+        errors = []
+        for repo in repos:
+            if repo.repo_url in prepared:
+                self.rags[repo.repo_url] = prepared[repo.repo_url]
+                continue
+            repo_url, future = repo.repo_url, futures[repo.repo_url]
+            try:
+                self.rags[repo_url] = future.result()
+            except Exception as e:
+                logger.error(f"Error preparing retriever for {repo_url}: {e}")
+                errors.append(f"{repo_url}: {e}")
+        if not self.rags:
+            raise ValueError(f"No repository could be prepared: {'; '.join(errors)}")
+        logger.info(f"Prepared federated retrieval over {len(self.rags)} of {len(repos)} repositories")
+
+    def retrieve_batch(self, queries: List[str], top_k: Optional[int] = None,
+                       chunk_filter: Optional[ChunkFilter] = None) -> List[List[FederatedHit]]:
+        """
+        Search every prepared repository concurrently and merge the rankings.
+
+        Args:
+            queries (List[str]): The query texts
+            top_k (int, optional): Number of chunks per repository and of the merged list,
+                defaults to `retriever.top_k`
+            chunk_filter (ChunkFilter, optional): Overrides the filter given to `prepare`
+
+        Returns:
+            List[List[FederatedHit]]: One merged ranking per query, best first
+        """
+        self.timings = {}
+        if not queries or not self.rags:
+            return [[] for _ in queries]
+        top_k = top_k or configs["retriever"]["top_k"]
+        rags = list(self.rags.items())
+        mode = rags[0][1].lexical_config["mode"]
+
+        if mode != "lexical":
+            # All repositories share the embedder; embed once so the searches hit the query cache
+            start = time.perf_counter()
+            try:
+                rags[0][1].embed_queries(queries)
+            except Exception as e:
+                if mode == "vector":
+                    raise
+                logger.warning(f"Query embedding failed, repositories fall back to lexical results: {e}")
+            self.timings["embed"] = (time.perf_counter() - start) * 1000
+
+        futures = [
+            (repo_url, rag, _executor.submit(rag.batch_call, queries, top_k, chunk_filter))
+            for repo_url, rag in rags
+        ]
+        merged: List[List[FederatedHit]] = [[] for _ in queries]
+        for repo_url, rag, future in futures:
+            try:
+                outputs = future.result()
+            except Exception as e:
+                logger.error(f"Error retrieving from {repo_url}: {e}")
+                continue
+            # Server-Timing metric names are tokens, so the label is reduced to safe characters
+            timing_prefix = re.sub(r"[^\w.-]", "_", get_repo_label(repo_url))
+            for stage, duration in rag.timings.items():
+                self.timings[f"{timing_prefix}.{stage}"] = duration
+            for hits, output in zip(merged, outputs):
+                raw_scores = output.doc_scores or [0.0] * len(output.doc_indices)
+                for doc_index, document, score, raw_score in zip(
+                    output.doc_indices, output.documents, normalize_scores(raw_scores, mode), raw_scores
+                ):
+                    hits.append(FederatedHit(repo_url, int(doc_index), score, float(raw_score), document))
+
+        # A stable sort keeps request order between equal scores
+        return [sorted(hits, key=lambda hit: hit.score, reverse=True)[:top_k] for hits in merged]
+
+    def build_context_spans(self, hits: Sequence[FederatedHit]) -> List[ContextSpan]:
+        """
+        Merge the chunks of a federated ranking into spans, per repository and file.
+
+        File paths are prefixed with the repository label so files of the same name
+        in different repositories stay apart.
+
+        Args:
+            hits (Sequence[FederatedHit]): A merged ranking from `retrieve_batch`
+
+        Returns:
+            List[ContextSpan]: The spans, best first
+        """
+        by_repo: Dict[str, List[FederatedHit]] = {}
+        for hit in hits:
+            by_repo.setdefault(hit.repo_url, []).append(hit)
+
+        labels = {}
+        for repo_url in by_repo:
+            label = get_repo_label(repo_url)
+            labels[repo_url] = label if label not in labels.values() else repo_url
+
+        spans = []
+        for repo_url, repo_hits in by_repo.items():
+            for span in merge_retrieved_chunks(
+                self.rags[repo_url].transformed_docs,
+                [hit.doc_index for hit in repo_hits],
+                [hit.score for hit in repo_hits],
+            ):
+                span.file_path = f"{labels[repo_url]}/{span.file_path}"
+                spans.append(span)
+
+        spans.sort(key=lambda span: span.score if span.score is not None else float("-inf"), reverse=True)
+        for rank, span in enumerate(spans):
+            span.rank = rank
+        return spans